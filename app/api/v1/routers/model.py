@@ -3,46 +3,37 @@
 from fastapi import Header, HTTPException, APIRouter
 from uuid import UUID
 from http import HTTPStatus
-from app.services.constant import DanceName, AZURE_PUBLIC_STORAGE_CONTAINER_NAME, AZURE_PUBLIC_CONNECTION_STRING, BACKGROUND_DIR, CHARACTER_DIR, RESULT_DIR, MODEL_SOURCE_DIR, MODEL_RESULT_DIR
-from app.services.blob import AzureBlobService
-from app.services.run_model import delete_tmp_result_files, delete_tmp_source_files, image_to_animation
+from app.services.model_job import model_job_manager
 
 router = APIRouter(tags=["model"])
 
 
-@router.post("/api/model", summary="Run the model using the saved background and character images")
+@router.post("/api/model", status_code=HTTPStatus.ACCEPTED, summary="Queue a model run using the saved background and character images")
 async def handle_model_request(x_cd_user_id: str = Header(...)):
     try:
         user_uuid = UUID(x_cd_user_id)
     except ValueError:
         raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Invalid UUID format for the user ID")
-    
-    user_uuid = str(user_uuid)
-
-    PrivateBlobService = AzureBlobService()
-
-    try:
-        PrivateBlobService.get_result_image(save_path=f"{MODEL_SOURCE_DIR}/{BACKGROUND_DIR}/{user_uuid}.png", blob_name=f"{BACKGROUND_DIR}/{user_uuid}.png")
-        PrivateBlobService.get_result_image(save_path=f"{MODEL_SOURCE_DIR}/{CHARACTER_DIR}/{user_uuid}.png", blob_name=f"{CHARACTER_DIR}/{user_uuid}.png")
-    except Exception as e:
-        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"Error downloading images from Blob: {str(e)}")
 
-    PublicBlobService = AzureBlobService(container_name=AZURE_PUBLIC_STORAGE_CONTAINER_NAME, connecting_string=AZURE_PUBLIC_CONNECTION_STRING)
+    user_uuid = str(user_uuid)
 
     try:
-        for dance_name in DanceName:
-            image_to_animation(
-                user_uuid=user_uuid,
-                dance_name=dance_name,
-            )
-            PublicBlobService.upload_file(file_path=f"{MODEL_RESULT_DIR}/{user_uuid}/video.gif", blob_name=f"{RESULT_DIR}/{dance_name.value}/{user_uuid}.gif")
-            PublicBlobService.upload_file(file_path=f"{MODEL_RESULT_DIR}/{user_uuid}/video.mp4", blob_name=f"{RESULT_DIR}/{dance_name.value}/{user_uuid}.mp4")
-            delete_tmp_result_files(user_uuid=user_uuid)
-        delete_tmp_source_files(user_uuid=user_uuid)
-    except Exception as e:
-        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"Error processing model - dance_name={dance_name}: {str(e)}")
+        job = model_job_manager.submit(user_uuid=user_uuid)
+    except RuntimeError as e:
+        raise HTTPException(status_code=HTTPStatus.CONFLICT, detail=str(e))
 
     return {
-        "message": "Model has been executed successfully.",
-        "user_id": str(user_uuid),
+        "message": "Model job has been queued.",
+        "user_id": user_uuid,
+        "job_id": job["job_id"],
+        "status": job["status"],
     }
+
+
+@router.get("/api/model/{job_id}", summary="Get the status, per-dance progress and result URLs of a model job")
+async def get_model_job(job_id: str):
+    job = model_job_manager.get(job_id=job_id)
+    if job is None:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=f"Model job not found - job_id={job_id}")
+
+    return job
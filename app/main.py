@@ -1,12 +1,19 @@
 """Entry point for the FastAPI application."""
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import JSONResponse
 from app.api.v1.routers import background, character, model
 from app.constant import FRONT_END_IP, FRONT_END_PORT
+from app.services.model_job import model_job_manager
 
-app = FastAPI(title="MotionCanvas", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    model_job_manager.shutdown()
+
+app = FastAPI(title="MotionCanvas", version="1.0.0", lifespan=lifespan)
 
 app.include_router(background.router)
 app.include_router(character.router)
@@ -30,10 +30,11 @@ class Config():
         self.scene: SceneConfig = SceneConfig({**base_cfg['scene'], **user_cfg['scene']})
         self.controller: ControllerConfig = ControllerConfig({**base_cfg['controller'], **user_cfg['controller']})
 
-        # cannot use an interactive controller with a headless mesa viewer
+        # cannot use an interactive controller with a headless viewer
         if self.controller.mode == 'interact':
             try:
                 assert self.view.use_mesa is False, 'cannot use interactive controller when USE_MESA is True'
+                assert self.view.use_software_renderer is False, 'cannot use interactive controller when USE_SOFTWARE_RENDERER is True'
             except AssertionError as e:
                 msg = f'Config error: {e}'
                 logging.critical(msg)
@@ -49,7 +50,7 @@ class Config():
                 assert False, msg
 
         # output video codec must be set for render controller with .mp4 output filetype
-        if self.controller.mode == 'video_render' and self.controller.output_video_path is not None and self.controller.output_video_path.endswith('.mp4'):
+        if self.controller.mode == 'video_render' and any(path.endswith('.mp4') for path in self.controller.output_video_paths):
             try:
                 assert self.controller.output_video_codec is not None, 'output_video_codec must be set when using video_render controller'
             except AssertionError as e:
@@ -60,7 +61,13 @@ class Config():
 
 class SceneConfig():
 
-    def __init__(self, scene_cfg: dict) -> None:
+    class MeshLODDict(TypedDict):
+        name: str
+        grid_spacing: Optional[float]
+        contour_tolerance: float
+        max_vertices: Optional[int]
+
+    def __init__(self, scene_cfg: dict) -> None:  # noqa: C901
 
         # show or hide the floor
         try:
@@ -80,9 +87,82 @@ class SceneConfig():
             logging.critical(msg)
             assert False, msg
 
+        # directory used to cache expensive, reusable preprocessing results. Caching is disabled if None
+        try:
+            self.cache_dir: Optional[Path] = scene_cfg['CACHE_DIR']
+            assert isinstance(self.cache_dir, (NoneType, str)), 'type not NoneType or str'
+            if self.cache_dir is not None:
+                self.cache_dir = Path(self.cache_dir)
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in CACHE_DIR config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # directory used to cache each character's preprocessing results (its mask, texture, mesh and ARAP matrices). If None, {CACHE_DIR}/character is used
+        try:
+            self.character_cache_dir: Optional[Path] = scene_cfg['CHARACTER_CACHE_DIR']
+            assert isinstance(self.character_cache_dir, (NoneType, str)), 'type not NoneType or str'
+            if self.character_cache_dir is not None:
+                self.character_cache_dir = Path(self.character_cache_dir)
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in CHARACTER_CACHE_DIR config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # solve the mesh deformation of every frame up front, before rendering starts, instead of once per update
+        try:
+            self.precompute_arap: bool = scene_cfg['PRECOMPUTE_ARAP']
+            assert isinstance(self.precompute_arap, bool), 'is not bool'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in PRECOMPUTE_ARAP config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # level of detail tiers controlling how densely character meshes are built
+        try:
+            self.mesh_lod_tiers: Dict[str, SceneConfig.MeshLODDict] = {}
+            tier_name: str
+            tier: Dict[str, Union[None, int, float]]
+            for tier_name, tier in scene_cfg['MESH_LOD_TIERS'].items():
+                grid_spacing = tier['GRID_SPACING']
+                assert isinstance(grid_spacing, (NoneType, int, float)), f'{tier_name} GRID_SPACING type not NoneType, int or float'
+                assert grid_spacing is None or grid_spacing > 0, f'{tier_name} GRID_SPACING must be > 0'
+
+                contour_tolerance = tier['CONTOUR_TOLERANCE']
+                assert isinstance(contour_tolerance, (int, float)), f'{tier_name} CONTOUR_TOLERANCE type not int or float'
+                assert contour_tolerance >= 0, f'{tier_name} CONTOUR_TOLERANCE must be >= 0'
+
+                max_vertices = tier['MAX_VERTICES']
+                assert isinstance(max_vertices, (NoneType, int)), f'{tier_name} MAX_VERTICES type not NoneType or int'
+                assert max_vertices is None or max_vertices > 0, f'{tier_name} MAX_VERTICES must be > 0'
+
+                self.mesh_lod_tiers[tier_name] = {
+                    'name': tier_name,
+                    'grid_spacing': None if grid_spacing is None else float(grid_spacing),
+                    'contour_tolerance': float(contour_tolerance),
+                    'max_vertices': max_vertices,
+                }
+        except (AssertionError, ValueError, KeyError, AttributeError) as e:
+            msg = f'Error in MESH_LOD_TIERS config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # the level of detail tier used for characters that don't specify their own
+        try:
+            self.mesh_lod: str = scene_cfg['MESH_LOD']
+            assert isinstance(self.mesh_lod, str), 'type not str'
+            assert self.mesh_lod in self.mesh_lod_tiers, f'{self.mesh_lod} not found in MESH_LOD_TIERS'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in MESH_LOD config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
         # config files for characters, driving motions, and retargeting
         self.animated_characters: List[Tuple[CharacterConfig, RetargetConfig, MotionConfig]] = []
 
+        # level of detail tier of each character, in the same order. May be overridden with a 'mesh_lod' key in the character's entry
+        self.animated_character_mesh_lods: List[SceneConfig.MeshLODDict] = []
+
         each: Dict[str, str]
         for each in scene_cfg['ANIMATED_CHARACTERS']:
             char_cfg_fn: str = each['character_cfg']
@@ -94,6 +174,16 @@ class SceneConfig():
                 MotionConfig(motion_cfg_fn)
             ))
 
+            try:
+                mesh_lod: str = each.get('mesh_lod', self.mesh_lod)
+                assert isinstance(mesh_lod, str), 'type not str'
+                assert mesh_lod in self.mesh_lod_tiers, f'{mesh_lod} not found in MESH_LOD_TIERS'
+            except AssertionError as e:
+                msg = f'Error in mesh_lod of character {char_cfg_fn}: {e}'
+                logging.critical(msg)
+                assert False, msg
+            self.animated_character_mesh_lods.append(self.mesh_lod_tiers[mesh_lod])
+
 
 class ViewConfig():
 
@@ -133,6 +223,15 @@ class ViewConfig():
             logging.critical(msg)
             assert False, msg
 
+        # set whether the output should take the size of the background image, with the scene drawn at WINDOW_DIMENSIONS in its center
+        try:
+            self.fit_window_to_background: bool = view_cfg['FIT_WINDOW_TO_BACKGROUND']
+            assert isinstance(self.fit_window_to_background, bool), 'value is not bool type'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in FIT_WINDOW_TO_BACKGROUND config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
         # set whether we want the character rigs to be visible
         try:
             self.draw_ad_rig: bool = view_cfg['DRAW_AD_RIG']
@@ -178,6 +277,15 @@ class ViewConfig():
             logging.critical(msg)
             assert False, msg
 
+        # set whether we want to rasterize the scene on the CPU with NumPy instead of OpenGL (headless, without OSMesa)
+        try:
+            self.use_software_renderer: bool = view_cfg['USE_SOFTWARE_RENDERER']
+            assert isinstance(self.use_software_renderer, bool), 'value is not bool type'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in USE_SOFTWARE_RENDERER config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
         # set the position of the view camera
         try:
             self.camera_pos: list[Union[float, int]] = view_cfg['CAMERA_POS']
@@ -225,12 +333,19 @@ class ControllerConfig():
             logging.critical(msg)
             assert False, msg
 
-        # set output video path (only use in video_render mode)
+        # set output video path (only use in video_render mode). A list of paths writes each video from the same rendered frames.
         try:
-            self.output_video_path: Union[None, str] = controller_cfg['OUTPUT_VIDEO_PATH']
-            assert isinstance(self.output_video_path, (NoneType, str)), 'type is not None or str'
+            self.output_video_path: Union[None, str, List[str]] = controller_cfg['OUTPUT_VIDEO_PATH']
+            assert isinstance(self.output_video_path, (NoneType, str, list)), 'type is not None, str or list'
+            self.output_video_paths: List[str] = []
             if isinstance(self.output_video_path, str):
-                assert Path(self.output_video_path).suffix in ('.gif', '.mp4'), 'output video extension not .gif or .mp4 '
+                self.output_video_paths = [self.output_video_path]
+            elif isinstance(self.output_video_path, list):
+                assert len(self.output_video_path) > 0, 'list is empty'
+                self.output_video_paths = self.output_video_path
+            for path in self.output_video_paths:
+                assert isinstance(path, str), f'{path} is not str'
+                assert Path(path).suffix in ('.gif', '.mp4'), 'output video extension not .gif or .mp4 '
         except (AssertionError, ValueError) as e:
             msg = f'Error in OUTPUT_VIDEO_PATH config parameter: {e}'
             logging.critical(msg)
@@ -245,6 +360,74 @@ class ControllerConfig():
             logging.critical(msg)
             assert False, msg
 
+        # set the backend used to encode .mp4 videos (only use in video_render mode with .mp4)
+        try:
+            self.output_video_backend: str = controller_cfg['OUTPUT_VIDEO_BACKEND']
+            assert isinstance(self.output_video_backend, str), 'type is not str'
+            assert self.output_video_backend in ('opencv', 'ffmpeg'), 'backend not opencv or ffmpeg'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in OUTPUT_VIDEO_BACKEND config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # set the ffmpeg encoder (only use with the ffmpeg backend)
+        try:
+            self.ffmpeg_codec: str = controller_cfg['FFMPEG_CODEC']
+            assert isinstance(self.ffmpeg_codec, str), 'type is not str'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in FFMPEG_CODEC config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # set the ffmpeg encoder preset, omitted if None (only use with the ffmpeg backend)
+        try:
+            self.ffmpeg_preset: Union[None, str] = controller_cfg['FFMPEG_PRESET']
+            assert isinstance(self.ffmpeg_preset, (NoneType, str)), 'type is not None or str'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in FFMPEG_PRESET config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # set the ffmpeg constant rate factor, omitted if None (only use with the ffmpeg backend)
+        try:
+            self.ffmpeg_crf: Union[None, int] = controller_cfg['FFMPEG_CRF']
+            assert isinstance(self.ffmpeg_crf, (NoneType, int)), 'type is not None or int'
+            if isinstance(self.ffmpeg_crf, int):
+                assert self.ffmpeg_crf >= 0, 'must be >= 0'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in FFMPEG_CRF config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # set the pixel format of the encoded video (only use with the ffmpeg backend)
+        try:
+            self.ffmpeg_pix_fmt: str = controller_cfg['FFMPEG_PIX_FMT']
+            assert isinstance(self.ffmpeg_pix_fmt, str), 'type is not str'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in FFMPEG_PIX_FMT config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # set the number of pixel pack buffers frames are read back through. 0 reads each frame synchronously
+        try:
+            self.readback_pbo_count: int = controller_cfg['READBACK_PBO_COUNT']
+            assert isinstance(self.readback_pbo_count, int), 'type is not int'
+            assert self.readback_pbo_count >= 0, 'must be >= 0'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in READBACK_PBO_COUNT config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
+        # set the number of frames that may wait for the video writer thread. 0 writes each frame on the render thread
+        try:
+            self.writer_queue_size: int = controller_cfg['WRITER_QUEUE_SIZE']
+            assert isinstance(self.writer_queue_size, int), 'type is not int'
+            assert self.writer_queue_size >= 0, 'must be >= 0'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in WRITER_QUEUE_SIZE config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
 
 class CharacterConfig():
 
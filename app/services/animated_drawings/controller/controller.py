@@ -73,19 +73,26 @@ class Controller():
     def _cleanup_after_run_loop(self) -> None:
         """Subclass and add anything necessary to do after run loop has finished. """
 
+    def _cleanup_after_run_loop_error(self) -> None:
+        """Subclass and release anything the run loop holds (threads, subprocesses) if it, or the cleanup after it, raises. The error is raised again afterwards. """
+
     def run(self) -> None:
         """ The run loop. Subclassed controllers should overload and define functionality for each step in this function."""
 
         self._prep_for_run_loop()
-        while not self._is_run_over():
-            self._start_run_loop_iteration()
-            self._update()
-            self._render()
-            self._tick()
-            self._handle_user_input()
-            self._finish_run_loop_iteration()
-
-        self._cleanup_after_run_loop()
+        try:
+            while not self._is_run_over():
+                self._start_run_loop_iteration()
+                self._update()
+                self._render()
+                self._tick()
+                self._handle_user_input()
+                self._finish_run_loop_iteration()
+
+            self._cleanup_after_run_loop()
+        except BaseException:
+            self._cleanup_after_run_loop_error()
+            raise
 
     @staticmethod
     def create_controller(controller_cfg: ControllerConfig, scene: Scene, view: View) -> Controller:
@@ -6,20 +6,28 @@
 
 from __future__ import annotations
 import time
+import ctypes
 import logging
-from typing import List
+import queue
+import shutil
+import subprocess
+import threading
+from collections import deque
+from typing import Deque, Iterator, List, Optional, Tuple, Union
 from pathlib import Path
 from abc import abstractmethod
 import numpy as np
 import numpy.typing as npt
 import cv2
 from OpenGL import GL
+from OpenGL.GL.MESA import pack_invert
 from tqdm import tqdm
 
 from app.services.animated_drawings.controller.controller import Controller
 from app.services.animated_drawings.model.scene import Scene
 from app.services.animated_drawings.model.animated_drawing import AnimatedDrawing
 from app.services.animated_drawings.view.view import View
+from app.services.animated_drawings.view.software_view import SoftwareView
 from app.services.animated_drawings.config import ControllerConfig
 
 NoneType = type(None)  # for type checking below
@@ -28,16 +36,18 @@ NoneType = type(None)  # for type checking below
 class VideoRenderController(Controller):
     """ Video Render Controller is used to non-interactively generate a video file """
 
-    def __init__(self, cfg: ControllerConfig, scene: Scene, view: View) -> None:
+    def __init__(self, cfg: ControllerConfig, scene: Scene, view: View, release_view: bool = True) -> None:
         super().__init__(cfg, scene)
 
         self.view: View = view
 
+        self.release_view: bool = release_view  # if False, the view is left alive to render further scenes
+
         self.scene: Scene = scene
 
         self.frames_left_to_render: int  # when this becomes zero, stop rendering
         self.delta_t: float              # amount of time to progress scene between renders
-        self._set_frames_left_to_render_and_delta_t()
+        self.frames_left_to_render, self.delta_t = get_frames_to_render_and_delta_t(self.scene)
 
         self.render_start_time: float  # track when we started to render frames (for performance stats)
         self.frames_rendered: int = 0  # track how many frames we've rendered
@@ -48,31 +58,19 @@ class VideoRenderController(Controller):
 
         self.video_writer: VideoWriter = VideoWriter.create_video_writer(self)
 
-        self.frame_data = np.empty([self.video_height, self.video_width, 4], dtype='uint8')  # 4 for RGBA
-
-        self.progress_bar = tqdm(total=self.frames_left_to_render)
-
-    def _set_frames_left_to_render_and_delta_t(self) -> None:
-        """
-        Based upon the animated drawings within the scene, computes maximum number of frames in a BVH.
-        Checks that all frame times within BVHs are equal, logs a warning if not.
-        Uses results to determine number of frames and frame time for output video.
-        """
+        # the video writer may have started an ffmpeg subprocess, which must not outlive a failure to create the rest of the controller
+        try:
+            self.frame_reader: FrameReader = FrameReader.create_frame_reader(self)
 
-        max_frames = 0
-        frame_time: List[float] = []
-        for child in self.scene.get_children():
-            if not isinstance(child, AnimatedDrawing):
-                continue
-            max_frames = max(max_frames, child.retargeter.bvh.frame_max_num)
-            frame_time.append(child.retargeter.bvh.frame_time)
+            # if specified, frames are written on a separate thread, overlapping encoding with rendering of the following frames
+            self.frame_writer_thread: Optional[FrameWriterThread] = None
+            if self.cfg.writer_queue_size > 0:
+                self.frame_writer_thread = FrameWriterThread(self.video_writer, self.frame_reader, self.cfg.writer_queue_size)
+        except BaseException:
+            self.video_writer.abort()
+            raise
 
-        if not all(x == frame_time[0] for x in frame_time):
-            msg = f'frame time of BVH files don\'t match. Using first value: {frame_time[0]}'
-            logging.warning(msg)
-
-        self.frames_left_to_render = max_frames
-        self.delta_t = frame_time[0]
+        self.progress_bar = tqdm(total=self.frames_left_to_render)
 
     def _prep_for_run_loop(self) -> None:
         self.run_loop_start_time = time.time()
@@ -96,24 +94,443 @@ class VideoRenderController(Controller):
         """ ignore all user input when rendering video file """
 
     def _finish_run_loop_iteration(self) -> None:
-        # get pixel values from the frame buffer, send them to the video writer
-        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, 0)
-        GL.glReadPixels(0, 0, self.video_width, self.video_height, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, self.frame_data)
-        self.video_writer.process_frame(self.frame_data[::-1, :, :].copy())
+        # get pixel values from the frame buffer, send the frames whose readback has finished to the video writer
+        for slot_id in self.frame_reader.read_frame():
+            self._write_frame(slot_id)
 
         # update our counts and progress_bar
         self.frames_left_to_render -= 1
         self.frames_rendered += 1
         self.progress_bar.update(1)
 
+    def _write_frame(self, slot_id: int) -> None:
+        """ Send the frame in the frame reader's slot to the video writer, then hand the slot back to the frame reader. """
+        if self.frame_writer_thread is not None:
+            self.frame_writer_thread.put(slot_id)
+            return
+        try:
+            self.video_writer.process_frame(self.frame_reader.get_frame(slot_id))
+        finally:
+            self.frame_reader.release_frame(slot_id)
+
     def _cleanup_after_run_loop(self) -> None:
-        logging.info(f'Rendered {self.frames_rendered} frames in {time.time()-self.run_loop_start_time} seconds.')
-        self.view.cleanup()
+        # write the frames still being read back
+        for slot_id in self.frame_reader.flush():
+            self._write_frame(slot_id)
+        self.frame_reader.cleanup()
+
+        mesh_lods = [f'{child.mesh_lod["name"]} ({len(child.mesh["vertices"])} vertices)' for child in self.scene.get_children() if isinstance(child, AnimatedDrawing)]
+        logging.info(f'Rendered {self.frames_rendered} frames in {time.time()-self.run_loop_start_time} seconds. Mesh level of detail: {", ".join(mesh_lods)}')
+        _log_gl_call_counts(self.view)
+        self.progress_bar.close()
 
         _time = time.time()
+        if self.frame_writer_thread is not None:
+            self.frame_writer_thread.join()
         self.video_writer.cleanup()
         logging.info(f'Wrote video to file in in {time.time()-_time} seconds.')
 
+        if self.release_view:
+            self.view.cleanup()
+
+    def _cleanup_after_run_loop_error(self) -> None:
+        _abort_video_render(self)
+
+
+def get_frames_to_render_and_delta_t(scene: Scene) -> Tuple[int, float]:
+    """
+    Based upon the animated drawings within the scene, computes maximum number of frames in a BVH.
+    Checks that all frame times within BVHs are equal, logs a warning if not.
+    Returns the number of frames and frame time for output video.
+    """
+
+    max_frames = 0
+    frame_time: List[float] = []
+    for child in scene.get_children():
+        if not isinstance(child, AnimatedDrawing):
+            continue
+        max_frames = max(max_frames, child.retargeter.frame_max_num)
+        frame_time.append(child.retargeter.frame_time)
+
+    if not all(x == frame_time[0] for x in frame_time):
+        msg = f'frame time of BVH files don\'t match. Using first value: {frame_time[0]}'
+        logging.warning(msg)
+
+    return max_frames, frame_time[0]
+
+
+def _log_gl_call_counts(view: View) -> None:
+    gl_call_counts = view.get_gl_call_counts()
+    if gl_call_counts:
+        logging.info(f'OpenGL calls per frame: {", ".join(f"{name}: {count:.1f}" for name, count in gl_call_counts.items())}')
+
+
+def _abort_video_render(controller: Union[VideoRenderController, BatchVideoRenderController]) -> None:
+    """
+    Release what a video render holds after an error, so none of it outlives the render in a long-lived worker:
+    the writer thread is stopped, the video writers are aborted (killing any ffmpeg subprocess), and the frame reader and view are cleaned up.
+    """
+    if controller.frame_writer_thread is not None:
+        controller.frame_writer_thread.stop()
+    controller.video_writer.abort()
+    controller.progress_bar.close()
+    try:
+        controller.frame_reader.cleanup()
+    except Exception as e:
+        logging.warning(f'Could not clean up the frame reader after an error: {e}')
+    if controller.release_view:
+        controller.view.cleanup()
+
+
+class BatchRenderJob():
+    """ One video of a batch rendered by a BatchVideoRenderController: its scene, the tile of the frames it is rendered into, and its video writer. """
+
+    def __init__(self, cfg: ControllerConfig, scene: Scene, frame_rect: Tuple[int, int, int, int]) -> None:
+        self.cfg: ControllerConfig = cfg
+        self.scene: Scene = scene
+        self.frame_rect: Tuple[int, int, int, int] = frame_rect  # (x, y, width, height) of the job's tile, measured from the top left of the frames
+
+        self.frames_left_to_render: int  # when this becomes zero, the job is finished
+        self.delta_t: float              # amount of time to progress scene between renders
+        self.frames_left_to_render, self.delta_t = get_frames_to_render_and_delta_t(scene)
+        self.frame_count: int = self.frames_left_to_render  # number of frames in the job's video
+
+        self.video_width: int = frame_rect[2]
+        self.video_height: int = frame_rect[3]
+
+        self.video_writer: VideoWriter = VideoWriter.create_video_writer(self)
+
+
+class BatchVideoRenderController(Controller):
+    """
+    Batch Video Render Controller renders several jobs' videos in a single render loop, each job's scene into its own tile of the view's framebuffer.
+    Each frame is read back once and split into the jobs' video writers. The loop runs until the longest job is finished;
+    finished jobs are no longer updated or drawn, and their videos end at their own last frame.
+    The view must have been laid out with one tile per job by View.reset_tiles(), in the same order as the jobs.
+    """
+
+    def __init__(self, jobs: List[BatchRenderJob], view: View, release_view: bool = True) -> None:
+        # readback and writer thread settings are taken from the first job
+        super().__init__(jobs[0].cfg, jobs[0].scene)
+
+        self.jobs: List[BatchRenderJob] = jobs
+
+        self.view: View = view
+
+        self.release_view: bool = release_view  # if False, the view is left alive to render further batches
+
+        self.frames_left_to_render: int = max(job.frames_left_to_render for job in jobs)  # when this becomes zero, stop rendering
+
+        self.frames_rendered: int = 0  # track how many frames we've rendered
+
+        self.video_width: int
+        self.video_height: int
+        self.video_width, self.video_height = self.view.get_framebuffer_size()
+
+        self.video_writer: TiledVideoWriter = TiledVideoWriter([job.video_writer for job in jobs], [job.frame_rect for job in jobs], [job.frame_count for job in jobs])
+
+        # the jobs' video writers may have started ffmpeg subprocesses, which must not outlive a failure to create the rest of the controller
+        try:
+            self.frame_reader: FrameReader = FrameReader.create_frame_reader(self)
+
+            # if specified, frames are written on a separate thread, overlapping encoding with rendering of the following frames
+            self.frame_writer_thread: Optional[FrameWriterThread] = None
+            if self.cfg.writer_queue_size > 0:
+                self.frame_writer_thread = FrameWriterThread(self.video_writer, self.frame_reader, self.cfg.writer_queue_size)
+        except BaseException:
+            self.video_writer.abort()
+            raise
+
+        self.progress_bar = tqdm(total=self.frames_left_to_render)
+
+    def _prep_for_run_loop(self) -> None:
+        self.run_loop_start_time = time.time()
+
+    def _is_run_over(self) -> bool:
+        return self.frames_left_to_render == 0
+
+    def _start_run_loop_iteration(self) -> None:
+        self.view.clear_window()
+
+    def _update(self) -> None:
+        for job in self.jobs:
+            if job.frames_left_to_render > 0:
+                job.scene.update_transforms()
+
+    def _render(self) -> None:
+        self.view.render_tiles([job.scene if job.frames_left_to_render > 0 else None for job in self.jobs])
+
+    def _tick(self) -> None:
+        for job in self.jobs:
+            if job.frames_left_to_render > 0:
+                job.scene.progress_time(job.delta_t)
+                job.frames_left_to_render -= 1
+
+    def _handle_user_input(self) -> None:
+        """ ignore all user input when rendering video files """
+
+    def _finish_run_loop_iteration(self) -> None:
+        # get pixel values from the frame buffer, send the frames whose readback has finished to the video writers
+        for slot_id in self.frame_reader.read_frame():
+            self._write_frame(slot_id)
+
+        # update our counts and progress_bar
+        self.frames_left_to_render -= 1
+        self.frames_rendered += 1
+        self.progress_bar.update(1)
+
+    def _write_frame(self, slot_id: int) -> None:
+        """ Send the frame in the frame reader's slot to the video writers, then hand the slot back to the frame reader. """
+        if self.frame_writer_thread is not None:
+            self.frame_writer_thread.put(slot_id)
+            return
+        try:
+            self.video_writer.process_frame(self.frame_reader.get_frame(slot_id))
+        finally:
+            self.frame_reader.release_frame(slot_id)
+
+    def _cleanup_after_run_loop(self) -> None:
+        # write the frames still being read back
+        for slot_id in self.frame_reader.flush():
+            self._write_frame(slot_id)
+        self.frame_reader.cleanup()
+
+        logging.info(f'Rendered {self.frames_rendered} frames of {len(self.jobs)} videos in {time.time()-self.run_loop_start_time} seconds.')
+        _log_gl_call_counts(self.view)
+        self.progress_bar.close()
+
+        _time = time.time()
+        if self.frame_writer_thread is not None:
+            self.frame_writer_thread.join()
+        self.video_writer.cleanup()
+        logging.info(f'Wrote videos to files in in {time.time()-_time} seconds.')
+
+        if self.release_view:
+            self.view.cleanup()
+
+    def _cleanup_after_run_loop_error(self) -> None:
+        _abort_video_render(self)
+
+
+class FrameReader():
+    """
+    Reads rendered frames back from the framebuffer into a fixed set of preallocated frame slots, so no memory is allocated per frame.
+    A slot handed out by read_frame() or flush() holds its frame until it is passed back to release_frame().
+    If all slots are in use, reading the next frame waits for one to be released.
+    """
+
+    def __init__(self, width: int, height: int, slot_count: int) -> None:
+        self.width: int = width
+        self.height: int = height
+
+        self.frame_slots: List[npt.NDArray[np.uint8]] = [np.empty([height, width, 4], dtype=np.uint8) for _ in range(slot_count)]  # 4 for BGRA
+        self._free_slot_ids: queue.Queue[int] = queue.Queue()
+        for slot_id in range(slot_count):
+            self._free_slot_ids.put(slot_id)
+
+        # OpenGL's first row is the bottom of the image. If the driver can, have it return rows top to bottom instead of flipping each frame
+        self.flip_rows: bool = True
+        self._enable_pack_invert()
+
+    def _enable_pack_invert(self) -> None:
+        try:
+            if pack_invert.glInitPackInvertMESA():
+                GL.glPixelStorei(pack_invert.GL_PACK_INVERT_MESA, GL.GL_TRUE)
+                self.flip_rows = False
+        except Exception as e:
+            logging.info(f'Could not enable GL_PACK_INVERT_MESA, flipping rows of frames instead: {e}')
+
+    @abstractmethod
+    def read_frame(self) -> List[int]:
+        """ Subclass must start reading back the current framebuffer, and return the slots of frames whose readback has finished, oldest first. """
+        pass
+
+    @abstractmethod
+    def flush(self) -> Iterator[int]:
+        """ Subclass must finish reading back all frames, yielding their slots oldest first. Each slot is only taken once the previous one was consumed. """
+        pass
+
+    def get_frame(self, slot_id: int) -> npt.NDArray[np.uint8]:
+        """ Returns the BGRA frame held in the slot, top row first. It may be a view with flipped rows rather than a contiguous array. """
+        if self.flip_rows:
+            return self.frame_slots[slot_id][::-1, :, :]
+        return self.frame_slots[slot_id]
+
+    def release_frame(self, slot_id: int) -> None:
+        """ Hand the slot back, once its frame has been written. """
+        self._free_slot_ids.put(slot_id)
+
+    def _get_free_slot(self) -> int:
+        return self._free_slot_ids.get()
+
+    def cleanup(self) -> None:
+        """ Restore the pixel pack state, so the view can be reused. Subclasses holding OpenGL objects must also delete them. """
+        if not self.flip_rows:
+            GL.glPixelStorei(pack_invert.GL_PACK_INVERT_MESA, GL.GL_FALSE)
+
+    @staticmethod
+    def create_frame_reader(controller: Union[VideoRenderController, BatchVideoRenderController]) -> FrameReader:
+        """
+        Read frames back synchronously, or through a ring of pixel pack buffers if READBACK_PBO_COUNT > 0.
+        Frames rendered by a SoftwareView are copied straight from its framebuffer.
+        """
+
+        # one slot is being written to the video while the next is being filled, plus one per frame waiting for the writer thread
+        slot_count = 2 + controller.cfg.writer_queue_size
+
+        if isinstance(controller.view, SoftwareView):
+            return SoftwareFrameReader(controller.view, slot_count)
+        if controller.cfg.readback_pbo_count > 0:
+            return PBOFrameReader(controller.video_width, controller.video_height, slot_count, controller.cfg.readback_pbo_count)
+        return SyncFrameReader(controller.video_width, controller.video_height, slot_count)
+
+
+class SyncFrameReader(FrameReader):
+    """ Frame reader waiting for each frame's pixels with glReadPixels """
+
+    def read_frame(self) -> List[int]:
+        slot_id = self._get_free_slot()
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, 0)
+        GL.glReadPixels(0, 0, self.width, self.height, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, self.frame_slots[slot_id])
+        return [slot_id]
+
+    def flush(self) -> Iterator[int]:
+        yield from []
+
+
+class PBOFrameReader(FrameReader):
+    """
+    Frame reader copying each frame into the next of a ring of pixel pack buffers, which returns without waiting for rendering to finish.
+    A frame is copied out of its buffer once the ring comes back around to it, by which time the copy has completed,
+    so rendering of the following frames overlaps with the readback of the earlier ones.
+    """
+
+    def __init__(self, width: int, height: int, slot_count: int, pbo_count: int) -> None:
+        super().__init__(width, height, slot_count)
+
+        self.frame_bytes: int = width * height * 4
+        self.pbos: List[int] = [int(pbo) for pbo in np.atleast_1d(GL.glGenBuffers(pbo_count))]
+        for pbo in self.pbos:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.frame_bytes, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        self._next_pbo_idx: int = 0
+        self._pending_pbo_idxs: Deque[int] = deque()  # buffers holding frames not yet copied out, oldest first
+
+    def read_frame(self) -> List[int]:
+        # the buffer about to be reused still holds the oldest frame, so copy that out first
+        finished_slot_ids: List[int] = []
+        if len(self._pending_pbo_idxs) == len(self.pbos):
+            finished_slot_ids.append(self._copy_out_oldest())
+
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, 0)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.pbos[self._next_pbo_idx])
+        GL.glReadPixels(0, 0, self.width, self.height, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        self._pending_pbo_idxs.append(self._next_pbo_idx)
+        self._next_pbo_idx = (self._next_pbo_idx + 1) % len(self.pbos)
+        return finished_slot_ids
+
+    def flush(self) -> Iterator[int]:
+        while self._pending_pbo_idxs:
+            yield self._copy_out_oldest()
+
+    def _copy_out_oldest(self) -> int:
+        """ Copy the oldest pending frame from its pixel pack buffer into a free slot, returning the slot. """
+        pbo_idx = self._pending_pbo_idxs.popleft()
+        slot_id = self._get_free_slot()
+
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.pbos[pbo_idx])
+        ptr = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self.frame_bytes, GL.GL_MAP_READ_BIT)
+        if not ptr:
+            msg = 'Could not map pixel pack buffer to read back frame'
+            logging.critical(msg)
+            assert False, msg
+        ctypes.memmove(self.frame_slots[slot_id].ctypes.data, ptr, self.frame_bytes)
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        return slot_id
+
+    def cleanup(self) -> None:
+        super().cleanup()
+        GL.glDeleteBuffers(len(self.pbos), self.pbos)
+        self.pbos = []
+
+
+class SoftwareFrameReader(FrameReader):
+    """ Frame reader copying each frame out of a SoftwareView's framebuffer, which is already in memory. No OpenGL context is used. """
+
+    def __init__(self, view: SoftwareView, slot_count: int) -> None:
+        self.view: SoftwareView = view
+        super().__init__(*view.get_framebuffer_size(), slot_count)
+
+    def _enable_pack_invert(self) -> None:
+        """ The framebuffer's rows are bottom to top, as OpenGL's, and are flipped the same way. """
+
+    def read_frame(self) -> List[int]:
+        slot_id = self._get_free_slot()
+        cv2.cvtColor(self.view.buffer, cv2.COLOR_RGBA2BGRA, dst=self.frame_slots[slot_id])
+        return [slot_id]
+
+    def flush(self) -> Iterator[int]:
+        yield from []
+
+
+class FrameWriterThread():
+    """
+    Sends frames to a video writer on a background thread, so encoding a frame overlaps with rendering the following ones.
+    Frames are passed as frame reader slots through a queue of at most queue_size frames. Once written, each slot is released back to the frame reader.
+    An error raised by the video writer is raised again on the render thread by the next call to put() or join().
+    """
+
+    def __init__(self, video_writer: VideoWriter, frame_reader: FrameReader, queue_size: int) -> None:
+        self.video_writer: VideoWriter = video_writer
+        self.frame_reader: FrameReader = frame_reader
+
+        self._queue: queue.Queue[Optional[int]] = queue.Queue(maxsize=queue_size)
+        self._error: Optional[BaseException] = None
+        self._stopped: bool = False  # if True, frames are only released
+
+        self._thread = threading.Thread(target=self._run, name='FrameWriterThread', daemon=True)
+        self._thread.start()
+
+    def put(self, slot_id: int) -> None:
+        """ Queue the frame in the slot to be written, waiting if the queue is full. """
+        self._raise_error()
+        self._queue.put(slot_id)
+
+    def join(self) -> None:
+        """ Wait for all queued frames to be written. """
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def stop(self) -> None:
+        """ Release the queued frames without writing them, and wait for the thread to finish. Used when rendering fails. """
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            slot_id = self._queue.get()
+            if slot_id is None:
+                return
+            try:
+                if self._error is None and not self._stopped:  # after an error, frames are only released
+                    self.video_writer.process_frame(self.frame_reader.get_frame(slot_id))
+            except BaseException as e:
+                self._error = e
+            finally:
+                self.frame_reader.release_frame(slot_id)
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
 
 class VideoWriter():
     """ Wrapper to abstract the different backends necessary for writing different video filetypes """
@@ -131,12 +548,30 @@ class VideoWriter():
         """ Subclass must specify how to finish up after all frames have been received. """
         pass
 
+    def abort(self) -> None:
+        """ Called instead of cleanup() if rendering fails. Subclasses holding resources (e.g. a subprocess) must release them, without finishing the video. """
+
     @staticmethod
-    def create_video_writer(controller: VideoRenderController) -> VideoWriter:
+    def create_video_writer(controller: Union[VideoRenderController, BatchRenderJob]) -> VideoWriter:
+        """ Create a writer for each output video path. Multiple paths are fed the same frames through a MultiVideoWriter. """
+
+        writers: List[VideoWriter] = []
+        try:
+            for path in controller.cfg.output_video_paths:
+                writers.append(VideoWriter._create_video_writer(controller, Path(path)))
+        except BaseException:
+            # release the writers already created, e.g. an ffmpeg subprocess
+            for writer in writers:
+                writer.abort()
+            raise
+
+        if len(writers) == 1:
+            return writers[0]
+        return MultiVideoWriter(writers)
 
-        assert isinstance(controller.cfg.output_video_path, str)  # for static analysis
+    @staticmethod
+    def _create_video_writer(controller: Union[VideoRenderController, BatchRenderJob], output_p: Path) -> VideoWriter:
 
-        output_p = Path(controller.cfg.output_video_path)
         output_p.parent.mkdir(exist_ok=True, parents=True)
 
         msg = f' Writing video to: {output_p.resolve()}'
@@ -144,21 +579,68 @@ class VideoWriter():
         print(msg)
 
         if output_p.suffix == '.gif':
-            return GIFWriter(controller)
+            return GIFWriter(controller, output_p)
+        elif output_p.suffix == '.mp4' and controller.cfg.output_video_backend == 'ffmpeg':
+            return FFmpegWriter(controller, output_p)
         elif output_p.suffix == '.mp4':
-            return MP4Writer(controller)
+            return MP4Writer(controller, output_p)
         else:
             msg = f'Unsupported output video file extension ({output_p.suffix}). Only .gif and .mp4 are supported.'
             logging.critical(msg)
             assert False, msg
 
 
+class MultiVideoWriter(VideoWriter):
+    """ Video writer that sends each frame to several video writers, so multiple formats are encoded in a single render pass """
+
+    def __init__(self, writers: List[VideoWriter]) -> None:
+        self.writers: List[VideoWriter] = writers
+
+    def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
+        """ Pass the frame to every writer. Writers must not modify the frame in place. """
+        for writer in self.writers:
+            writer.process_frame(frame)
+
+    def cleanup(self) -> None:
+        for writer in self.writers:
+            writer.cleanup()
+
+    def abort(self) -> None:
+        for writer in self.writers:
+            writer.abort()
+
+
+class TiledVideoWriter(VideoWriter):
+    """ Video writer that splits each frame into tiles, sending each tile to its own video writer until that writer has received its frame count """
+
+    def __init__(self, writers: List[VideoWriter], frame_rects: List[Tuple[int, int, int, int]], frame_counts: List[int]) -> None:
+        """ frame_rects are (x, y, width, height) of each writer's tile, measured from the top left of the frames """
+        self.writers: List[VideoWriter] = writers
+        self.frame_rects: List[Tuple[int, int, int, int]] = frame_rects
+        self.frame_counts: List[int] = frame_counts
+        self.frames_written: int = 0
+
+    def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
+        """ Pass each unfinished writer its tile of the frame. Tiles are views into the frame, which writers must not modify in place. """
+        for writer, (x, y, width, height), frame_count in zip(self.writers, self.frame_rects, self.frame_counts):
+            if self.frames_written < frame_count:
+                writer.process_frame(frame[y:y + height, x:x + width])
+        self.frames_written += 1
+
+    def cleanup(self) -> None:
+        for writer in self.writers:
+            writer.cleanup()
+
+    def abort(self) -> None:
+        for writer in self.writers:
+            writer.abort()
+
+
 class GIFWriter(VideoWriter):
     """ Video writer for creating transparent, animated GIFs with Pillow """
 
-    def __init__(self, controller: VideoRenderController) -> None:
-        assert isinstance(controller.cfg.output_video_path, str)  # for static analysis
-        self.output_p = Path(controller.cfg.output_video_path)
+    def __init__(self, controller: Union[VideoRenderController, BatchRenderJob], output_p: Path) -> None:
+        self.output_p = output_p
 
         self.duration = int(controller.delta_t*1000)
         if self.duration < 20:
@@ -183,14 +665,9 @@ class GIFWriter(VideoWriter):
 
 class MP4Writer(VideoWriter):
     """ Video writer for creating mp4 videos with cv2.VideoWriter """
-    def __init__(self, controller: VideoRenderController) -> None:
+    def __init__(self, controller: Union[VideoRenderController, BatchRenderJob], output_p: Path) -> None:
 
-        # validate and prep output path
-        if isinstance(controller.cfg.output_video_path, NoneType):
-            msg = 'output video path not specified for mp4 video writer'
-            logging.critical(msg)
-            assert False, msg
-        output_p = Path(controller.cfg.output_video_path)
+        # prep output path
         output_p.parent.mkdir(exist_ok=True, parents=True)
         logging.info(f'VideoWriter will write to {output_p.resolve()}')
 
@@ -214,3 +691,83 @@ class MP4Writer(VideoWriter):
 
     def cleanup(self) -> None:
         self.video_writer.release()
+
+    def abort(self) -> None:
+        self.video_writer.release()
+
+
+class FFmpegWriter(VideoWriter):
+    """
+    Video writer that streams raw BGRA frames to the stdin of an ffmpeg subprocess.
+    Encoding runs in the ffmpeg process, overlapping with rendering, and the video is complete once the last frame is sent.
+    """
+    def __init__(self, controller: Union[VideoRenderController, BatchRenderJob], output_p: Path) -> None:
+
+        # find ffmpeg
+        ffmpeg_path = shutil.which('ffmpeg')
+        if ffmpeg_path is None:
+            msg = 'ffmpeg executable not found on PATH, needed by the ffmpeg video writer'
+            logging.critical(msg)
+            assert False, msg
+
+        # prep output path
+        output_p.parent.mkdir(exist_ok=True, parents=True)
+        logging.info(f'VideoWriter will write to {output_p.resolve()}')
+
+        # calculate video writer framerate
+        frame_rate = round(1/controller.delta_t)
+
+        cfg = controller.cfg
+        cmd = [
+            ffmpeg_path, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgra', '-s', f'{controller.video_width}x{controller.video_height}', '-framerate', str(frame_rate),
+            '-i', 'pipe:0',
+            '-an',
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',  # yuv420p requires even dimensions
+            '-c:v', cfg.ffmpeg_codec,
+        ]
+        if cfg.ffmpeg_preset is not None:
+            cmd += ['-preset', cfg.ffmpeg_preset]
+        if cfg.ffmpeg_crf is not None:
+            cmd += ['-crf', str(cfg.ffmpeg_crf)]
+        cmd += ['-pix_fmt', cfg.ffmpeg_pix_fmt, '-movflags', '+faststart', str(output_p)]
+        logging.info(f'Using ffmpeg command: {" ".join(cmd)}')
+
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
+        """ Send the frame's raw BGRA bytes to ffmpeg as it arrives. """
+        assert self.process.stdin is not None  # for static analysis
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self._raise_ffmpeg_error()
+
+    def cleanup(self) -> None:
+        """ Close ffmpeg's stdin and wait for it to finish writing the video. """
+        assert self.process.stdin is not None  # for static analysis
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        if self.process.returncode != 0:
+            self._raise_ffmpeg_error()
+
+    def abort(self) -> None:
+        """ Kill ffmpeg and wait for it to exit, leaving the video unfinished. """
+        self.process.kill()  # does nothing if ffmpeg already exited
+        for stream in [self.process.stdin, self.process.stderr]:
+            try:
+                if stream is not None:
+                    stream.close()
+            except OSError:
+                pass  # frames still buffered for the killed process can't be flushed
+        self.process.wait()
+
+    def _raise_ffmpeg_error(self) -> None:
+        assert self.process.stderr is not None  # for static analysis
+        self.process.wait()
+        msg = f'ffmpeg exited with code {self.process.returncode}: {self.process.stderr.read().decode(errors="replace")}'
+        logging.critical(msg)
+        assert False, msg
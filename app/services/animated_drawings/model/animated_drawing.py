@@ -4,8 +4,11 @@
 
 import logging
 import ctypes
-import heapq
+import hashlib
+import json
 import math
+import os
+import tempfile
 import time
 from typing import Dict, List, Tuple, Optional, TypedDict, DefaultDict
 from collections import defaultdict
@@ -15,7 +18,7 @@ import cv2
 import numpy as np
 import numpy.typing as npt
 from skimage import measure
-from shapely import geometry
+from shapely import geometry, vectorized
 from OpenGL import GL
 
 from scipy.spatial import Delaunay
@@ -26,7 +29,20 @@ from app.services.animated_drawings.model.arap import ARAP
 from app.services.animated_drawings.model.joint import Joint
 from app.services.animated_drawings.model.quaternions import Quaternions
 from app.services.animated_drawings.model.vectors import Vectors
-from app.services.animated_drawings.config import CharacterConfig, MotionConfig, RetargetConfig
+from app.services.animated_drawings.config import CharacterConfig, MotionConfig, RetargetConfig, SceneConfig
+from app.services.animated_drawings.view.shaders.shader import Shader, GLState
+
+ARAP_PRECOMPUTE_BATCH_SIZE = 128  # frames solved together when precomputing the mesh deformations
+
+CHARACTER_CACHE_VERSION = 2  # increment when the cached arrays or the code computing them change
+
+# level of detail used to build the mesh if none is specified
+DEFAULT_MESH_LOD: SceneConfig.MeshLODDict = {'name': 'default', 'grid_spacing': None, 'contour_tolerance': 0.25, 'max_vertices': None}
+MESH_GRID_NUM = 40  # interior vertices per side of the grid spanning the image, if the mesh level of detail has no grid spacing
+
+# 8-connected neighbors of a mask pixel and the distance to each, used to find each pixel's closest bone
+BONE_SEARCH_OFFSETS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+BONE_SEARCH_DISTANCES = [1.414, 1.0, 1.414, 1.0, 1.0, 1.414, 1.0, 1.414]
 
 
 class AnimatedDrawingMesh(TypedDict):
@@ -94,6 +110,9 @@ class AnimatedDrawingRig(Transform):
         self.root_joint = joints_d['root']
         self.add_child(self.root_joint)
 
+        # joints in depth-first order, the order of get_joints_2D_positions(). A joint's position in this list is its joint id
+        self.joints: List[AnimatedDrawingsJoint] = [joints_d[joint_name] for joint_name in self.root_joint.get_chain_joint_names()]
+
         # cache for later
         self.joint_count = joints_d['root'].joint_count()
 
@@ -109,6 +128,45 @@ class AnimatedDrawingRig(Transform):
         self._set_global_orientations(self.root_joint, bvh_frame_orientations)
         self._vertex_buffer_dirty_bit = True
 
+    def compute_joint_rotations(self, orientations: npt.NDArray[np.float32]) -> Tuple[npt.NDArray[np.int64], npt.NDArray[np.float32]]:
+        """
+        Array-backed counterpart of set_global_orientations(), for all frames at once.
+        orientations: ndarray [F, J] of each joint's orientation at each frame, columns ordered by joint id, NaN for joints without one.
+        Returns the ids of the K joints that set_global_orientations() would rotate, and ndarray [F, K, 4, 4] of their rotation matrices at each frame.
+        Pass a frame's matrices to set_joint_rotations() to pose the rig.
+        """
+        oriented: npt.NDArray[np.bool8] = ~np.isnan(orientations[0]) if len(orientations) else np.zeros(len(self.joints), dtype=bool)
+        joint_ids: Dict[Optional[str], int] = {joint.name: joint_id for joint_id, joint in enumerate(self.joints)}
+
+        # visit joints in the same order as _set_global_orientations, so later children determine their parent's rotation as they do there
+        thetas = np.zeros(orientations.shape, dtype=np.float64)
+        parent_thetas: Dict[int, npt.NDArray[np.float64]] = {}
+        for joint_id, joint in enumerate(self.joints):
+            if not oriented[joint_id]:
+                continue
+            thetas[:, joint_id] = np.radians(orientations[:, joint_id].astype(np.float64) - joint.starting_theta)
+
+            parent = joint.get_parent()
+            assert isinstance(parent, AnimatedDrawingsJoint)
+            parent_id = joint_ids[parent.name]
+            parent_thetas[parent_id] = thetas[:, joint_id] - thetas[:, parent_id] if oriented[parent_id] else thetas[:, joint_id]
+
+        rotated_joint_ids = np.array(list(parent_thetas.keys()), dtype=np.int64)
+        angles = np.stack(list(parent_thetas.values()), axis=1) if parent_thetas else np.zeros([len(orientations), 0])
+        rotations = np.zeros([*angles.shape, 4, 4], dtype=np.float32)
+        rotations[..., 3, 3] = 1.0
+        if angles.size:
+            axes = Vectors(np.tile([0.0, 0.0, 1.0], [angles.size, 1]))
+            rotations[..., :3, :3] = Quaternions.from_angle_axis(angles.reshape([-1, 1]), axes).to_rotation_matrices().reshape([*angles.shape, 3, 3])
+        return rotated_joint_ids, rotations
+
+    def set_joint_rotations(self, joint_ids: npt.NDArray[np.int64], rotations: npt.NDArray[np.float32]) -> None:
+        """ Poses the rig with one frame of the rotations returned by compute_joint_rotations(). rotations: ndarray [K, 4, 4]. """
+        for joint_id, rotation in zip(joint_ids, rotations):
+            self.joints[joint_id].set_rotation_matrix(rotation)
+        self.root_joint.update_transforms()
+        self._vertex_buffer_dirty_bit = True
+
     def get_joints_2D_positions(self) -> npt.NDArray[np.float32]:
         """ Returns array of 2D joints positions for rig.  """
         return np.array(self.root_joint.get_chain_worldspace_positions()).reshape([-1, 3])[:, :2]
@@ -197,15 +255,21 @@ class AnimatedDrawingRig(Transform):
         if self._vertex_buffer_dirty_bit:
             self._compute_and_buffer_vertex_data()
 
-        GL.glDisable(GL.GL_DEPTH_TEST)
-        GL.glUseProgram(kwargs['shader_ids']['color_shader'])
-        model_loc = GL.glGetUniformLocation(kwargs['shader_ids']['color_shader'], "model")
-        GL.glUniformMatrix4fv(model_loc, 1, GL.GL_FALSE, self._world_transform.T)
+        # the rig is drawn over the texture, without depth testing
+        gl_state: GLState = kwargs['gl_state']
+        gl_state.set_capability(GL.GL_DEPTH_TEST, False)
+        gl_state.set_uniform_matrix(kwargs['shaders']['color_shader'], 'model', self._world_transform)
 
         GL.glBindVertexArray(self.vao)
         GL.glDrawArrays(GL.GL_LINES, 0, len(self.vertices))
 
-        GL.glEnable(GL.GL_DEPTH_TEST)
+    def _cleanup(self) -> None:
+        if not self._is_opengl_initialized:
+            return
+
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(1, [self.vbo])
+        self._is_opengl_initialized = False
 
 
 class AnimatedDrawing(Transform, TimeManager):
@@ -221,51 +285,160 @@ class AnimatedDrawing(Transform, TimeManager):
     Afterwars, only the update() method needs to be called.
     """
 
-    def __init__(self, char_cfg: CharacterConfig, retarget_cfg: RetargetConfig, motion_cfg: MotionConfig):
+    def __init__(self, char_cfg: CharacterConfig, retarget_cfg: RetargetConfig, motion_cfg: MotionConfig, cache_dir: Optional[Path] = None, character_cache_dir: Optional[Path] = None,
+                 precompute_arap: bool = False, mesh_lod: Optional[SceneConfig.MeshLODDict] = None):
+        """
+        If cache_dir is specified, reusable preprocessing results (the character's mesh and ARAP matrices, the retargeted motion) are cached there.
+        If character_cache_dir is specified, the character's own preprocessing results are cached there instead of in {cache_dir}/character.
+        If precompute_arap is True, the mesh vertices of every frame are solved together during initialization and update() only looks them up.
+        mesh_lod controls how densely the character's mesh is built. If None, DEFAULT_MESH_LOD is used.
+        """
         super().__init__()
 
+        self.mesh_lod: SceneConfig.MeshLODDict = mesh_lod if mesh_lod is not None else DEFAULT_MESH_LOD
+
+        self.cache_dir: Optional[Path] = cache_dir
+
         self.char_cfg: CharacterConfig = char_cfg
 
         self.retarget_cfg: RetargetConfig = retarget_cfg
 
         self.img_dim: int = self.char_cfg.img_dim
 
-        # load mask and pad to square
-        self.mask: npt.NDArray[np.uint8] = self._load_mask()
-
-        # load texture and pad to square
-        self.txtr: npt.NDArray[np.uint8] = self._load_txtr()
-
-        # generate the mesh
-        self.mesh: AnimatedDrawingMesh
-        self._generate_mesh()
-
         self.rig = AnimatedDrawingRig(self.char_cfg)
         self.add_child(self.rig)
 
         # perform runtime checks for character pose, modify retarget config accordingly
         self._modify_retargeting_cfg_for_character()
 
+        self.mask: npt.NDArray[np.uint8]
+        self.txtr: npt.NDArray[np.uint8]
+        self.mesh: AnimatedDrawingMesh
         self.joint_to_tri_v_idx:  Dict[str, npt.NDArray[np.int32]]
-        self._initialize_joint_to_triangles_dict()
+        self.arap: ARAP
+
+        if character_cache_dir is None and self.cache_dir is not None:
+            character_cache_dir = Path(self.cache_dir, 'character')
+        self._initialize_character(character_cache_dir)
 
         self.indices: npt.NDArray[np.int32] = np.stack(self.mesh['triangles']).flatten()  # order in which to render triangles
 
         self.retargeter: Retargeter
         self._initialize_retargeter_bvh(motion_cfg, retarget_cfg)
 
-        # initialize arap solver with original joint positions
-        self.arap = ARAP(self.rig.get_joints_2D_positions(), self.mesh['triangles'], self.mesh['vertices'])
+        # retargeted motion of every frame, indexed by frame and joint id
+        self.rotated_joint_ids: npt.NDArray[np.int64]
+        self.frame_joint_rotations: npt.NDArray[np.float32]
+        self.frame_root_positions: npt.NDArray[np.float32]
+        self.draw_orders: List[npt.NDArray[np.int32]]
+        self.frame_draw_order_ids: npt.NDArray[np.int64]
+        self._initialize_frame_arrays()
 
         self.vertices: npt.NDArray[np.float32]
         self._initialize_vertices()
 
+        # [F, V, 2] mesh vertex xy positions of every frame, if precomputed
+        self.vertex_trajectory: Optional[npt.NDArray[np.float32]] = None
+        if precompute_arap:
+            self._precompute_vertex_trajectory()
+
         self._is_opengl_initialized: bool = False
         self._vertex_buffer_dirty_bit: bool = True
 
         # pose the animated drawing using the first frame of the bvh
         self.update()
 
+    @classmethod
+    def create_character_cache(cls, char_cfg: CharacterConfig, character_cache_dir: Path, mesh_lod: Optional[SceneConfig.MeshLODDict] = None) -> None:
+        """
+        Preprocess the character and save the results to character_cache_dir, without retargeting any motion,
+        so AnimatedDrawings of the character created later with the same character_cache_dir and mesh_lod load them instead.
+        """
+        # only what the character's preprocessing depends upon is initialized
+        ad = cls.__new__(cls)
+        ad.mesh_lod = mesh_lod if mesh_lod is not None else DEFAULT_MESH_LOD
+        ad.char_cfg = char_cfg
+        ad.img_dim = char_cfg.img_dim
+        ad.rig = AnimatedDrawingRig(char_cfg)
+        ad._initialize_character(character_cache_dir)
+
+    def _initialize_character(self, character_cache_dir: Optional[Path]) -> None:
+        """ Load the character's mask, texture, mesh, joint to triangle assignment and ARAP matrices from the cache, or compute them (and cache them). """
+        character_cache_p: Optional[Path] = None
+        if character_cache_dir is not None:
+            character_cache_p = Path(character_cache_dir, f'{self._get_character_cache_key()}.npz')
+
+        if character_cache_p is not None and character_cache_p.exists():
+            self._load_character_cache(character_cache_p)
+            return
+
+        # load mask and pad to square
+        self.mask = self._load_mask()
+
+        # load texture and pad to square
+        self.txtr = self._load_txtr()
+
+        # generate the mesh
+        self._generate_mesh()
+
+        self._initialize_joint_to_triangles_dict()
+
+        # initialize arap solver with original joint positions
+        self.arap = ARAP(self.rig.get_joints_2D_positions(), self.mesh['triangles'], self.mesh['vertices'])
+
+        if character_cache_p is not None:
+            self._save_character_cache(character_cache_p)
+
+    def _get_character_cache_key(self) -> str:
+        """ Hash of everything the character's mask, texture, mesh, joint to triangle assignment and ARAP matrices depend upon. """
+        cfg_values = [
+            CHARACTER_CACHE_VERSION,
+            self.char_cfg.img_height,
+            self.char_cfg.img_width,
+            self.char_cfg.skeleton,
+            self.mesh_lod,
+        ]
+        h = hashlib.sha1(json.dumps(cfg_values, sort_keys=True).encode())
+        h.update(Path(self.char_cfg.mask_p).read_bytes())
+        h.update(Path(self.char_cfg.txtr_p).read_bytes())
+        return f'{Path(self.char_cfg.txtr_p).parent.name}_{self.mesh_lod["name"]}_{h.hexdigest()}'
+
+    def _save_character_cache(self, cache_p: Path) -> None:
+        """ Write the character's preprocessing results to cache_p. Written to a temporary file first so concurrent readers never see a partial file. """
+        joint_names = list(self.joint_to_tri_v_idx.keys())
+
+        arrays: Dict[str, npt.NDArray] = {
+            'mask': self.mask,
+            'txtr': self.txtr,
+            'mesh_vertices': self.mesh['vertices'],
+            'mesh_triangles': np.array(self.mesh['triangles'], dtype=np.int32).reshape([-1, 3]),
+            'tri_joint_names': np.array(joint_names),
+            'tri_joint_v_idx_counts': np.array([len(self.joint_to_tri_v_idx[name]) for name in joint_names], dtype=np.int64),
+            'tri_joint_v_idxs': np.concatenate([self.joint_to_tri_v_idx[name] for name in joint_names]).astype(np.int32),
+        }
+        arrays.update({f'arap_{name}': array for name, array in self.arap.to_arrays().items()})
+
+        try:
+            cache_p.parent.mkdir(exist_ok=True, parents=True)
+            fd, tmp_fn = tempfile.mkstemp(dir=cache_p.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_fn, cache_p)
+            logging.info(f'Saved character cache to {cache_p}')
+        except OSError as e:
+            logging.warning(f'Could not save character cache to {cache_p}: {e}')
+
+    def _load_character_cache(self, cache_p: Path) -> None:
+        """ Read the character's preprocessing results from cache_p. """
+        logging.info(f'Using character cache located at {cache_p}')
+        with np.load(cache_p) as data:
+            self.mask = data['mask']
+            self.txtr = data['txtr']
+            self.mesh = {'vertices': data['mesh_vertices'], 'triangles': list(data['mesh_triangles'])}
+            v_idxs = np.split(data['tri_joint_v_idxs'], np.cumsum(data['tri_joint_v_idx_counts'])[:-1])
+            self.joint_to_tri_v_idx = dict(zip(data['tri_joint_names'].tolist(), v_idxs))
+            self.arap = ARAP.from_arrays({name[len('arap_'):]: data[name] for name in data.files if name.startswith('arap_')})
+
     def _modify_retargeting_cfg_for_character(self):
         """
         If the character is drawn in particular poses, the orientation-matching retargeting framework produce poor results.
@@ -314,7 +487,9 @@ class AnimatedDrawing(Transform, TimeManager):
         """ Initializes the retargeter used to drive the animated character.  """
 
         # initialize retargeter
-        self.retargeter = Retargeter(motion_cfg, retarget_cfg)
+        retarget_cache_dir = Path(self.cache_dir, 'retarget') if self.cache_dir is not None else None
+        bvh_cache_dir = Path(self.cache_dir, 'bvh') if self.cache_dir is not None else None
+        self.retargeter = Retargeter(motion_cfg, retarget_cfg, cache_dir=retarget_cache_dir, bvh_cache_dir=bvh_cache_dir)
 
         # validate the motion and retarget config files, now that we know char/bvh joint names
         char_joint_names: List[str] = self.rig.root_joint.get_chain_joint_names()
@@ -343,13 +518,7 @@ class AnimatedDrawing(Transform, TimeManager):
         b_joint_groups: List[List[str]] = char_bvh_root_offset['bvh_joints']
         for b_joint_group in b_joint_groups:
             while len(b_joint_group) >= 2:
-                b_dist_joint = self.retargeter.bvh.root_joint.get_transform_by_name(b_joint_group[1])
-                b_prox_joint = self.retargeter.bvh.root_joint.get_transform_by_name(b_joint_group[0])
-                assert isinstance(b_dist_joint, Joint)
-                assert isinstance(b_prox_joint, Joint)
-                b_dist_joint_pos = b_dist_joint.get_world_position()
-                b_prox_joint_pos = b_prox_joint.get_world_position()
-                b_limb_length += np.linalg.norm(np.subtract(b_dist_joint_pos, b_prox_joint_pos))
+                b_limb_length += self.retargeter.get_bvh_bone_length(b_joint_group[0], b_joint_group[1])
                 b_joint_group.pop(0)
 
         # compute character-bvh scale factor and send to retargeter
@@ -371,18 +540,19 @@ class AnimatedDrawing(Transform, TimeManager):
         """
 
         # get retargeted motion data
-        frame_orientations: Dict[str, float]
-        joint_depths: Dict[str, float]
-        root_position: npt.NDArray[np.float32]
-        frame_orientations, joint_depths, root_position = self.retargeter.get_retargeted_frame_data(self.get_time())
+        frame_idx: int = self.retargeter.get_frame_idx(self.get_time())
+        root_position: npt.NDArray[np.float32] = self.frame_root_positions[frame_idx]
 
         # update the rig's root position and reorient all of its joints
         self.rig.root_joint.set_position(root_position)
-        self.rig.set_global_orientations(frame_orientations)
+        self.rig.set_joint_rotations(self.rotated_joint_ids, self.frame_joint_rotations[frame_idx])
 
-        # using new joint positions, calculate new mesh vertex xy positions
-        control_points: npt.NDArray[np.float32] = self.rig.get_joints_2D_positions() - root_position[:2]
-        self.vertices[:, :2] = self.arap.solve(control_points) + root_position[:2]
+        # using new joint positions, calculate new mesh vertex xy positions (or look them up, if precomputed)
+        if self.vertex_trajectory is not None:
+            self.vertices[:, :2] = self.vertex_trajectory[frame_idx]
+        else:
+            control_points: npt.NDArray[np.float32] = self.rig.get_joints_2D_positions() - root_position[:2]
+            self.vertices[:, :2] = self.arap.solve(control_points) + root_position[:2]
 
         # use the z position of the rig's root joint for all mesh vertices
         self.vertices[:, 2] = self.rig.root_joint.get_world_position()[2]
@@ -390,94 +560,153 @@ class AnimatedDrawing(Transform, TimeManager):
         self._vertex_buffer_dirty_bit = True
 
         # using joint depths, determine the correct order in which to render the character
-        self._set_draw_indices(joint_depths)
+        self.indices = self.draw_orders[self.frame_draw_order_ids[frame_idx]]
 
-    def _set_draw_indices(self, joint_depths: Dict[str, float]):
+    def _precompute_vertex_trajectory(self) -> None:
+        """
+        The control point trajectory of the whole motion is known up front, so pose the rig for every frame
+        and solve the mesh vertex positions of all frames in batches, rather than one frame per update().
+        """
+        frame_num: int = self.retargeter.frame_max_num
+        control_points: npt.NDArray[np.float32] = np.empty([frame_num, len(self.rig.get_joints_2D_positions()), 2], dtype=np.float32)
+        root_positions: npt.NDArray[np.float32] = np.empty([frame_num, 2], dtype=np.float32)
+        for frame_idx in range(frame_num):
+            root_position = self.frame_root_positions[frame_idx]
+            self.rig.root_joint.set_position(root_position)
+            self.rig.set_joint_rotations(self.rotated_joint_ids, self.frame_joint_rotations[frame_idx])
+            control_points[frame_idx] = self.rig.get_joints_2D_positions() - root_position[:2]
+            root_positions[frame_idx] = root_position[:2]
+
+        self.vertex_trajectory = np.empty([frame_num, len(self.vertices), 2], dtype=np.float32)
+        for start_idx in range(0, frame_num, ARAP_PRECOMPUTE_BATCH_SIZE):
+            end_idx = start_idx + ARAP_PRECOMPUTE_BATCH_SIZE
+            self.vertex_trajectory[start_idx:end_idx] = self.arap.solve_batch(control_points[start_idx:end_idx]) + root_positions[start_idx:end_idx, np.newaxis]
+
+    def _initialize_frame_arrays(self) -> None:
+        """
+        Looks up the retargeted motion of all frames at once, so update() does no per-frame dictionary or list work:
+        the rotations posing the rig, the root positions, and one triangle index buffer per distinct render order of the bodypart groups.
+        """
+        orientations = self.retargeter.get_char_joint_orientations([str(joint.name) for joint in self.rig.joints])
+        self.rotated_joint_ids, self.frame_joint_rotations = self.rig.compute_joint_rotations(orientations)
+        self.frame_root_positions = self.retargeter.get_char_root_positions()
+
+        # depth of each segmentation group's depth drivers at each frame
+        depth_joint_names: List[str] = list(self.retargeter.bvh_joint_to_projection_depth.keys())
+        joint_depths = self.retargeter.get_bvh_joint_depths(depth_joint_names)
+        bodypart_depths = np.stack([joint_depths[:, [depth_joint_names.index(joint_name) for joint_name in bodypart_group_dict['bvh_depth_drivers']]].mean(axis=1)
+                                    for bodypart_group_dict in self.retarget_cfg.char_bodypart_groups], axis=1)  # [F, G]
 
         # sort segmentation groups by decreasing depth_driver's distance to camera
-        _bodypart_render_order: List[Tuple[int, np.float32]] = []
-        for idx, bodypart_group_dict in enumerate(self.retarget_cfg.char_bodypart_groups):
-            bodypart_depth: np.float32 = np.mean([joint_depths[joint_name] for joint_name in bodypart_group_dict['bvh_depth_drivers']])
-            _bodypart_render_order.append((idx, bodypart_depth))
-        _bodypart_render_order.sort(key=lambda x: float(x[1]))
+        bodypart_render_orders = np.argsort(bodypart_depths, axis=1, kind='stable')
+        in_front = np.take_along_axis(bodypart_depths, bodypart_render_orders, axis=1) > 0
+
+        # build the index buffer of each distinct render order once
+        group_num = bodypart_depths.shape[1]
+        distinct_orders, self.frame_draw_order_ids = np.unique(np.hstack([bodypart_render_orders, in_front]), axis=0, return_inverse=True)
+        self.draw_orders = [self._get_draw_indices(order[:group_num], order[group_num:].astype(bool)) for order in distinct_orders]
+        logging.info(f'Built {len(self.draw_orders)} distinct draw orders for {len(bodypart_depths)} frames')
 
+    def _get_draw_indices(self, bodypart_render_order: npt.NDArray[np.int64], in_front: npt.NDArray[np.bool8]) -> npt.NDArray[np.int32]:
+        """
+        Returns the triangle index buffer rendering the segmentation groups in bodypart_render_order.
+        in_front: whether each group's depth driver is in front of the projection plane
+        """
         # Add vertices belonging to joints in each segment group in the order they will be rendered
         indices: List[npt.NDArray[np.int32]] = []
-        for idx, dist in _bodypart_render_order:
-            intra_bodypart_render_order = 1 if dist > 0 else -1  # if depth driver is behind plane, render bodyparts in reverse order
+        for idx, is_in_front in zip(bodypart_render_order, in_front):
+            intra_bodypart_render_order = 1 if is_in_front else -1  # if depth driver is behind plane, render bodyparts in reverse order
             for joint_name in self.retarget_cfg.char_bodypart_groups[idx]['char_joints'][::intra_bodypart_render_order]:
                 indices.append(self.joint_to_tri_v_idx.get(joint_name, np.array([], dtype=np.int32)))
-        self.indices = np.hstack(indices)
+        return np.hstack(indices)
 
-    def _initialize_joint_to_triangles_dict(self) -> None:  # noqa: C901
+    def _initialize_joint_to_triangles_dict(self) -> None:
         """
         Uses BFS to find and return the closest joint bone (line segment between joint and parent) to each triangle centroid.
+        The search floods the character mask from seeds along each bone, one step to an 8-connected neighbor at a time, in order of distance.
+        Each step adds at least 1.0 to the distance, so the steps starting within the same whole pixel of distance cannot depend on one another and are taken together;
+        steps reaching the same pixel are applied in the order a heap of (distance, joint index, x, y) would pop them, so ties are broken by joint index.
         """
-        shortest_distance = np.full(self.mask.shape, 1 << 12, dtype=np.int32)  # to nearest joint
+        # to nearest joint. Stored truncated to whole pixels, and a step only updates a pixel if it is shorter than the stored distance
+        shortest_distance = np.full(self.mask.shape, 1 << 12, dtype=np.int32)
         closest_joint_idx = np.full(self.mask.shape, -1, dtype=np.int8)  # track joint idx nearest each point
 
-        # temp dictionary to help with seed generation
-        joints_d: Dict[str, CharacterConfig.JointDict] = {}
-        for joint in self.char_cfg.skeleton:
-            joints_d[joint['name']] = joint
-            joints_d[joint['name']]['loc'][1] = 1 - joints_d[joint['name']]['loc'][1]
-
         # store joint names and later reference by element location
         joint_name_to_idx: List[str] = [joint['name'] for joint in self.char_cfg.skeleton]
 
+        # flip joint locations to match the mask, without modifying the character config
+        joint_locs: Dict[str, npt.NDArray[np.float64]] = {joint['name']: np.array([joint['loc'][0], 1 - joint['loc'][1]]) for joint in self.char_cfg.skeleton}
+
+        # steps yet to be taken, as (distances, joint idxs, xs, ys), bucketed by distance truncated to whole pixels
+        steps: DefaultDict[int, List[Tuple[npt.NDArray[np.float64], npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.int64]]]] = defaultdict(list)
+
         # seed generation
-        heap: List[Tuple[float, Tuple[int, Tuple[int, int]]]] = []  # [(dist, (joint_idx, (x, y))]
-        for _, joint in joints_d.items():
+        for joint in self.char_cfg.skeleton:
             if joint['parent'] is None:  # skip root joint
                 continue
             joint_idx = joint_name_to_idx.index(joint['name'])
-            dist_joint_xy: List[float] = joint['loc']
-            prox_joint_xy: List[float] = joints_d[joint['parent']]['loc']
-            seeds_xy = (self.img_dim * np.linspace(dist_joint_xy, prox_joint_xy, num=20, endpoint=False)).round()
-            heap.extend([(0, (joint_idx, tuple(seed_xy.astype(np.int32)))) for seed_xy in seeds_xy])
+            seeds_xy = (self.img_dim * np.linspace(joint_locs[joint['name']], joint_locs[joint['parent']], num=20, endpoint=False)).round().astype(np.int64)
+            steps[0].append((np.zeros(len(seeds_xy)), np.full(len(seeds_xy), joint_idx), seeds_xy[:, 0], seeds_xy[:, 1]))
+
+        offsets_x = np.array([dx for dx, _ in BONE_SEARCH_OFFSETS])
+        offsets_y = np.array([dy for _, dy in BONE_SEARCH_OFFSETS])
+        offset_distances = np.array(BONE_SEARCH_DISTANCES)
 
         # BFS search
         start_time: float = time.time()
         logging.info('Starting joint -> mask pixel BFS')
-        while heap:
-            distance, (joint_idx, (x, y)) = heapq.heappop(heap)
-            neighbors = [(x-1, y-1), (x, y-1), (x+1, y-1), (x-1, y), (x+1, y), (x-1, y+1), (x, y+1), (x+1, y+1)]
-            n_dist = [1.414, 1.0, 1.414, 1.0, 1.0, 1.414, 1.0, 1.414]
-            for (n_x, n_y), n_dist in zip(neighbors, n_dist):
-                n_distance = distance + n_dist
-                if not 0 <= n_x < self.img_dim or not 0 <= n_y < self.img_dim:
-                    continue  # neighbor is outside image bounds- ignore
-
-                if not self.mask[n_x, n_y]:
-                    continue  # outside character mask
-
-                if shortest_distance[n_x, n_y] <= n_distance:
-                    continue  # a closer joint exists
-
-                closest_joint_idx[n_x, n_y] = joint_idx
-                shortest_distance[n_x, n_y] = n_distance
-                heapq.heappush(heap, (n_distance, (joint_idx, (n_x, n_y))))
+        while steps:
+            distances, joint_idxs, xs, ys = (np.concatenate(arrays) for arrays in zip(*steps.pop(min(steps))))
+
+            # the neighbors of every step, in the order the steps would be popped from a heap
+            order = np.lexsort([ys, xs, joint_idxs, distances])
+            n_distances = (distances[order, np.newaxis] + offset_distances).ravel()
+            n_joint_idxs = np.repeat(joint_idxs[order], len(BONE_SEARCH_OFFSETS))
+            n_xs = (xs[order, np.newaxis] + offsets_x).ravel()
+            n_ys = (ys[order, np.newaxis] + offsets_y).ravel()
+
+            # ignore neighbors outside image bounds or outside character mask
+            inside = (0 <= n_xs) & (n_xs < self.img_dim) & (0 <= n_ys) & (n_ys < self.img_dim)
+            inside[inside] = self.mask[n_xs[inside], n_ys[inside]].astype(bool)
+            n_distances, n_joint_idxs, n_xs, n_ys = n_distances[inside], n_joint_idxs[inside], n_xs[inside], n_ys[inside]
+
+            # group the steps by the pixel they reach, keeping their order within each group
+            order = np.argsort(n_xs * self.img_dim + n_ys, kind='stable')
+            n_distances, n_joint_idxs, n_xs, n_ys = n_distances[order], n_joint_idxs[order], n_xs[order], n_ys[order]
+            pixel_ids = n_xs * self.img_dim + n_ys
+            group_starts = np.flatnonzero(np.diff(pixel_ids, prepend=-1))
+            ranks = np.arange(len(pixel_ids)) - np.repeat(group_starts, np.diff(group_starts, append=len(pixel_ids)))
+
+            # take the first step to each pixel, then the second, and so on, skipping those for which a closer joint exists
+            taken = np.zeros(len(pixel_ids), dtype=bool)
+            by_rank = np.argsort(ranks, kind='stable')
+            for step_idxs in np.split(by_rank, np.cumsum(np.bincount(ranks))[:-1]):
+                step_idxs = step_idxs[shortest_distance[n_xs[step_idxs], n_ys[step_idxs]] > n_distances[step_idxs]]
+                closest_joint_idx[n_xs[step_idxs], n_ys[step_idxs]] = n_joint_idxs[step_idxs]
+                shortest_distance[n_xs[step_idxs], n_ys[step_idxs]] = n_distances[step_idxs]
+                taken[step_idxs] = True
+
+            # continue the search from every pixel updated
+            n_distances, n_joint_idxs, n_xs, n_ys = n_distances[taken], n_joint_idxs[taken], n_xs[taken], n_ys[taken]
+            buckets = n_distances.astype(np.int64)
+            for bucket in np.unique(buckets):
+                in_bucket = buckets == bucket
+                steps[int(bucket)].append((n_distances[in_bucket], n_joint_idxs[in_bucket], n_xs[in_bucket], n_ys[in_bucket]))
         logging.info(f'Finished joint -> mask pixel BFS in {time.time() - start_time} seconds')
 
-        # create map between joint name and triangle centroids it is closest to
-        joint_to_tri_v_idx_and_dist: DefaultDict[str, List[Tuple[npt.NDArray[np.int32], np.int32]]] = defaultdict(list)
-        for tri_v_idx in self.mesh['triangles']:
-            tri_verts = np.array([self.mesh['vertices'][v_idx] for v_idx in tri_v_idx])
-            centroid_x, centroid_y = list((tri_verts.mean(axis=0) * self.img_dim).round().astype(np.int32))
-            tri_centroid_closest_joint_idx: np.int8 = closest_joint_idx[centroid_x, centroid_y]
-            dist_from_tri_centroid_to_bone: np.int32 = shortest_distance[centroid_x, centroid_y]
-            joint_to_tri_v_idx_and_dist[joint_name_to_idx[tri_centroid_closest_joint_idx]].append((tri_v_idx, dist_from_tri_centroid_to_bone))
+        # find the joint and distance at each triangle centroid
+        triangles = np.array(self.mesh['triangles'], dtype=np.int32).reshape([-1, 3])
+        centroids = (self.mesh['vertices'][triangles].mean(axis=1) * self.img_dim).round().astype(np.int32)
+        tri_joint_idxs = closest_joint_idx[centroids[:, 0], centroids[:, 1]] % len(joint_name_to_idx)  # -1 indexes the last joint
+        tri_distances = shortest_distance[centroids[:, 0], centroids[:, 1]]
 
+        # create map between joint name and triangles whose centroids it is closest to, sorted by distance, descending
         joint_to_tri_v_idx: Dict[str, npt.NDArray[np.int32]] = {}
-        for key, val in joint_to_tri_v_idx_and_dist.items():
-            # sort by distance, descending
-            val.sort(key=lambda x: float(x[1]), reverse=True)
-
-            # retain vertex indices, remove distance info
-            val = [v[0] for v in val]
-
-            # convert to np array and save in dictionary
-            joint_to_tri_v_idx[key] = np.array(val).flatten()  # type: ignore
+        _, first_tri_idxs = np.unique(tri_joint_idxs, return_index=True)
+        for joint_idx in tri_joint_idxs[np.sort(first_tri_idxs)]:
+            tri_idxs = np.nonzero(tri_joint_idxs == joint_idx)[0]
+            tri_idxs = tri_idxs[np.argsort(-tri_distances[tri_idxs], kind='stable')]
+            joint_to_tri_v_idx[joint_name_to_idx[joint_idx]] = triangles[tri_idxs].flatten()
 
         self.joint_to_tri_v_idx = joint_to_tri_v_idx
 
@@ -544,18 +773,34 @@ class AnimatedDrawing(Transform, TimeManager):
             logging.info(msg)
             contours.sort(key=len, reverse=True)
 
-        outside_vertices: npt.NDArray[np.float64] = measure.approximate_polygon(contours[0], tolerance=0.25)
+        start_time: float = time.time()
+        max_vertices: Optional[int] = self.mesh_lod['max_vertices']
+
+        # simplify the outline, further if needed to leave some of the vertex budget for the interior
+        contour_tolerance: float = self.mesh_lod['contour_tolerance']
+        outside_vertices: npt.NDArray[np.float64] = measure.approximate_polygon(contours[0], tolerance=contour_tolerance)
+        while max_vertices is not None and len(outside_vertices) > max_vertices // 2 and len(outside_vertices) > 3:
+            contour_tolerance = max(2 * contour_tolerance, 0.25)
+            logging.info(f'Mesh outline exceeds half of vertex budget {max_vertices}, simplifying with tolerance {contour_tolerance}')
+            outside_vertices = measure.approximate_polygon(contours[0], tolerance=contour_tolerance)
         character_outline = geometry.Polygon(contours[0])
 
         # add some internal vertices to ensure a good mesh is created
-        inside_vertices_xy: List[Tuple[np.float32, np.float32]] = []
-        _x = np.linspace(0, self.img_dim, 40)
-        _y = np.linspace(0, self.img_dim, 40)
-        xv, yv = np.meshgrid(_x, _y)
-        for x, y in zip(xv.flatten(), yv.flatten()):
-            if character_outline.contains(geometry.Point(x, y)):
-                inside_vertices_xy.append((x, y))
-        inside_vertices: npt.NDArray[np.float64] = np.array(inside_vertices_xy)
+        if self.mesh_lod['grid_spacing'] is None:
+            grid_num: int = MESH_GRID_NUM
+        else:
+            character_size = np.sqrt(np.count_nonzero(self.mask))
+            grid_num = max(2, int(round(self.img_dim / (self.mesh_lod['grid_spacing'] * character_size))) + 1)
+        inside_vertices: npt.NDArray[np.float64] = self._get_inside_grid_vertices(character_outline, grid_num)
+
+        # coarsen the grid until the mesh fits the vertex budget
+        while max_vertices is not None and len(outside_vertices) + len(inside_vertices) > max_vertices and grid_num > 2:
+            inside_budget = max(max_vertices - len(outside_vertices), 1)
+            grid_num = max(2, min(grid_num - 1, int(grid_num * np.sqrt(inside_budget / len(inside_vertices)))))
+            inside_vertices = self._get_inside_grid_vertices(character_outline, grid_num)
+        if max_vertices is not None and len(outside_vertices) + len(inside_vertices) > max_vertices:
+            msg = f'Mesh has {len(outside_vertices) + len(inside_vertices)} vertices even with the coarsest interior grid, exceeding vertex budget {max_vertices}'
+            logging.warning(msg)
 
         vertices: npt.NDArray[np.float32] = np.concatenate([outside_vertices, inside_vertices]).astype(np.float32)
 
@@ -565,18 +810,25 @@ class AnimatedDrawing(Transform, TimeManager):
         falls outside the character's outline.
         """
         convex_hull_triangles = Delaunay(vertices)
-        triangles: List[npt.NDArray[np.int32]] = []
-        for _triangle in convex_hull_triangles.simplices:
-            tri_vertices = np.array(
-                [vertices[_triangle[0]], vertices[_triangle[1]], vertices[_triangle[2]]])
-            tri_centroid = geometry.Point(np.mean(tri_vertices, 0))
-            if character_outline.contains(tri_centroid):
-                triangles.append(_triangle)
+        tri_centroids = np.mean(vertices[convex_hull_triangles.simplices], axis=1)
+        inside_outline = vectorized.contains(character_outline, tri_centroids[:, 0], tri_centroids[:, 1])
+        triangles: List[npt.NDArray[np.int32]] = list(convex_hull_triangles.simplices[inside_outline])
 
         vertices /= self.img_dim  # scale vertices so they lie between 0-1
 
         self.mesh = {'vertices': vertices, 'triangles': triangles}
 
+        logging.info(f'Generated mesh with level of detail {self.mesh_lod["name"]}: {len(vertices)} vertices, {len(triangles)} triangles in {time.time() - start_time} seconds')
+
+    def _get_inside_grid_vertices(self, character_outline: geometry.Polygon, grid_num: int) -> npt.NDArray[np.float64]:
+        """ Returns the points of a grid_num x grid_num grid spanning the image which lie inside the character outline. """
+        _x = np.linspace(0, self.img_dim, grid_num)
+        _y = np.linspace(0, self.img_dim, grid_num)
+        xv, yv = np.meshgrid(_x, _y)
+        xs, ys = xv.flatten(), yv.flatten()
+        inside_outline = vectorized.contains(character_outline, xs, ys)
+        return np.stack([xs[inside_outline], ys[inside_outline]], axis=1)
+
     def _initialize_vertices(self) -> None:
         """
         Prepare the ndarray that will be sent to rendering pipeline.
@@ -616,52 +868,64 @@ class AnimatedDrawing(Transform, TimeManager):
                         0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, self.txtr)
 
         self.vao = GL.glGenVertexArrays(1)
-        self.vbo = GL.glGenBuffers(1)
-        self.ebo = GL.glGenBuffers(1)
+        self.position_vbo, self.attribute_vbo, self.ebo = GL.glGenBuffers(3)
 
         GL.glBindVertexArray(self.vao)
 
-        # buffer vertex data
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.vertices, GL.GL_DYNAMIC_DRAW)
-
-        # buffer element index data
-        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
-        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER,
-                        self.indices, GL.GL_STATIC_DRAW)
+        # vertex positions change every frame. Keep them in their own buffer, staged through a contiguous array
+        self._position_data: npt.NDArray[np.float32] = np.ascontiguousarray(self.vertices[:, :3])
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.position_vbo)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, self._position_data, GL.GL_DYNAMIC_DRAW)
 
         # position attributes
         GL.glVertexAttribPointer(
-            0, 3, GL.GL_FLOAT, False, 4 * self.vertices.shape[1], None)
+            0, 3, GL.GL_FLOAT, False, 4 * 3, None)
         GL.glEnableVertexAttribArray(0)
 
+        # colors and texture coordinates never change, so are buffered once
+        attribute_data: npt.NDArray[np.float32] = np.ascontiguousarray(self.vertices[:, 3:])
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.attribute_vbo)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, attribute_data, GL.GL_STATIC_DRAW)
+
         # color attributes
         GL.glVertexAttribPointer(
-            1, 3, GL.GL_FLOAT, False, 4 * self.vertices.shape[1], ctypes.c_void_p(4 * 3))
+            1, 3, GL.GL_FLOAT, False, 4 * attribute_data.shape[1], None)
         GL.glEnableVertexAttribArray(1)
 
         # texture attributes
         GL.glVertexAttribPointer(
-            2, 2, GL.GL_FLOAT, False, 4 * self.vertices.shape[1], ctypes.c_void_p(4 * 6))
+            2, 2, GL.GL_FLOAT, False, 4 * attribute_data.shape[1], ctypes.c_void_p(4 * 3))
         GL.glEnableVertexAttribArray(2)
 
+        # buffer element index data
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER,
+                        self.indices, GL.GL_DYNAMIC_DRAW)
+        self._buffered_indices: npt.NDArray[np.int32] = self.indices  # the draw order currently in the element buffer
+
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
         GL.glBindVertexArray(0)
 
         self._is_opengl_initialized = True
 
     def _rebuffer_vertex_data(self):
-        GL.glBindVertexArray(self.vao)
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, self.vertices, GL.GL_STATIC_DRAW)
+        # overwrite the vertex positions in place
+        np.copyto(self._position_data, self.vertices[:, :3])
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.position_vbo)
+        GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, self._position_data.nbytes, self._position_data)
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
 
-        # buffer element index data
-        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
-        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER,
-                        self.indices, GL.GL_STATIC_DRAW)
+        # buffer element index data, only if the draw order changed. Draw orders are never modified in place, so comparing identity suffices
+        if self.indices is not self._buffered_indices:
+            GL.glBindVertexArray(self.vao)
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+            if self.indices.nbytes == self._buffered_indices.nbytes:
+                GL.glBufferSubData(GL.GL_ELEMENT_ARRAY_BUFFER, 0, self.indices.nbytes, self.indices)
+            else:
+                GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, self.indices, GL.GL_DYNAMIC_DRAW)
+            GL.glBindVertexArray(0)
+            self._buffered_indices = self.indices
 
-        GL.glBindVertexArray(0)
         self._vertex_buffer_dirty_bit = False
 
     def _draw(self, **kwargs):
@@ -674,42 +938,42 @@ class AnimatedDrawing(Transform, TimeManager):
 
         GL.glBindVertexArray(self.vao)
 
+        # Animated Drawings are drawn without depth testing, in scene order. Objects drawn with it enable it again through the GL state cache
+        gl_state: GLState = kwargs['gl_state']
+        shaders: Dict[str, Shader] = kwargs['shaders']
+
         if kwargs['viewer_cfg'].draw_ad_txtr:
             GL.glActiveTexture(GL.GL_TEXTURE0)
             GL.glBindTexture(GL.GL_TEXTURE_2D, self.txtr_id)
-            GL.glDisable(GL.GL_DEPTH_TEST)
+            gl_state.set_capability(GL.GL_DEPTH_TEST, False)
 
-            GL.glUseProgram(kwargs['shader_ids']['texture_shader'])
-            model_loc = GL.glGetUniformLocation(kwargs['shader_ids']['texture_shader'], "model")
-            GL.glUniformMatrix4fv(model_loc, 1, GL.GL_FALSE, self._world_transform.T)
+            gl_state.set_uniform_matrix(shaders['texture_shader'], 'model', self._world_transform)
             GL.glDrawElements(GL.GL_TRIANGLES, self.indices.shape[0], GL.GL_UNSIGNED_INT, None)
 
-            GL.glEnable(GL.GL_DEPTH_TEST)
-
         if kwargs['viewer_cfg'].draw_ad_color:
-            GL.glDisable(GL.GL_DEPTH_TEST)
+            gl_state.set_capability(GL.GL_DEPTH_TEST, False)
 
-            GL.glPolygonMode(GL.GL_FRONT_AND_BACK, GL.GL_FILL)
-            GL.glUseProgram(kwargs['shader_ids']['color_shader'])
-            model_loc = GL.glGetUniformLocation(kwargs['shader_ids']['color_shader'], "model")
-            GL.glUniformMatrix4fv(model_loc, 1, GL.GL_FALSE, self._world_transform.T)
+            gl_state.set_polygon_mode(GL.GL_FILL)
+            gl_state.set_uniform_matrix(shaders['color_shader'], 'model', self._world_transform)
             GL.glDrawElements(GL.GL_TRIANGLES, self.indices.shape[0], GL.GL_UNSIGNED_INT, None)
 
-            GL.glEnable(GL.GL_DEPTH_TEST)
-
         if kwargs['viewer_cfg'].draw_ad_mesh_lines:
-            GL.glDisable(GL.GL_DEPTH_TEST)
+            gl_state.set_capability(GL.GL_DEPTH_TEST, False)
 
-            GL.glPolygonMode(GL.GL_FRONT_AND_BACK, GL.GL_LINE)
-            GL.glUseProgram(kwargs['shader_ids']['color_shader'])
-            model_loc = GL.glGetUniformLocation(kwargs['shader_ids']['color_shader'], "model")
-            GL.glUniformMatrix4fv(model_loc, 1, GL.GL_FALSE, self._world_transform.T)
+            gl_state.set_polygon_mode(GL.GL_LINE)
+            gl_state.set_uniform_matrix(shaders['color_shader'], 'model', self._world_transform)
 
-            color_black_loc = GL.glGetUniformLocation(kwargs['shader_ids']['color_shader'], "color_black")
-            GL.glUniform1i(color_black_loc, 1)
+            gl_state.set_uniform_int(shaders['color_shader'], 'color_black', 1)
             GL.glDrawElements(GL.GL_TRIANGLES, self.indices.shape[0], GL.GL_UNSIGNED_INT, None)
-            GL.glUniform1i(color_black_loc, 0)
-
-            GL.glEnable(GL.GL_DEPTH_TEST)
+            gl_state.set_uniform_int(shaders['color_shader'], 'color_black', 0)
 
         GL.glBindVertexArray(0)
+
+    def _cleanup(self) -> None:
+        if not self._is_opengl_initialized:
+            return
+
+        GL.glDeleteTextures([self.txtr_id])
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(3, [self.position_vbo, self.attribute_vbo, self.ebo])
+        self._is_opengl_initialized = False
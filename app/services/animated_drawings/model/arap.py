@@ -2,13 +2,14 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+from __future__ import annotations  # so we can refer to class Type inside class
 import numpy as np
 import numpy.typing as npt
-from collections import defaultdict
 import logging
-from typing import List, Dict, Set, Tuple
+from typing import Dict, List, Mapping, Tuple
 import scipy.sparse.linalg as spla
 import scipy.sparse as sp
+from app.services.animated_drawings.model.mesh_point_locator import MeshPointLocator
 
 
 csr_matrix = sp._csr.csr_matrix  # for typing  # pyright: ignore[reportPrivateUsage]
@@ -38,7 +39,7 @@ class ARAP():
     between (e' in E') and (e in E). This way, rotation is essentially free, while scaling is not.
     """
 
-    def __init__(self, pins_xy: npt.NDArray[np.float32], triangles: List[npt.NDArray[np.int32]], vertices: npt.NDArray[np.float32], w: int = 1000):  # noqa: C901
+    def __init__(self, pins_xy: npt.NDArray[np.float32], triangles: List[npt.NDArray[np.int32]], vertices: npt.NDArray[np.float32], w: int = 1000):
         """
         Sets up the matrices needed for later solves.
 
@@ -51,121 +52,160 @@ class ARAP():
 
         self.vertices = np.copy(vertices)
 
-        # build a deduplicated list of edge->vertex IDS...
-        self.e_v_idxs: List[Tuple[np.int32, np.int32]] = []
-        for v0, v1, v2 in triangles:
-            self.e_v_idxs.append(tuple(sorted((v0, v1))))
-            self.e_v_idxs.append(tuple(sorted((v1, v2))))
-            self.e_v_idxs.append(tuple(sorted((v2, v0))))
-        self.e_v_idxs = list(set(self.e_v_idxs))  # ...and deduplicate it
-
-        # build list of edge vectors
-        _edge_vectors: List[npt.NDArray[np.float32]] = []
-        for vi_idx, vj_idx in self.e_v_idxs:
-            vi = self.vertices[vi_idx]
-            vj = self.vertices[vj_idx]
-            _edge_vectors.append(vj - vi)
-        self.edge_vectors: npt.NDArray[np.float32] = np.array(_edge_vectors)
+        # build a deduplicated array of edge->vertex IDS
+        tris: npt.NDArray[np.int32] = np.asarray(triangles, dtype=np.int32).reshape([-1, 3])
+        _edges = np.sort(np.concatenate([tris[:, [0, 1]], tris[:, [1, 2]], tris[:, [2, 0]]]), axis=1)
+        self.e_v_idxs: npt.NDArray[np.int32] = np.unique(_edges, axis=0)
+
+        # build array of edge vectors
+        self.edge_vectors: npt.NDArray[np.float32] = self.vertices[self.e_v_idxs[:, 1]] - self.vertices[self.e_v_idxs[:, 0]]
 
         # get barycentric coordinates of pins, and mask denoting which pins were initially outside the mesh
         pins_bc: List[Tuple[Tuple[np.int32, np.float32], Tuple[np.int32, np.float32], Tuple[np.int32, np.float32]]]
         self.pin_mask = npt.NDArray[np.bool8]
-        pins_bc, self.pin_mask = self._xy_to_barycentric_coords(pins_xy, vertices, triangles)
-
-        v_vnbr_idxs: Dict[np.int32, Set[np.int32]] = defaultdict(set)  # build a dict mapping vertex ID -> neighbor vertex IDs
-        for v0, v1, v2 in triangles:
-            v_vnbr_idxs[v0] |= {v1, v2}
-            v_vnbr_idxs[v1] |= {v2, v0}
-            v_vnbr_idxs[v2] |= {v0, v1}
+        self.point_locator = MeshPointLocator(vertices, triangles)
+        pins_bc, self.pin_mask = self._xy_to_barycentric_coords(pins_xy)
 
         self.edge_num = len(self.e_v_idxs)
         self.vert_num = len(self.vertices)
         self.pin_num = len(pins_xy[self.pin_mask])
 
-        self.A1: npt.NDArray[np.float32] = np.zeros([2 * (self.edge_num + self.pin_num), 2 * self.vert_num], dtype=np.float32)
-        G: npt.NDArray[np.float32] = np.zeros([2 * self.edge_num, 2 * self.vert_num], dtype=np.float32)  # holds edge rotation calculations
-
-        # populate top half of A1, one row per edge
-        for k, (vi_idx, vj_idx) in enumerate(self.e_v_idxs):
-
-            # initialize self.A1 with 1, -1 denoting beginning and end of x and y dims of vector
-            self.A1[2*k:2*(k+1), 2*vi_idx:2*(vi_idx+1)] = -np.identity(2)
-            self.A1[2*k:2*(k+1), 2*vj_idx:2*(vj_idx+1)] = np.identity(2)
-
-            # Find the 'neighbor' vertices for this edge: {v_i, v_j,v_r, v_l}
-            vi_vnbr_idxs: Set[np.int32] = v_vnbr_idxs[vi_idx]
-            vj_vnbr_idxs: Set[np.int32] = v_vnbr_idxs[vj_idx]
-            e_vnbr_idxs: List[np.int32] = list(vi_vnbr_idxs.intersection(vj_vnbr_idxs))
-            e_vnbr_idxs.insert(0, vi_idx)
-            e_vnbr_idxs.insert(1, vj_idx)
-
-            e_vnbr_xys: Tuple[np.float32, np.float32] = tuple([self.vertices[v_idx] for v_idx in e_vnbr_idxs])
-
-            _: List[Tuple[float, float]] = []
-            for v in e_vnbr_xys[1:]:
-                vx: float = v[0] - e_vnbr_xys[0][0]
-                vy: float = v[1] - e_vnbr_xys[0][1]
-                _.extend(((vx, vy), (vy, -vx)))
-            G_k: npt.NDArray[np.float32] = np.array(_)
-
-            G_k_star: npt.NDArray[np.float32] = np.linalg.inv(G_k.T @ G_k) @ G_k.T
-
-            e_kx, e_ky = self.edge_vectors[k]
-            e = np.array([
-                [e_kx,  e_ky],
-                [e_ky, -e_kx]
-            ], np.float32)
-
-            edge_matrix = np.hstack([np.tile(-np.identity(2), (len(e_vnbr_idxs)-1, 1)), np.identity(2*(len(e_vnbr_idxs)-1))])
-            g = np.dot(G_k_star, edge_matrix)
-            h = np.dot(e, g)
-
-            for h_offset, v_idx in enumerate(e_vnbr_idxs):
-                self.A1[2*k:2*(k+1), 2*v_idx:2*(v_idx+1)] -= h[:, 2*h_offset:2*(h_offset+1)]
-                G[2*k:2*(k+1), 2*v_idx:2*(v_idx+1)] = g[:, 2*h_offset:2*(h_offset+1)]
-
-        # populate bottom row of A1, one row per constraint-dimension
-        for pin_idx, pin_bc in enumerate(pins_bc):
-            for v_idx, v_w in pin_bc:
-                self.A1[2*self.edge_num + 2*pin_idx  , 2*v_idx]     = self.w * v_w  # x component
-                self.A1[2*self.edge_num + 2*pin_idx+1, 2*v_idx + 1] = self.w * v_w  # y component
-
-        A2_top: npt.NDArray[np.float32] = np.zeros([self.edge_num, self.vert_num], dtype=np.float32)
-        for k, (vi_idx, vj_idx) in enumerate(self.e_v_idxs):
-            A2_top[k, vi_idx] = -1
-            A2_top[k, vj_idx] = 1
-
-        A2_bot: npt.NDArray[np.float32] = np.zeros([self.pin_num, self.vert_num], dtype=np.float32)
-        for pin_idx, pin_bc in enumerate(pins_bc):
-            for v_idx, v_w in pin_bc:
-                A2_bot[pin_idx, v_idx] = self.w * v_w
-
-        self.A2: npt.NDArray[np.float32] = np.vstack([A2_top, A2_bot])
-
-        # for speed, convert to sparse matrices and cache for later
-        self.tA1: csr_matrix = sp.csr_matrix(self.A1.transpose())
-        self.tA2: csr_matrix = sp.csr_matrix(self.A2.transpose())
-        self.G: csr_matrix = sp.csr_matrix(G)
-
-        # perturbing singular matrix and calling det can trigger overflow warning- ignore it
-        old_settings = np.seterr(over='ignore')
-
-        # ensure tA1xA1 matrix isn't singular and cache sparse repsentation
-        tA1xA1_dense: npt.NDArray[np.float32] = self.tA1 @ self.A1
-        while np.linalg.det(tA1xA1_dense) == 0.0:
-            logging.info('tA1xA1 is singular. perturbing...')
-            tA1xA1_dense += 0.00000001 * np.identity(tA1xA1_dense.shape[0])
-        self.tA1xA1: csr_matrix = sp.csr_matrix(tA1xA1_dense)
-
-        # ensure tA2xA2 matrix isn't singular and cache sparse repsentation
-        tA2xA2_dense: npt.NDArray[np.float32] = self.tA2 @ self.A2
-        while np.linalg.det(tA2xA2_dense) == 0.0:
-            logging.info('tA2xA2 is singular. perturbing...')
-            tA2xA2_dense += 0.00000001 * np.identity(tA2xA2_dense.shape[0])
-        self.tA2xA2: csr_matrix = sp.csr_matrix(tA2xA2_dense)
-
-        # revert np overflow warnings behavior
-        np.seterr(**old_settings)
+        # sparse vertex adjacency matrix. The 'neighbor' vertices of an edge {v_i, v_j} are those adjacent to both v_i and v_j
+        adjacency: csr_matrix = sp.csr_matrix((np.ones(2 * self.edge_num, dtype=np.int32),
+                                               (np.concatenate([self.e_v_idxs[:, 0], self.e_v_idxs[:, 1]]), np.concatenate([self.e_v_idxs[:, 1], self.e_v_idxs[:, 0]]))),
+                                              shape=(self.vert_num, self.vert_num))
+        common_nbrs = (adjacency[self.e_v_idxs[:, 0]].multiply(adjacency[self.e_v_idxs[:, 1]])).tocsr()
+        common_nbrs.sort_indices()
+        nbr_counts: npt.NDArray[np.int32] = np.diff(common_nbrs.indptr)
+
+        # A1 and G are assembled as lists of (row, col, value) triplets. Duplicate entries are summed.
+        a1_rows: List[npt.NDArray[np.int64]] = []
+        a1_cols: List[npt.NDArray[np.int64]] = []
+        a1_vals: List[npt.NDArray[np.float64]] = []
+        g_rows: List[npt.NDArray[np.int64]] = []
+        g_cols: List[npt.NDArray[np.int64]] = []
+        g_vals: List[npt.NDArray[np.float64]] = []
+
+        # top half of A1, two rows per edge: -1, 1 denoting beginning and end of x and y dims of vector
+        ks = np.arange(self.edge_num)
+        for r in range(2):
+            a1_rows.extend([2*ks + r, 2*ks + r])
+            a1_cols.extend([2*self.e_v_idxs[:, 0] + r, 2*self.e_v_idxs[:, 1] + r])
+            a1_vals.extend([np.full(self.edge_num, -1.0), np.full(self.edge_num, 1.0)])
+
+        # edges with the same number of neighbor vertices are processed together
+        for nbr_count in np.unique(nbr_counts):
+            group_ks = np.flatnonzero(nbr_counts == nbr_count)
+            group_nbr_idxs = common_nbrs.indices[common_nbrs.indptr[group_ks][:, np.newaxis] + np.arange(nbr_count)]
+            e_vnbr_idxs = np.concatenate([self.e_v_idxs[group_ks], group_nbr_idxs], axis=1)  # [K, M]: {v_i, v_j, v_r, v_l}
+            vnbr_num = e_vnbr_idxs.shape[1]
+
+            # G_k has two rows, (vx, vy) and (vy, -vx), per vertex v other than v_i, relative to v_i
+            vs = self.vertices[e_vnbr_idxs[:, 1:]] - self.vertices[e_vnbr_idxs[:, :1]]  # [K, M-1, 2]
+            vx, vy = vs[..., 0], vs[..., 1]
+            G_k = np.stack([np.stack([vx, vy], axis=-1), np.stack([vy, -vx], axis=-1)], axis=2).reshape([len(group_ks), 2 * (vnbr_num-1), 2])
+            G_k_t = G_k.transpose([0, 2, 1])
+
+            G_k_star = np.linalg.inv(G_k_t @ G_k) @ G_k_t  # [K, 2, 2(M-1)]
+
+            e_kx, e_ky = self.edge_vectors[group_ks, 0], self.edge_vectors[group_ks, 1]
+            e = np.stack([np.stack([e_kx, e_ky], axis=-1), np.stack([e_ky, -e_kx], axis=-1)], axis=1).astype(np.float32)  # [K, 2, 2]
+
+            edge_matrix = np.hstack([np.tile(-np.identity(2), (vnbr_num-1, 1)), np.identity(2*(vnbr_num-1))])
+            g = G_k_star @ edge_matrix  # [K, 2, 2M]
+            h = e @ g
+
+            # scatter the 2x2 block of each vertex into the edge's rows of A1 (subtracted) and G
+            rows = (2*group_ks[:, np.newaxis, np.newaxis] + np.arange(2)[np.newaxis, :, np.newaxis]).repeat(2*vnbr_num, axis=2)
+            cols = (2*e_vnbr_idxs[:, :, np.newaxis] + np.arange(2)).reshape([len(group_ks), 1, 2*vnbr_num]).repeat(2, axis=1)
+            a1_rows.append(rows.ravel())
+            a1_cols.append(cols.ravel())
+            a1_vals.append(-h.ravel())
+            g_rows.append(rows.ravel())
+            g_cols.append(cols.ravel())
+            g_vals.append(g.ravel())
+
+        # bottom rows of A1 and A2, one row per constraint-dimension
+        pin_v_idxs = np.array([[v_idx for v_idx, _ in pin_bc] for pin_bc in pins_bc], dtype=np.int64).reshape([-1, 3])
+        pin_v_ws = np.array([[v_w for _, v_w in pin_bc] for pin_bc in pins_bc], dtype=np.float32).reshape([-1, 3])
+        pin_idxs = np.arange(self.pin_num).repeat(3)
+        for r in range(2):
+            a1_rows.append(2*self.edge_num + 2*pin_idxs + r)  # x, then y component
+            a1_cols.append(2*pin_v_idxs.ravel() + r)
+            a1_vals.append((self.w * pin_v_ws).ravel())
+
+        A1_shape = (2 * (self.edge_num + self.pin_num), 2 * self.vert_num)
+        self.A1: csr_matrix = sp.csr_matrix((np.concatenate(a1_vals), (np.concatenate(a1_rows), np.concatenate(a1_cols))), shape=A1_shape).astype(np.float32)
+        self.G: csr_matrix = sp.csr_matrix((np.concatenate(g_vals), (np.concatenate(g_rows), np.concatenate(g_cols))), shape=(2 * self.edge_num, 2 * self.vert_num)).astype(np.float32)
+
+        A2_rows = np.concatenate([ks, ks, self.edge_num + pin_idxs])
+        A2_cols = np.concatenate([self.e_v_idxs[:, 0], self.e_v_idxs[:, 1], pin_v_idxs.ravel()])
+        A2_vals = np.concatenate([np.full(self.edge_num, -1.0, dtype=np.float32), np.full(self.edge_num, 1.0, dtype=np.float32), (self.w * pin_v_ws).ravel()])
+        self.A2: csr_matrix = sp.csr_matrix((A2_vals, (A2_rows, A2_cols)), shape=(self.edge_num + self.pin_num, self.vert_num), dtype=np.float32)
+
+        self._prepare_solves()
+
+    def _prepare_solves(self) -> None:
+        """ Computes the transposes, normal matrices and factorizations of A1 and A2 used by every solve. """
+        # for speed, cache the transposes and normal matrices
+        self.tA1: csr_matrix = self.A1.transpose().tocsr()
+        self.tA2: csr_matrix = self.A2.transpose().tocsr()
+        self.tA1xA1: csr_matrix = (self.tA1 @ self.A1).tocsr()
+        self.tA2xA2: csr_matrix = (self.tA2 @ self.A2).tocsr()
+
+        # the system matrices never change after this point, so factorize them once and reuse the factors for every solve
+        self.tA1xA1_lu: spla.SuperLU = self._factorize(self.tA1xA1, 'tA1xA1')
+        self.tA2xA2_lu: spla.SuperLU = self._factorize(self.tA2xA2, 'tA2xA2')
+
+    def to_arrays(self) -> Dict[str, npt.NDArray]:
+        """
+        Returns the arrays needed to recreate this ARAP with from_arrays(), e.g. to save them with np.savez.
+        The factorizations cannot be stored, so from_arrays() recomputes them.
+        """
+        arrays: Dict[str, npt.NDArray] = {
+            'w': np.array(self.w),
+            'vertices': self.vertices,
+            'triangles': self.point_locator.triangles,
+            'e_v_idxs': self.e_v_idxs,
+            'edge_vectors': self.edge_vectors,
+            'pin_mask': self.pin_mask,
+        }
+        for name, m in [('A1', self.A1), ('A2', self.A2), ('G', self.G)]:
+            arrays.update({f'{name}_data': m.data, f'{name}_indices': m.indices, f'{name}_indptr': m.indptr, f'{name}_shape': np.array(m.shape)})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, npt.NDArray]) -> ARAP:
+        """ Recreates an ARAP from the arrays returned by to_arrays(), skipping the construction of its matrices. """
+        arap = cls.__new__(cls)
+        arap.w = int(arrays['w'])
+        arap.vertices = arrays['vertices']
+        arap.e_v_idxs = arrays['e_v_idxs']
+        arap.edge_vectors = arrays['edge_vectors']
+        arap.pin_mask = arrays['pin_mask']
+        arap.point_locator = MeshPointLocator(arap.vertices, arrays['triangles'])
+
+        arap.edge_num = len(arap.e_v_idxs)
+        arap.vert_num = len(arap.vertices)
+        arap.pin_num = int(np.count_nonzero(arap.pin_mask))
+
+        def _csr(name: str) -> csr_matrix:
+            return sp.csr_matrix((arrays[f'{name}_data'], arrays[f'{name}_indices'], arrays[f'{name}_indptr']), shape=tuple(arrays[f'{name}_shape']))
+        arap.A1, arap.A2, arap.G = _csr('A1'), _csr('A2'), _csr('G')
+
+        arap._prepare_solves()
+        return arap
+
+    @staticmethod
+    def _factorize(m: csr_matrix, name: str) -> spla.SuperLU:
+        """ LU-factorize m. If the factorization finds m to be singular, add 1e-8 to its diagonal and try again. """
+        m_csc = m.astype(np.float64).tocsc()
+        while True:
+            try:
+                return spla.splu(m_csc)
+            except RuntimeError:
+                logging.info(f'{name} is singular. perturbing...')
+                m_csc = (m_csc + 0.00000001 * sp.identity(m_csc.shape[0], format='csc')).tocsc()
 
     def solve(self, pins_xy_: npt.NDArray[np.float32]) -> npt.NDArray[np.float64]:
         """
@@ -176,130 +216,71 @@ class ARAP():
         return: ndarray [N, 2], the updated xy locations of each vertex in the mesh
         """
 
+        return self.solve_batch(np.expand_dims(pins_xy_, axis=0))[0]
+
+    def solve_batch(self, pins_xy_: npt.NDArray[np.float32]) -> npt.NDArray[np.float64]:
+        """
+        Batched counterpart of solve(): solves F frames at once, as F columns of the right-hand sides of the prefactorized systems.
+
+        pins_xy: ndarray [F, N, 2] with new pin xy positions for each of F frames
+        return: ndarray [F, N, 2], the updated xy locations of each vertex in the mesh for each frame
+        """
+        frame_num = len(pins_xy_)
+
         # remove any pins that were orgininally outside the mesh
-        pins_xy: npt.NDArray[np.float32] = pins_xy_[self.pin_mask]  # pyright: ignore[reportGeneralTypeIssues]
+        pins_xy: npt.NDArray[np.float32] = pins_xy_[:, self.pin_mask]  # pyright: ignore[reportGeneralTypeIssues]
 
-        assert len(pins_xy) == self.pin_num
+        assert pins_xy.shape[1] == self.pin_num
 
-        self.b1: npt.NDArray[np.float64] = np.hstack([np.zeros([2 * self.edge_num], dtype=np.float64), self.w * pins_xy.reshape([-1, ])])
-        v1: npt.NDArray[np.float64] = spla.spsolve(self.tA1xA1, self.tA1 @ self.b1.T)
+        # one column per frame
+        b1: npt.NDArray[np.float64] = np.vstack([np.zeros([2 * self.edge_num, frame_num], dtype=np.float64), self.w * pins_xy.reshape([frame_num, -1]).T])
+        v1: npt.NDArray[np.float64] = self.tA1xA1_lu.solve(self.tA1 @ b1)
 
         T1: npt.NDArray[np.float64] = self.G @ v1
-        b2_top = np.empty([self.edge_num, 2], dtype=np.float64)
-        for idx, e0 in enumerate(self.edge_vectors):
-            c: np.float64 = T1[2*idx]
-            s: np.float64 = T1[2*idx + 1]
-            scale = 1.0 / np.sqrt(c * c + s * s)
-            c *= scale
-            s *= scale
-            T2 = np.asarray(((c, s), (-s, c)))  # create rotation matrix
-            e1 = np.dot(T2, e0)                 # and rotate old vector to get new
-            b2_top[idx] = e1
-        b2 = np.vstack([b2_top, self.w * pins_xy])
-        b2x = b2[:, 0]
-        b2y = b2[:, 1]
-
-        v2x: npt.NDArray[np.float64] = spla.spsolve(self.tA2xA2, self.tA2 @ b2x)
-        v2y: npt.NDArray[np.float64] = spla.spsolve(self.tA2xA2, self.tA2 @ b2y)
-
-        return np.vstack((v2x, v2y)).T
+
+        # normalize each edge's (c, s) into a rotation and rotate the old edge vectors to get new ones
+        cs: npt.NDArray[np.float64] = T1.reshape([self.edge_num, 2, frame_num])
+        cs = cs / np.sqrt(np.sum(cs * cs, axis=1, keepdims=True))
+        c, s = cs[:, 0], cs[:, 1]
+        e0x, e0y = self.edge_vectors[:, 0:1], self.edge_vectors[:, 1:2]
+        b2_top = np.stack([c * e0x + s * e0y, -s * e0x + c * e0y], axis=1)  # [E, 2, F]
+        b2 = np.concatenate([b2_top, self.w * pins_xy.transpose([1, 2, 0])])
+
+        # solve for x and y of all frames together, as the columns of the right-hand side
+        v2: npt.NDArray[np.float64] = self.tA2xA2_lu.solve(self.tA2 @ b2.reshape([len(b2), 2 * frame_num]))
+
+        return v2.reshape([self.vert_num, 2, frame_num]).transpose([2, 0, 1])
 
     def _xy_to_barycentric_coords(self,
-                                  points: npt.NDArray[np.float32],
-                                  vertices: npt.NDArray[np.float32],
-                                  triangles: List[npt.NDArray[np.int32]]
+                                  points: npt.NDArray[np.float32]
                                   ) -> Tuple[List[Tuple[Tuple[np.int32, np.float32], Tuple[np.int32, np.float32], Tuple[np.int32, np.float32]]],
                                              npt.NDArray[np.bool8]]:
         """
-        Given and array containing xy locations and the vertices & triangles making up a mesh,
+        Given and array containing xy locations, use the mesh's point locator to
         find the triangle that each points in within and return it's representation using barycentric coordinates.
         points: ndarray [N,2] of point xy coords
-        vertices: ndarray of vertex locations, row position is index id
-        triangles: ndarraywith ordered vertex ids of vertices that make up each mesh triangle
-
-        Is point inside triangle? : https://mathworld.wolfram.com/TriangleInterior.html
 
         Returns a list of barycentric coords for points inside the mesh,
         and a list of True/False values indicating whether a given pin was inside the mesh or not.
         Needed for removing pins during subsequent solve steps.
 
         """
-        def det(u: npt.NDArray[np.float32], v: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
-            """ helper function returns determinents of two [N,2] arrays"""
-            ux, uy = u[:, 0], u[:, 1]
-            vx, vy = v[:, 0], v[:, 1]
-            return ux*vy - uy*vx
-
-        tv_locs: npt.NDArray[np.float32] = np.asarray([vertices[t].flatten() for t in triangles])  # triangle->vertex locations, [T x 6] array
-
-        v0 = tv_locs[:, :2]
-        v1 = np.subtract(tv_locs[:, 2:4], v0)
-        v2 = np.subtract(tv_locs[:, 4: ], v0)
+        t_idxs, uvws = self.point_locator.locate(points)
 
         b_coords: List[Tuple[Tuple[np.int32, np.float32], Tuple[np.int32, np.float32], Tuple[np.int32, np.float32]]] = []
-        pin_mask: List[bool] = []
-
-        for p_xy in points:
-
-            p_xy = np.expand_dims(p_xy, axis=0)
-            a =  (det(p_xy, v2) - det(v0, v2)) / det(v1, v2)
-            b = -(det(p_xy, v1) - det(v0, v1)) / det(v1, v2)
-
-            # find the indices of triangle containing
-            in_triangle = np.bitwise_and(np.bitwise_and(a > 0, b > 0), a + b < 1)
-            containing_t_idxs = np.argwhere(in_triangle)
-
-            # if length is zero, check if on triangle(s) perimeters
-            if not len(containing_t_idxs):
-                on_triangle_perimeter = np.bitwise_and(np.bitwise_and(a >= 0, b >= 0), a + b <= 1)
-                containing_t_idxs = np.argwhere(on_triangle_perimeter)
+        for p_xy, t_idx, uvw in zip(points, t_idxs, uvws):
 
             # point is outside mesh. Log a warning and continue
-            if not len(containing_t_idxs):
+            if t_idx < 0:
                 msg = f'point {p_xy} not inside or on edge of any triangle in mesh. Skipping it'
                 print(msg)
                 logging.warning(msg)
-                pin_mask.append(False)
                 continue
 
-            # grab the id of first triangle the point is in or on
-            t_idx = int(containing_t_idxs[0])
-
-            vertex_ids = triangles[t_idx]                               # get ids of verts in triangle
-            a_xy, b_xy, c_xy = vertices[vertex_ids]                     # get xy coords of verts
-            uvw = self._get_barycentric_coords(p_xy, a_xy, b_xy, c_xy)  # get barycentric coords
+            vertex_ids = self.point_locator.triangles[t_idx]            # get ids of verts in triangle
             b_coords.append(list(zip(vertex_ids, uvw)))                 # append to our list  # pyright: ignore[reportGeneralTypeIssues]
-            pin_mask.append(True)
-
-        return (b_coords, np.array(pin_mask, dtype=np.bool8))
 
-    def _get_barycentric_coords(self,
-                                p: npt.NDArray[np.float32],
-                                a: npt.NDArray[np.float32],
-                                b: npt.NDArray[np.float32],
-                                c: npt.NDArray[np.float32]
-                                ) -> npt.NDArray[np.float32]:
-        """
-        As described in Christer Ericson's Real-Time Collision Detection.
-        p: the input point
-        a, b, c: the vertices of the triangle
-
-        Returns ndarray [u, v, w], the barycentric coordinates of p wrt vertices a, b, c
-        """
-        v0: npt.NDArray[np.float32] = np.subtract(b, a)
-        v1: npt.NDArray[np.float32] = np.subtract(c, a)
-        v2: npt.NDArray[np.float32] = np.subtract(p, a)
-        d00: np.float32 = np.dot(v0, v0)
-        d01: np.float32 = np.dot(v0, v1)
-        d11: np.float32 = np.dot(v1, v1)
-        d20: np.float32 = np.dot(v2, v0)
-        d21: np.float32 = np.dot(v2, v1)
-        denom = d00 * d11 - d01 * d01
-        v: npt.NDArray[np.float32] = (d11 * d20 - d01 * d21) / denom  # pyright: ignore[reportGeneralTypeIssues]
-        w: npt.NDArray[np.float32] = (d00 * d21 - d01 * d20) / denom  # pyright: ignore[reportGeneralTypeIssues]
-        u: npt.NDArray[np.float32] = 1.0 - v - w
-
-        return np.array([u, v, w]).squeeze()
+        return (b_coords, np.array(t_idxs >= 0, dtype=np.bool8))
 
 
 def plot_mesh(vertices, triangles, pins_xy):
@@ -6,6 +6,7 @@ import numpy as np
 import OpenGL.GL as GL
 import ctypes
 from app.services.animated_drawings.model.transform import Transform
+from app.services.animated_drawings.view.shaders.shader import GLState
 
 
 class Box(Transform):
@@ -135,9 +136,17 @@ class Box(Transform):
         if not self._is_opengl_initialized:
             self._initialize_opengl_resources()
 
-        GL.glUseProgram(kwargs['shader_ids'][self.shader_name])
-        model_loc = GL.glGetUniformLocation(kwargs['shader_ids'][self.shader_name], "model")
-        GL.glUniformMatrix4fv(model_loc, 1, GL.GL_FALSE, self._world_transform.T)
+        gl_state: GLState = kwargs['gl_state']
+        gl_state.set_capability(GL.GL_DEPTH_TEST, True)
+        gl_state.set_uniform_matrix(kwargs['shaders'][self.shader_name], 'model', self._world_transform)
 
         GL.glBindVertexArray(self.vao)
         GL.glDrawArrays(GL.GL_TRIANGLES, 0, 36)
+
+    def _cleanup(self) -> None:
+        if not self._is_opengl_initialized:
+            return
+
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(2, [self.vbo, self.ebo])
+        self._is_opengl_initialized = False
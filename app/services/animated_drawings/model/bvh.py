@@ -3,7 +3,10 @@
 # LICENSE file in the root directory of this source tree.
 
 from __future__ import annotations  # so we can refer to class Type inside class
+import hashlib
 import logging
+import os
+import tempfile
 from pathlib import Path
 from typing import List, Tuple, Optional
 
@@ -18,6 +21,8 @@ from app.services.animated_drawings.model.joint import Joint
 from app.services.animated_drawings.model.time_manager import TimeManager
 from app.services.animated_drawings.utils import resolve_ad_filepath
 
+BVH_SIDECAR_VERSION = 1  # increment when the sidecar contents or the code computing them change
+
 
 class BVH_Joint(Joint):
     """
@@ -68,6 +73,11 @@ class BVH(Transform, TimeManager):
         self.add_child(self.root_joint)
         self.joint_num = self.root_joint.joint_count()
 
+        # parent index and local offset of each joint, in get_joint_names() order, for batched forward kinematics
+        self.joint_parent_idxs: npt.NDArray[np.int32] = np.empty([self.joint_num], dtype=np.int32)
+        self.joint_offsets: npt.NDArray[np.float32] = np.empty([self.joint_num, 3], dtype=np.float32)
+        self._compute_joint_hierarchy_arrays(self.root_joint, parent_idx=-1, ptr=np.array(0))
+
         self.cur_frame = 0  # initialize skeleton pose to first frame
         self.apply_frame(self.cur_frame)
 
@@ -75,6 +85,18 @@ class BVH(Transform, TimeManager):
         """ Get names of joints in skeleton in the order in which BVH rotation data is stored. """
         return self.root_joint.get_chain_joint_names()
 
+    def _compute_joint_hierarchy_arrays(self, joint: BVH_Joint, parent_idx: int, ptr: npt.NDArray[np.int32]) -> None:
+        joint_idx = int(ptr)
+        self.joint_parent_idxs[joint_idx] = parent_idx
+        self.joint_offsets[joint_idx] = joint.get_local_position()
+
+        ptr += 1
+
+        for c in joint.get_children():
+            if not isinstance(c, BVH_Joint):
+                continue
+            self._compute_joint_hierarchy_arrays(c, joint_idx, ptr)
+
     def update(self) -> None:
         """Based upon internal time, determine which frame should be displayed and apply it"""
         cur_time: float = self.get_time()
@@ -126,45 +148,102 @@ class BVH(Transform, TimeManager):
 
         return Vectors(vectors_cw_perpendicular_to_fwd).average().perpendicular()
 
+    def get_joint_world_positions(self, frame_idxs: Optional[npt.NDArray[np.int32]] = None) -> npt.NDArray[np.float32]:
+        """
+        Batched forward kinematics. Returns the world position of every joint, in get_joint_names() order, at each of frame_idxs: [F, J, 3].
+        If frame_idxs is None, all frames are used. The skeleton's current pose is left untouched.
+        """
+        if frame_idxs is None:
+            frame_idxs = np.arange(self.frame_max_num)
+
+        local_rs = Quaternions(self.rot_data[frame_idxs]).to_rotation_matrices()  # [F, J, 3, 3]
+
+        world_rs = np.empty_like(local_rs)
+        world_ps = np.empty([len(frame_idxs), self.joint_num, 3], dtype=np.float32)
+
+        # the root is placed by the BVH's own transform (orientation, scale, offset) and translated by pos_data
+        bvh_world_transform = self.get_world_transform()
+        world_rs[:, 0] = bvh_world_transform[:-1, :-1] @ local_rs[:, 0]
+        world_ps[:, 0] = self.pos_data[frame_idxs] @ bvh_world_transform[:-1, :-1].T + bvh_world_transform[:-1, -1]
+
+        # joints are stored depth-first, so each parent is computed before its children
+        for joint_idx in range(1, self.joint_num):
+            parent_idx = self.joint_parent_idxs[joint_idx]
+            world_rs[:, joint_idx] = world_rs[:, parent_idx] @ local_rs[:, joint_idx]
+            world_ps[:, joint_idx] = world_rs[:, parent_idx] @ self.joint_offsets[joint_idx] + world_ps[:, parent_idx]
+
+        return world_ps
+
+    def get_skeleton_fwd_vectors(self, forward_perp_vector_joint_names: List[Tuple[str, str]], joint_world_positions: npt.NDArray[np.float32]) -> Vectors:
+        """
+        Batched counterpart of get_skeleton_fwd(). Given joint_world_positions [F, J, 3], as returned by get_joint_world_positions(),
+        returns the forward vector of the skeleton at each of the F frames: [F, 3].
+        """
+        joint_names = self.get_joint_names()
+        start_idxs: List[int] = []
+        end_idxs: List[int] = []
+        for (start_joint_name, end_joint_name) in forward_perp_vector_joint_names:
+            for joint_name, idxs in [(start_joint_name, start_idxs), (end_joint_name, end_idxs)]:
+                if joint_name not in joint_names:
+                    msg = f'Could not find BVH joint with name: {joint_name}'
+                    logging.critical(msg)
+                    assert False, msg
+                idxs.append(joint_names.index(joint_name))
+
+        bone_vectors: Vectors = Vectors(joint_world_positions[:, end_idxs] - joint_world_positions[:, start_idxs])  # [F, P, 3]
+        bone_vectors.norm()
+
+        return Vectors(np.mean(bone_vectors.vs, axis=1)).perpendicular()
+
     @classmethod
-    def from_file(cls, bvh_fn: str, start_frame_idx: int = 0, end_frame_idx: Optional[int] = None) -> BVH:
-        """ Given a path to a .bvh, constructs and returns BVH object"""
+    def from_file(cls, bvh_fn: str, start_frame_idx: int = 0, end_frame_idx: Optional[int] = None, cache_dir: Optional[Path] = None) -> BVH:
+        """
+        Given a path to a .bvh, constructs and returns BVH object.
+        If cache_dir is specified, the parsed skeleton, root positions and joint quaternions of all frames are stored there
+        in a <bvh name>.<hash of its resolved path>.npz sidecar, which is reused as long as the mtime and hash of the .bvh still match.
+        """
 
         # search for the BVH file specified
         bvh_p: Path = resolve_ad_filepath(bvh_fn, 'bvh file')
         logging.info(f'Using BVH file located at {bvh_p.resolve()}')
 
-        with open(str(bvh_p), 'r') as f:
-            lines = f.read().splitlines()
+        bvh_bytes = bvh_p.read_bytes()
 
-        if lines.pop(0) != 'HIERARCHY':
-            msg = f'Malformed BVH in line preceding {lines}'
-            logging.critical(msg)
-            assert False, msg
+        sidecar_p: Optional[Path] = None
+        source_mtime_ns, source_sha1 = bvh_p.stat().st_mtime_ns, hashlib.sha1(bvh_bytes).hexdigest()
+        if cache_dir is not None:
+            # keyed by the resolved path too, so same-named files in different directories get separate sidecars
+            path_sha1 = hashlib.sha1(str(bvh_p.resolve()).encode()).hexdigest()[:16]
+            sidecar_p = Path(cache_dir, f'{bvh_p.name}.{path_sha1}.npz')
 
-        # Parse the skeleton
-        root_joint: BVH_Joint = BVH._parse_skeleton(lines)
+        sidecar = BVH._load_sidecar(sidecar_p, source_mtime_ns, source_sha1) if sidecar_p is not None else None
+        if sidecar is not None:
+            skeleton_lines, frame_max_num, frame_time, pos_data, rot_data = sidecar
+            root_joint: BVH_Joint = BVH._parse_skeleton(skeleton_lines)
+        else:
+            lines = bvh_bytes.decode().splitlines()
 
-        if lines.pop(0) != 'MOTION':
-            msg = f'Malformed BVH in line preceding {lines}'
-            logging.critical(msg)
-            assert False, msg
+            if lines.pop(0) != 'HIERARCHY':
+                msg = f'Malformed BVH in line preceding {lines}'
+                logging.critical(msg)
+                assert False, msg
 
-        # Parse motion metadata
-        frame_max_num = int(lines.pop(0).split(':')[-1])
-        frame_time = float(lines.pop(0).split(':')[-1])
+            # Parse the skeleton, keeping its lines for the sidecar
+            skeleton_lines = list(lines)
+            root_joint = BVH._parse_skeleton(lines)
+            skeleton_lines = skeleton_lines[:len(skeleton_lines) - len(lines)]
 
-        # Parse motion data
-        frames = [list(map(float, line.strip().split(' '))) for line in lines]
-        if len(frames) != frame_max_num:
-            msg = f'framenum specified ({frame_max_num}) and found ({len(frames)}) do not match'
-            logging.critical(msg)
-            assert False, msg
+            if lines.pop(0) != 'MOTION':
+                msg = f'Malformed BVH in line preceding {lines}'
+                logging.critical(msg)
+                assert False, msg
 
-        # Split logically distinct root position data from joint euler angle rotation data
-        pos_data: npt.NDArray[np.float32]
-        rot_data: npt.NDArray[np.float32]
-        pos_data, rot_data = BVH._process_frame_data(root_joint, frames)
+            # Parse motion metadata
+            frame_max_num = int(lines.pop(0).split(':')[-1])
+            frame_time = float(lines.pop(0).split(':')[-1])
+
+            # Parse motion data
+            frames = BVH._parse_motion_data(lines, frame_max_num)
 
         # Set end_frame if not passed in
         if not end_frame_idx:
@@ -176,15 +255,77 @@ class BVH(Transform, TimeManager):
             logging.warning(msg)
             end_frame_idx = frame_max_num
 
-        # slice position and rotation data using start and end frame indices
-        pos_data = pos_data[start_frame_idx:end_frame_idx, :]
-        rot_data = rot_data[start_frame_idx:end_frame_idx, :]
+        if sidecar is None:
+            if sidecar_p is None:
+                # only convert the frames that will be used
+                frames = frames[start_frame_idx:end_frame_idx]
+
+            # Split logically distinct root position data from joint euler angle rotation data
+            pos_data, rot_data = BVH._process_frame_data(root_joint, frames)
+
+            if sidecar_p is not None:
+                BVH._save_sidecar(sidecar_p, source_mtime_ns, source_sha1, skeleton_lines, frame_max_num, frame_time, pos_data, rot_data)
+
+        if sidecar_p is not None:
+            # slice position and rotation data using start and end frame indices
+            pos_data = pos_data[start_frame_idx:end_frame_idx, :]
+            rot_data = rot_data[start_frame_idx:end_frame_idx, :]
 
         # new frame_max_num based is end_frame_idx minus start_frame_idx
         frame_max_num = end_frame_idx - start_frame_idx
 
         return BVH(bvh_p.name, root_joint, frame_max_num, frame_time, pos_data, rot_data)
 
+    @classmethod
+    def _parse_motion_data(cls, lines: List[str], frame_max_num: int) -> npt.NDArray[np.float32]:
+        """ Convert the frame lines of the MOTION section into a [frame_max_num, channel_num] array with a single bulk conversion. """
+        lines = [line for line in lines if line.strip()]
+        if len(lines) != frame_max_num:
+            msg = f'framenum specified ({frame_max_num}) and found ({len(lines)}) do not match'
+            logging.critical(msg)
+            assert False, msg
+
+        values = np.fromstring('\n'.join(lines), dtype=np.float64, sep=' ')
+        if frame_max_num == 0 or values.size % frame_max_num != 0 or values.size // frame_max_num != len(lines[0].split()):
+            msg = 'Malformed BVH motion data: frames do not all contain the same number of channels'
+            logging.critical(msg)
+            assert False, msg
+
+        return values.reshape([frame_max_num, -1]).astype(np.float32)
+
+    @classmethod
+    def _load_sidecar(cls, sidecar_p: Path, source_mtime_ns: int, source_sha1: str) -> Optional[Tuple[List[str], int, float, npt.NDArray[np.float32], npt.NDArray[np.float32]]]:
+        """ Returns skeleton lines, frame count, frame time, pos_data and rot_data from sidecar_p, or None if it is missing or stale. """
+        if not sidecar_p.exists():
+            return None
+
+        try:
+            with np.load(sidecar_p) as data:
+                if int(data['version']) != BVH_SIDECAR_VERSION or int(data['source_mtime_ns']) != source_mtime_ns or str(data['source_sha1']) != source_sha1:
+                    logging.info(f'Ignoring stale BVH sidecar {sidecar_p}')
+                    return None
+                logging.info(f'Using BVH sidecar located at {sidecar_p}')
+                return data['skeleton_lines'].tolist(), int(data['frame_max_num']), float(data['frame_time']), data['pos_data'], data['rot_data']
+        except Exception as e:
+            logging.warning(f'Ignoring unreadable BVH sidecar {sidecar_p}: {e}')
+            return None
+
+    @classmethod
+    def _save_sidecar(cls, sidecar_p: Path, source_mtime_ns: int, source_sha1: str, skeleton_lines: List[str], frame_max_num: int, frame_time: float,
+                      pos_data: npt.NDArray[np.float32], rot_data: npt.NDArray[np.float32]) -> None:
+        """ Write the sidecar to a temporary file first so concurrent readers never see a partial file. """
+        try:
+            sidecar_p.parent.mkdir(exist_ok=True, parents=True)
+            fd, tmp_fn = tempfile.mkstemp(dir=sidecar_p.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, version=np.array(BVH_SIDECAR_VERSION), source_mtime_ns=np.array(source_mtime_ns), source_sha1=np.array(source_sha1),
+                         skeleton_lines=np.array(skeleton_lines), frame_max_num=np.array(frame_max_num), frame_time=np.array(frame_time),
+                         pos_data=pos_data, rot_data=rot_data)
+            os.replace(tmp_fn, sidecar_p)
+            logging.info(f'Saved BVH sidecar to {sidecar_p}')
+        except OSError as e:
+            logging.warning(f'Could not save BVH sidecar to {sidecar_p}: {e}')
+
     @classmethod
     def _parse_skeleton(cls, lines: List[str]) -> BVH_Joint:
         """
@@ -238,7 +379,7 @@ class BVH(Transform, TimeManager):
         return BVH_Joint(name=joint_name, offset=offset, channel_order=channel_order, children=children)
 
     @classmethod
-    def _process_frame_data(cls, skeleton: BVH_Joint, frames: List[List[float]]) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+    def _process_frame_data(cls, skeleton: BVH_Joint, frames: npt.NDArray[np.float32]) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
         """ Given skeleton and frame data, return root position data and joint quaternion data, separately"""
 
         def _get_frame_channel_order(joint: BVH_Joint, channels=[]):
@@ -0,0 +1,140 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from typing import List, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+
+class MeshPointLocator():
+    """
+    Finds the triangle of a 2D triangle mesh containing each of a set of query points, and the point's barycentric coordinates within it.
+
+    Triangles are bucketed into a uniform grid of cells by their bounding boxes, so each query point is only tested
+    against the triangles overlapping its cell. All points of a query are located at once.
+    """
+
+    def __init__(self, vertices: npt.NDArray[np.float32], triangles: List[npt.NDArray[np.int32]]) -> None:
+        """
+        vertices: ndarray [V, 2] of vertex xy positions, row position is index id
+        triangles: ndarray [T, 3] of ordered ids of the vertices making up each triangle
+        """
+        self.vertices: npt.NDArray[np.float32] = vertices
+        self.triangles: npt.NDArray[np.int32] = np.asarray(triangles, dtype=np.int32).reshape([-1, 3])
+
+        tri_xys = self.vertices[self.triangles]  # [T, 3, 2]
+        self.v0 = tri_xys[:, 0]
+        self.v1 = np.subtract(tri_xys[:, 1], self.v0)
+        self.v2 = np.subtract(tri_xys[:, 2], self.v0)
+
+        # grid with about one triangle per cell, covering all triangles
+        tri_mins, tri_maxs = tri_xys.min(axis=1), tri_xys.max(axis=1)
+        self.grid_min: npt.NDArray[np.float64] = tri_mins.min(axis=0).astype(np.float64) if len(tri_xys) else np.zeros(2)
+        grid_extent = (tri_maxs.max(axis=0) - self.grid_min) if len(tri_xys) else np.ones(2)
+        grid_extent = np.maximum(grid_extent, 1e-6)
+        self.cell_num: int = max(1, int(np.sqrt(len(self.triangles))))
+        self.cell_size: npt.NDArray[np.float64] = grid_extent / self.cell_num
+
+        # pad bounding boxes slightly, so points on a triangle's perimeter are never missed due to rounding
+        eps = 1e-6 * grid_extent
+        cell_mins = self._get_cells(tri_mins - eps)
+        cell_maxs = self._get_cells(tri_maxs + eps)
+
+        # list each (cell, triangle) pair where the triangle's bounding box overlaps the cell...
+        cell_nums_x = cell_maxs[:, 0] - cell_mins[:, 0] + 1
+        cell_nums = cell_nums_x * (cell_maxs[:, 1] - cell_mins[:, 1] + 1)
+        _tri_idxs = np.repeat(np.arange(len(self.triangles)), cell_nums)
+        _offsets = np.arange(cell_nums.sum()) - np.repeat(np.cumsum(cell_nums) - cell_nums, cell_nums)
+        _xs = cell_mins[_tri_idxs, 0] + _offsets % cell_nums_x[_tri_idxs]
+        _ys = cell_mins[_tri_idxs, 1] + _offsets // cell_nums_x[_tri_idxs]
+        _cell_idxs = _ys * self.cell_num + _xs
+
+        # ...and store the triangle ids of each cell contiguously, in ascending order
+        order = np.lexsort([_tri_idxs, _cell_idxs])
+        self.cell_tri_idxs: npt.NDArray[np.int64] = _tri_idxs[order]
+        self.cell_starts: npt.NDArray[np.int64] = np.searchsorted(_cell_idxs[order], np.arange(self.cell_num ** 2 + 1))
+
+    def _get_cells(self, xys: npt.NDArray[np.float32]) -> npt.NDArray[np.int64]:
+        """ Returns the [N, 2] column and row of the grid cell containing each xy, clamped to the grid. """
+        return np.clip(np.floor((xys - self.grid_min) / self.cell_size), 0, self.cell_num - 1).astype(np.int64)
+
+    def locate(self, points: npt.NDArray[np.float32]) -> Tuple[npt.NDArray[np.int64], npt.NDArray[np.float32]]:
+        """
+        points: ndarray [N, 2] of point xy coords
+
+        Is point inside triangle? : https://mathworld.wolfram.com/TriangleInterior.html
+
+        Returns, for each point, the id of the first triangle it is inside of or, failing that, on the perimeter of (-1 if neither),
+        and its barycentric coordinates [u, v, w] wrt that triangle's vertices (zeros if it is outside the mesh).
+        """
+        points = np.asarray(points).reshape([-1, 2])
+        point_num = len(points)
+
+        # candidate (point, triangle) pairs: each point with every triangle overlapping its grid cell.
+        # Points outside the grid are clamped to its border cells, whose triangles they will then fail to be inside of
+        cells = self._get_cells(points)
+        cell_idxs = cells[:, 1] * self.cell_num + cells[:, 0]
+        starts = self.cell_starts[cell_idxs]
+        counts = self.cell_starts[cell_idxs + 1] - starts
+        pair_point_idxs = np.repeat(np.arange(point_num), counts)
+        pair_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_tri_idxs = self.cell_tri_idxs[np.repeat(starts, counts) + pair_offsets]
+
+        def det(u: npt.NDArray[np.float32], v: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+            """ helper function returns determinents of two [N,2] arrays"""
+            ux, uy = u[:, 0], u[:, 1]
+            vx, vy = v[:, 0], v[:, 1]
+            return ux*vy - uy*vx
+
+        p = points[pair_point_idxs]
+        v0, v1, v2 = self.v0[pair_tri_idxs], self.v1[pair_tri_idxs], self.v2[pair_tri_idxs]
+        a =  (det(p, v2) - det(v0, v2)) / det(v1, v2)
+        b = -(det(p, v1) - det(v0, v1)) / det(v1, v2)
+
+        # pick the first triangle each point is in, or else the first triangle it is on the perimeter of
+        in_triangle = np.bitwise_and(np.bitwise_and(a > 0, b > 0), a + b < 1)
+        on_triangle_perimeter = np.bitwise_and(np.bitwise_and(a >= 0, b >= 0), a + b <= 1)
+        tri_idxs = np.full(point_num, -1, dtype=np.int64)
+        for mask in [on_triangle_perimeter, in_triangle]:  # later assignments win, so strictly-inside matches take precedence
+            first = np.full(point_num, np.iinfo(np.int64).max)
+            np.minimum.at(first, pair_point_idxs[mask], pair_tri_idxs[mask])
+            found = first != np.iinfo(np.int64).max
+            tri_idxs[found] = first[found]
+
+        bcs = np.zeros([point_num, 3], dtype=np.float32)
+        located = tri_idxs >= 0
+        if np.any(located):
+            tri_xys = self.vertices[self.triangles[tri_idxs[located]]]
+            bcs[located] = self._get_barycentric_coords(points[located], tri_xys[:, 0], tri_xys[:, 1], tri_xys[:, 2])
+
+        return tri_idxs, bcs
+
+    @staticmethod
+    def _get_barycentric_coords(p: npt.NDArray[np.float32],
+                                a: npt.NDArray[np.float32],
+                                b: npt.NDArray[np.float32],
+                                c: npt.NDArray[np.float32]
+                                ) -> npt.NDArray[np.float32]:
+        """
+        As described in Christer Ericson's Real-Time Collision Detection.
+        p: [N, 2] the input points
+        a, b, c: [N, 2] the vertices of each point's triangle
+
+        Returns ndarray [N, 3], the barycentric coordinates [u, v, w] of each p wrt vertices a, b, c
+        """
+        v0: npt.NDArray[np.float32] = np.subtract(b, a)
+        v1: npt.NDArray[np.float32] = np.subtract(c, a)
+        v2: npt.NDArray[np.float32] = np.subtract(p, a)
+        d00 = np.sum(v0 * v0, axis=1)
+        d01 = np.sum(v0 * v1, axis=1)
+        d11 = np.sum(v1 * v1, axis=1)
+        d20 = np.sum(v2 * v0, axis=1)
+        d21 = np.sum(v2 * v1, axis=1)
+        denom = d00 * d11 - d01 * d01
+        v = (d11 * d20 - d01 * d21) / denom
+        w = (d00 * d21 - d01 * d20) / denom
+        u = 1.0 - v - w
+
+        return np.stack([u, v, w], axis=1)
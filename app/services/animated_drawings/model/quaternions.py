@@ -97,6 +97,29 @@ class Quaternions:
                          [r20, r21, r22, 0.0],
                          [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
 
+    def to_rotation_matrices(self) -> npt.NDArray[np.float32]:
+        """
+        Batched counterpart of to_rotation_matrix().
+        :return: [..., 3, 3] rotation matrix for each quaternion, keeping the leading dimensions of qs
+        """
+        w, x, y, z = np.moveaxis(self.qs, -1, 0)
+
+        xx, yy, zz = x**2, y**2, z**2
+        wx, wy, wz = w*x, w*y, w*z
+        xy, xz, yz = x*y, x*z, y*z
+
+        rs = np.empty([*self.qs.shape[:-1], 3, 3], dtype=np.float32)
+        rs[..., 0, 0] = 1 - 2 * (yy + zz)
+        rs[..., 0, 1] = 2 * (xy - wz)
+        rs[..., 0, 2] = 2 * (xz + wy)
+        rs[..., 1, 0] = 2 * (xy + wz)
+        rs[..., 1, 1] = 1 - 2 * (xx + zz)
+        rs[..., 1, 2] = 2 * (yz - wx)
+        rs[..., 2, 0] = 2 * (xz - wy)
+        rs[..., 2, 1] = 2 * (yz + wx)
+        rs[..., 2, 2] = 1 - 2 * (xx + yy)
+        return rs
+
     @classmethod
     def rotate_between_vectors(cls, v1: Vectors, v2: Vectors) -> Quaternions:
         """ Computes quaternion rotating from v1 to v2.  """
@@ -5,6 +5,7 @@
 import numpy as np
 import OpenGL.GL as GL
 from app.services.animated_drawings.model.transform import Transform
+from app.services.animated_drawings.view.shaders.shader import GLState
 import ctypes
 
 
@@ -59,10 +60,14 @@ class Rectangle(Transform):
 
     def _draw(self, **kwargs) -> None:
 
-        GL.glPolygonMode(GL.GL_FRONT_AND_BACK, GL.GL_FILL)
-        GL.glUseProgram(kwargs['shader_ids']['color_shader'])
-        model_loc = GL.glGetUniformLocation(kwargs['shader_ids']['color_shader'], "model")
-        GL.glUniformMatrix4fv(model_loc, 1, GL.GL_FALSE, self._world_transform.T)
+        gl_state: GLState = kwargs['gl_state']
+        gl_state.set_capability(GL.GL_DEPTH_TEST, True)
+        gl_state.set_polygon_mode(GL.GL_FILL)
+        gl_state.set_uniform_matrix(kwargs['shaders']['color_shader'], 'model', self._world_transform)
 
         GL.glBindVertexArray(self.vao)
         GL.glDrawArrays(GL.GL_TRIANGLES, 0, 6)
+
+    def _cleanup(self) -> None:
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(1, [self.vbo])
@@ -3,13 +3,18 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
 from app.services.animated_drawings.model.bvh import BVH
 import numpy as np
 import numpy.typing as npt
 import math
 from app.services.animated_drawings.model.joint import Joint
 from sklearn.decomposition import PCA
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional
 from app.services.animated_drawings.model.vectors import Vectors
 from app.services.animated_drawings.model.quaternions import Quaternions
 from app.services.animated_drawings.config import MotionConfig, RetargetConfig
@@ -17,6 +22,8 @@ from app.services.animated_drawings.config import MotionConfig, RetargetConfig
 x_axis = np.array([1.0, 0.0, 0.0], dtype=np.float32)
 z_axis = np.array([0.0, 0.0, 1.0], dtype=np.float32)
 
+RETARGET_CACHE_VERSION = 1  # increment when the cached arrays or the code computing them change
+
 
 class Retargeter():
     """
@@ -27,50 +34,110 @@ class Retargeter():
     bone orientations, joint 'depths', and root offsets for each frame.
     """
 
-    def __init__(self, motion_cfg: MotionConfig, retarget_cfg: RetargetConfig) -> None:
+    def __init__(self, motion_cfg: MotionConfig, retarget_cfg: RetargetConfig, cache_dir: Optional[Path] = None, bvh_cache_dir: Optional[Path] = None) -> None:
+        """
+        If cache_dir is specified, the character-independent results (joint positions, forward vectors, projection planes,
+        depths and bone orientations) are loaded from a file keyed by the motion config, retarget config and BVH file,
+        or computed and saved there if not yet present. On a cache hit, the BVH itself is only loaded if self.bvh is accessed.
+        If bvh_cache_dir is specified, the parsed BVH is kept there in a sidecar file (see BVH.from_file).
+        """
+
+        self.motion_cfg: MotionConfig = motion_cfg
+
+        # bvh joints defining a set of vectors that skeleton's fwd is perpendicular to
+        self.forward_perp_vector_joint_names: List[Tuple[str, str]] = motion_cfg.forward_perp_joint_vectors
+
+        self._bvh: Optional[BVH] = None
+        self._bvh_cache_dir: Optional[Path] = bvh_cache_dir
+
+        self.bvh_joint_names: List[str]
+        self.frame_time: float
+        self.frame_max_num: int
+        self.joint_positions: npt.NDArray[np.float32]
+        self.fwd_vectors: npt.NDArray[np.float32]
+        self.bvh_root_positions: npt.NDArray[np.float32]
+
+        # get & save projection planes
+        self.joint_group_name_to_projection_plane: Dict[ str, npt.NDArray[np.float32]] = {}
+        self.joint_to_projection_plane: Dict[ str, npt.NDArray[np.float32]] = {}
+
+        # map bvh joint names to its distance to project plane (useful for rendering order)
+        self.bvh_joint_to_projection_depth: Dict[str, npt.NDArray[np.float32]] = {}
+
+        # map (bvh prox joint name, bvh dist joint name) to bone orientations
+        self._bvh_bone_to_orientation: Dict[Tuple[str, str], npt.NDArray[np.float32]] = {}
+
+        cache_p: Optional[Path] = None
+        if cache_dir is not None:
+            cache_p = Path(cache_dir, f'{self._get_cache_key(motion_cfg, retarget_cfg)}.npz')
+
+        if cache_p is not None and cache_p.exists():
+            self._load_cache(cache_p)
+        else:
+            self._compute_bvh_motion_data(retarget_cfg)
+            if cache_p is not None:
+                self._save_cache(cache_p)
+
+        for joint_projection_group in retarget_cfg.bvh_projection_bodypart_groups:
+            for joint_name in joint_projection_group['bvh_joint_names']:
+                self.joint_to_projection_plane[joint_name] = self.joint_group_name_to_projection_plane[joint_projection_group['name']]
+
+        # cache the starting worldspace location of character's root joint
+        self.character_start_loc: npt.NDArray[np.float32] = np.array(retarget_cfg.char_start_loc, dtype=np.float32)
+
+        # holds world coordinates of character root joint after retargeting
+        self.char_root_positions: npt.NDArray[np.float32]
+
+        # map character joint names to its orientations
+        self.char_joint_to_orientation: Dict[str, npt.NDArray[np.float32]] = {}
+
+    @property
+    def bvh(self) -> BVH:
+        """ The BVH driving the retargeter, loaded on first access if its motion data came from the cache. """
+        if self._bvh is None:
+            self._bvh = self._load_bvh(self.motion_cfg, self._bvh_cache_dir)
+        return self._bvh
+
+    @staticmethod
+    def _load_bvh(motion_cfg: MotionConfig, bvh_cache_dir: Optional[Path] = None) -> BVH:
+        """ Load the BVH specified in motion_cfg and transform it so up is +Y, forward is +X, and it stands above the origin on the y=0 plane. """
 
         # instantiate the bvh
         try:
-            self.bvh = BVH.from_file(str(motion_cfg.bvh_p), motion_cfg.start_frame_idx, motion_cfg.end_frame_idx)
+            bvh = BVH.from_file(str(motion_cfg.bvh_p), motion_cfg.start_frame_idx, motion_cfg.end_frame_idx, cache_dir=bvh_cache_dir)
         except Exception as e:
             msg = f'Error loading BVH: {e}'
             logging.critical(msg)
             assert False, msg
 
-        # get and cache bvh joint names for later
-        self.bvh_joint_names = self.bvh.get_joint_names()
-
-        # bvh joints defining a set of vectors that skeleton's fwd is perpendicular to
-        self.forward_perp_vector_joint_names: List[Tuple[str, str]] = motion_cfg.forward_perp_joint_vectors
-
         # override the frame_time, if one was specified within motion_cfg
         if motion_cfg.frame_time:
-            self.bvh.frame_time = motion_cfg.frame_time
+            bvh.frame_time = motion_cfg.frame_time
 
         # rotate BVH skeleton so up is +Y
         if motion_cfg.up == '+y':
             pass  # no rotation needed
         elif motion_cfg.up == '+z':
-            self.bvh.set_rotation(Quaternions.from_euler_angles('yx', np.array([-90.0, -90.0])))
+            bvh.set_rotation(Quaternions.from_euler_angles('yx', np.array([-90.0, -90.0])))
         else:
             msg = f'up value not implemented: {motion_cfg.up}'
             logging.critical(msg)
             assert False, msg
 
         # rotate BVH skeleton so forward is +X
-        skeleton_fwd: Vectors = self.bvh.get_skeleton_fwd(self.forward_perp_vector_joint_names)
+        skeleton_fwd: Vectors = bvh.get_skeleton_fwd(motion_cfg.forward_perp_joint_vectors)
         q: Quaternions = Quaternions.rotate_between_vectors(skeleton_fwd, Vectors([1.0, 0.0, 0.0]))
-        self.bvh.rotation_offset(q)
+        bvh.rotation_offset(q)
 
         # scale BVH
-        self.bvh.set_scale(motion_cfg.scale)
+        bvh.set_scale(motion_cfg.scale)
 
         # position above origin
-        self.bvh.offset(-self.bvh.root_joint.get_world_position())
+        bvh.offset(-bvh.root_joint.get_world_position())
 
         # adjust bvh skeleton y pos by getting groundplane joint...
         try:
-            groundplane_joint = self.bvh.root_joint.get_transform_by_name(motion_cfg.groundplane_joint)
+            groundplane_joint = bvh.root_joint.get_transform_by_name(motion_cfg.groundplane_joint)
             assert isinstance(groundplane_joint, Joint), f'could not find joint by name: {motion_cfg.groundplane_joint}'
         except Exception as e:
             msg = f'Error getting groundplane joint: {e}'
@@ -79,22 +146,21 @@ class Retargeter():
 
         # ... and moving the bvh so it is on the y=0 plane
         bvh_groundplane_y = groundplane_joint.get_world_position()[1]
-        self.bvh.offset(np.array([0, -bvh_groundplane_y, 0]))
+        bvh.offset(np.array([0, -bvh_groundplane_y, 0]))
 
-        self.joint_positions: npt.NDArray[np.float32]
-        self.fwd_vectors: npt.NDArray[np.float32]
-        self.bvh_root_positions: npt.NDArray[np.float32]
-        self._compute_normalized_joint_positions_and_fwd_vectors()
+        return bvh
 
-        # cache the starting worldspace location of character's root joint
-        self.character_start_loc: npt.NDArray[np.float32] = np.array(retarget_cfg.char_start_loc, dtype=np.float32)
+    def _compute_bvh_motion_data(self, retarget_cfg: RetargetConfig) -> None:
+        """ Compute everything the retargeter needs from the BVH that does not depend upon the character. """
 
-        # holds world coordinates of character root joint after retargeting
-        self.char_root_positions: npt.NDArray[np.float32]
+        # get and cache bvh joint names for later
+        self.bvh_joint_names = self.bvh.get_joint_names()
+
+        self.frame_time = self.bvh.frame_time
+        self.frame_max_num = self.bvh.frame_max_num
+
+        self._compute_normalized_joint_positions_and_fwd_vectors()
 
-        # get & save projection planes
-        self.joint_group_name_to_projection_plane: Dict[ str, npt.NDArray[np.float32]] = {}
-        self.joint_to_projection_plane: Dict[ str, npt.NDArray[np.float32]] = {}
         for joint_projection_group in retarget_cfg.bvh_projection_bodypart_groups:
             group_name = joint_projection_group['name']
             joint_names = joint_projection_group['bvh_joint_names']
@@ -106,11 +172,73 @@ class Retargeter():
             for joint_name in joint_projection_group['bvh_joint_names']:
                 self.joint_to_projection_plane[joint_name] = projection_plane
 
-        # map character joint names to its orientations
-        self.char_joint_to_orientation: Dict[str, npt.NDArray[np.float32]] = {}
+        self.bvh_joint_to_projection_depth = self._compute_depths()
+
+        for bvh_prox_joint_name, bvh_dist_joint_name in retarget_cfg.char_joint_bvh_joints_mapping.values():
+            self._get_bvh_bone_orientations(bvh_prox_joint_name, bvh_dist_joint_name)
+
+    @staticmethod
+    def _get_cache_key(motion_cfg: MotionConfig, retarget_cfg: RetargetConfig) -> str:
+        """ Hash of everything the character-independent retargeting results depend upon. """
+        cfg_values = [
+            RETARGET_CACHE_VERSION,
+            motion_cfg.start_frame_idx,
+            motion_cfg.end_frame_idx,
+            motion_cfg.frame_time,
+            motion_cfg.groundplane_joint,
+            motion_cfg.forward_perp_joint_vectors,
+            motion_cfg.scale,
+            motion_cfg.up,
+            retarget_cfg.bvh_projection_bodypart_groups,
+        ]
+        h = hashlib.sha1(json.dumps(cfg_values, sort_keys=True, default=list).encode())
+        h.update(Path(motion_cfg.bvh_p).read_bytes())
+        return f'{Path(motion_cfg.bvh_p).stem}_{h.hexdigest()}'
+
+    def _save_cache(self, cache_p: Path) -> None:
+        """ Write the character-independent results to cache_p. Written to a temporary file first so concurrent readers never see a partial file. """
+        group_names = list(self.joint_group_name_to_projection_plane.keys())
+        depth_joint_names = list(self.bvh_joint_to_projection_depth.keys())
+        bones = list(self._bvh_bone_to_orientation.keys())
+
+        arrays: Dict[str, npt.NDArray] = {
+            'bvh_joint_names': np.array(self.bvh_joint_names),
+            'frame_time': np.array(self.frame_time),
+            'frame_max_num': np.array(self.frame_max_num),
+            'joint_positions': self.joint_positions,
+            'fwd_vectors': self.fwd_vectors,
+            'bvh_root_positions': self.bvh_root_positions,
+            'projection_group_names': np.array(group_names),
+            'projection_planes': np.array([self.joint_group_name_to_projection_plane[name] for name in group_names], dtype=np.float32).reshape([-1, 3]),
+            'depth_joint_names': np.array(depth_joint_names),
+            'depths': np.array([self.bvh_joint_to_projection_depth[name] for name in depth_joint_names], dtype=np.float32).reshape([-1, self.frame_max_num]),
+            'orientation_bones': np.array(bones).reshape([-1, 2]),
+            'orientations': np.array([self._bvh_bone_to_orientation[bone] for bone in bones], dtype=np.float32).reshape([-1, self.frame_max_num]),
+        }
 
-        # map bvh joint names to its distance to project plane (useful for rendering order)
-        self.bvh_joint_to_projection_depth: Dict[str, npt.NDArray[np.float32]] = self._compute_depths()
+        try:
+            cache_p.parent.mkdir(exist_ok=True, parents=True)
+            fd, tmp_fn = tempfile.mkstemp(dir=cache_p.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_fn, cache_p)
+            logging.info(f'Saved retarget cache to {cache_p}')
+        except OSError as e:
+            logging.warning(f'Could not save retarget cache to {cache_p}: {e}')
+
+    def _load_cache(self, cache_p: Path) -> None:
+        """ Read the character-independent results from cache_p. """
+        logging.info(f'Using retarget cache located at {cache_p}')
+        with np.load(cache_p) as data:
+            self.bvh_joint_names = data['bvh_joint_names'].tolist()
+            self.frame_time = float(data['frame_time'])
+            self.frame_max_num = int(data['frame_max_num'])
+            self.joint_positions = data['joint_positions']
+            self.fwd_vectors = data['fwd_vectors']
+            self.bvh_root_positions = data['bvh_root_positions']
+            self.joint_group_name_to_projection_plane = dict(zip(data['projection_group_names'].tolist(), data['projection_planes']))
+            self.bvh_joint_to_projection_depth = dict(zip(data['depth_joint_names'].tolist(), data['depths']))
+            self._bvh_bone_to_orientation = {tuple(bone): orientations for bone, orientations in zip(data['orientation_bones'].tolist(), data['orientations'])}
 
     def _compute_normalized_joint_positions_and_fwd_vectors(self) -> None:
         """
@@ -120,13 +248,10 @@ class Retargeter():
         Repositions them so root is above the origin.
         Rotates them so skeleton faces along the +X axis.
         """
-        # get joint positions and forward vectors
-        self.joint_positions = np.empty([self.bvh.frame_max_num, 3 * self.bvh.joint_num], dtype=np.float32)
-        self.fwd_vectors = np.empty([self.bvh.frame_max_num, 3], dtype=np.float32)
-        for frame_idx in range(self.bvh.frame_max_num):
-            self.bvh.apply_frame(frame_idx)
-            self.joint_positions[frame_idx] = self.bvh.root_joint.get_chain_worldspace_positions()
-            self.fwd_vectors[frame_idx] = self.bvh.get_skeleton_fwd(self.forward_perp_vector_joint_names).vs[0]
+        # get joint positions and forward vectors for all frames at once
+        joint_world_positions = self.bvh.get_joint_world_positions()
+        self.joint_positions = joint_world_positions.reshape([self.bvh.frame_max_num, 3 * self.bvh.joint_num])
+        self.fwd_vectors = self.bvh.get_skeleton_fwd_vectors(self.forward_perp_vector_joint_names, joint_world_positions).vs.astype(np.float32)
 
         # reposition over origin
         self.bvh_root_positions = self.joint_positions[:, :3]
@@ -260,27 +385,33 @@ class Retargeter():
         Calculates the orientation (degrees CCW of +Y axis) of the vector from bvh_prox_joint->bvh_dist_joint using the
         projection plane of bvh_dist_joint. Results are saved into a dictionary using char_joint_name as the key.
         """
+        self.char_joint_to_orientation[char_joint_name] = self._get_bvh_bone_orientations(bvh_prox_joint_name, bvh_dist_joint_name)
+
+    def _get_bvh_bone_orientations(self, bvh_prox_joint_name: str, bvh_dist_joint_name: str) -> npt.NDArray[np.float32]:
+        """
+        Returns the orientation (degrees CCW of +Y axis) at each frame of the vector from bvh_prox_joint->bvh_dist_joint using the
+        projection plane of bvh_dist_joint. Results are independent of the character, so they are kept (and cached) per bvh bone.
+        """
+        if (bvh_prox_joint_name, bvh_dist_joint_name) in self._bvh_bone_to_orientation:
+            return self._bvh_bone_to_orientation[(bvh_prox_joint_name, bvh_dist_joint_name)]
 
         # get distal end joint
-        dist_joint = self.bvh.root_joint.get_transform_by_name(bvh_dist_joint_name)
-        if dist_joint is None or not isinstance(dist_joint, Joint) or dist_joint.name is None:
-            msg = 'error finding joint {bvh_dist_joint_name}'
+        if bvh_dist_joint_name not in self.bvh_joint_names:
+            msg = f'error finding joint {bvh_dist_joint_name}'
             logging.critical(msg)
             assert False, msg
 
         # get prox joint
-        prox_joint = self.bvh.root_joint.get_transform_by_name(bvh_prox_joint_name)
-        if prox_joint is None or not isinstance(prox_joint, Joint) or prox_joint.name is None:
-            msg = 'joint {bvh_prox_joint_name} has no parent joint, therefore no bone orientation. Returning zero'
+        if bvh_prox_joint_name not in self.bvh_joint_names:
+            msg = f'joint {bvh_prox_joint_name} has no parent joint, therefore no bone orientation. Returning zero'
             logging.info(msg)
-            self.char_joint_to_orientation[char_joint_name] = np.zeros(self.joint_positions.shape[0], dtype=np.float32)
-            return
+            return np.zeros(self.joint_positions.shape[0], dtype=np.float32)
 
         # get joint xyz locations
-        dist_joint_idx = self.bvh_joint_names.index(dist_joint.name)
+        dist_joint_idx = self.bvh_joint_names.index(bvh_dist_joint_name)
         dist_joint_xyz = self.joint_positions[:, 3*dist_joint_idx:3*(dist_joint_idx+1)]
 
-        prox_joint_idx = self.bvh_joint_names.index(prox_joint.name)
+        prox_joint_idx = self.bvh_joint_names.index(bvh_prox_joint_name)
         prox_joint_xyz = self.joint_positions[:, 3*prox_joint_idx:3*(prox_joint_idx+1)]
 
         # compute the bone vector
@@ -315,7 +446,22 @@ class Retargeter():
         theta = np.where(theta < 0.0, theta + 360, theta)
 
         # save it
-        self.char_joint_to_orientation[char_joint_name] = np.array(theta)
+        self._bvh_bone_to_orientation[(bvh_prox_joint_name, bvh_dist_joint_name)] = np.array(theta)
+        return self._bvh_bone_to_orientation[(bvh_prox_joint_name, bvh_dist_joint_name)]
+
+    def get_bvh_bone_length(self, bvh_prox_joint_name: str, bvh_dist_joint_name: str) -> float:
+        """ Returns the worldspace distance between two bvh joints, measured in the last frame of the bvh. """
+        for joint_name in (bvh_prox_joint_name, bvh_dist_joint_name):
+            if joint_name not in self.bvh_joint_names:
+                msg = f'error finding joint {joint_name}'
+                logging.critical(msg)
+                assert False, msg
+
+        prox_joint_idx = self.bvh_joint_names.index(bvh_prox_joint_name)
+        dist_joint_idx = self.bvh_joint_names.index(bvh_dist_joint_name)
+        prox_joint_xyz = self.joint_positions[-1, 3*prox_joint_idx:3*(prox_joint_idx+1)]
+        dist_joint_xyz = self.joint_positions[-1, 3*dist_joint_idx:3*(dist_joint_idx+1)]
+        return float(np.linalg.norm(dist_joint_xyz - prox_joint_xyz))
 
     def get_retargeted_frame_data(self, time: float) -> Tuple[Dict[str, float], Dict[str, float], npt.NDArray[np.float32]]:
         """
@@ -325,16 +471,24 @@ class Retargeter():
             - joint_depths, dictionary mapping from BVH skeleton's joint names to distance from joint to projection plane
             - root_positions, the position of the character's root at this frame.
         """
-        frame_idx = int(round(time / self.bvh.frame_time, 0))
+        return self.get_retargeted_frame_data_by_idx(self.get_frame_idx(time))
+
+    def get_frame_idx(self, time: float) -> int:
+        """ Input: time, in seconds. Returns the index of the BVH frame to use at that time, clamped to the valid range. """
+        frame_idx = int(round(time / self.frame_time, 0))
 
         if frame_idx < 0:
             logging.info(f'invalid frame_idx ({frame_idx}), replacing with 0')
             frame_idx = 0
 
-        if self.bvh.frame_max_num <= frame_idx:
-            logging.info(f'invalid frame_idx ({frame_idx}), replacing with last frame {self.bvh.frame_max_num-1}')
-            frame_idx = self.bvh.frame_max_num-1
+        if self.frame_max_num <= frame_idx:
+            logging.info(f'invalid frame_idx ({frame_idx}), replacing with last frame {self.frame_max_num-1}')
+            frame_idx = self.frame_max_num-1
+
+        return frame_idx
 
+    def get_retargeted_frame_data_by_idx(self, frame_idx: int) -> Tuple[Dict[str, float], Dict[str, float], npt.NDArray[np.float32]]:
+        """ Same as get_retargeted_frame_data(), but for the frame at frame_idx. """
         orientations = {key: val[frame_idx] for (key, val) in self.char_joint_to_orientation.items()}
 
         joint_depths = {key: val[frame_idx] for (key, val) in self.bvh_joint_to_projection_depth.items()}
@@ -343,3 +497,31 @@ class Retargeter():
         root_position += self.character_start_loc  # offset by character's starting location
 
         return orientations, joint_depths, root_position
+
+    def get_char_joint_orientations(self, char_joint_names: List[str]) -> npt.NDArray[np.float32]:
+        """
+        Array-backed counterpart of the orientations returned by get_retargeted_frame_data(), for all frames at once.
+        Returns ndarray [F, J]: the orientation of each of char_joint_names at each frame, NaN for joints without one.
+        """
+        orientations = np.full([self.frame_max_num, len(char_joint_names)], np.nan, dtype=np.float32)
+        for joint_id, joint_name in enumerate(char_joint_names):
+            if joint_name in self.char_joint_to_orientation:
+                orientations[:, joint_id] = self.char_joint_to_orientation[joint_name]
+        return orientations
+
+    def get_bvh_joint_depths(self, bvh_joint_names: List[str]) -> npt.NDArray[np.float32]:
+        """
+        Array-backed counterpart of the joint_depths returned by get_retargeted_frame_data(), for all frames at once.
+        Returns ndarray [F, J]: the distance from each of bvh_joint_names to its projection plane at each frame.
+        """
+        return np.array([self.bvh_joint_to_projection_depth[joint_name] for joint_name in bvh_joint_names], dtype=np.float32).reshape([-1, self.frame_max_num]).T
+
+    def get_char_root_positions(self) -> npt.NDArray[np.float32]:
+        """
+        Array-backed counterpart of the root_position returned by get_retargeted_frame_data(), for all frames at once.
+        Returns ndarray [F, 3]: the position of the character's root at each frame.
+        """
+        root_positions = np.zeros([self.frame_max_num, 3], dtype=np.float32)
+        root_positions[:, :2] = self.char_root_positions
+        root_positions += self.character_start_loc  # offset by character's starting location
+        return root_positions
@@ -25,9 +25,9 @@ class Scene(Transform, TimeManager):
             self.add_child(Floor())
 
         # Add the Animated Drawings
-        for each in cfg.animated_characters:
+        for each, mesh_lod in zip(cfg.animated_characters, cfg.animated_character_mesh_lods):
 
-            ad = AnimatedDrawing(*each)
+            ad = AnimatedDrawing(*each, cache_dir=cfg.cache_dir, character_cache_dir=cfg.character_cache_dir, precompute_arap=cfg.precompute_arap, mesh_lod=mesh_lod)
             self.add_child(ad)
 
             # add bvh to the scene if we're going to visualize it
@@ -183,6 +183,15 @@ class Transform():
         self._rotate_m = q.to_rotation_matrix()
         self.dirty_bit = True
 
+    def set_rotation_matrix(self, rotate_m: npt.NDArray[np.float32]) -> None:
+        """ Set the rotation from a precomputed 4x4 rotation matrix. The matrix is used as is, not copied. """
+        if rotate_m.shape != (4, 4):
+            msg = f'set_rotation_matrix rotate_m must have dimension (4, 4). Found: {rotate_m.shape}'
+            logging.critical(msg)
+            assert False, msg
+        self._rotate_m = rotate_m
+        self.dirty_bit = True
+
     def rotation_offset(self, q: Quaternions) -> None:
         if q.qs.shape != (1, 4):
             msg = f'set_rotate q must have dimension (1, 4). Found: {q.qs.shape}'
@@ -231,3 +240,14 @@ class Transform():
 
     def _draw(self, **kwargs) -> None:
         """Transforms default to not being drawn. Subclasses must implement how they appear"""
+
+    def cleanup(self, recurse: bool = True) -> None:
+        """ Release resources held by this transform and recurse on children """
+        self._cleanup()
+
+        if recurse:
+            for child in self.get_children():
+                child.cleanup()
+
+    def _cleanup(self) -> None:
+        """Transforms default to holding no resources. Subclasses that create OpenGL objects must delete them"""
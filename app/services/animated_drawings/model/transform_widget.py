@@ -3,6 +3,7 @@
 # LICENSE file in the root directory of this source tree.
 
 from app.services.animated_drawings.model.transform import Transform
+from app.services.animated_drawings.view.shaders.shader import GLState
 import numpy as np
 import numpy.typing as npt
 import OpenGL.GL as GL
@@ -62,12 +63,18 @@ class TransformWidget(Transform):
         if not self._is_opengl_initialized:
             self._initialize_opengl_resources()
 
-        GL.glUseProgram(kwargs['shader_ids'][self.shader_name])
-        model_loc = GL.glGetUniformLocation(
-            kwargs['shader_ids'][self.shader_name], "model")
-        GL.glUniformMatrix4fv(model_loc, 1, GL.GL_FALSE,
-                              self._world_transform.T)
+        gl_state: GLState = kwargs['gl_state']
+        gl_state.set_capability(GL.GL_DEPTH_TEST, True)
+        gl_state.set_uniform_matrix(kwargs['shaders'][self.shader_name], 'model', self._world_transform)
 
         GL.glBindVertexArray(self.vao)
         GL.glDrawArrays(GL.GL_LINES, 0, len(self.points))
         GL.glBindVertexArray(0)
+
+    def _cleanup(self) -> None:
+        if not self._is_opengl_initialized:
+            return
+
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(1, [self.vbo])
+        self._is_opengl_initialized = False
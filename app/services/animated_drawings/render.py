@@ -2,8 +2,13 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+from __future__ import annotations
 import logging
 import sys
+from typing import Optional, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from app.services.animated_drawings.config import Config
 
 
 def start(user_mvc_cfg_fn: str):
@@ -28,6 +33,111 @@ def start(user_mvc_cfg_fn: str):
     controller.run()
 
 
+class RenderWorker:
+    """
+    Long-lived renderer for a stream of 'video_render' jobs using a headless view: the mesa view or the software view.
+    Jobs are rendered one at a time by render(), or several in a single render pass by render_batch().
+    The view (for the mesa view, its OSMesa context and compiled shaders) is created by the first job and reused by the following ones;
+    only the scene, camera, background and video writer are rebuilt for each job.
+    A RenderWorker must be used from the thread (or process) that created it.
+    """
+
+    def __init__(self) -> None:
+        from app.services.animated_drawings.view.view import View
+        self.view: Optional[View] = None
+
+    def render(self, user_mvc_cfg_fn: str) -> None:
+        """ Render the video described by the mvc config at user_mvc_cfg_fn. """
+
+        # build cfg
+        from app.services.animated_drawings.config import Config
+        cfg: Config = Config(user_mvc_cfg_fn)
+        self._prep_view([cfg])
+        assert self.view is not None  # for static analysis
+
+        # create scene
+        from app.services.animated_drawings.model.scene import Scene
+        scene = Scene(cfg.scene)
+
+        # create controller, leaving the view alive once the run loop is finished
+        from app.services.animated_drawings.controller.video_render_controller import VideoRenderController
+        controller = VideoRenderController(cfg.controller, scene, self.view, release_view=False)
+
+        try:
+            controller.run()
+        finally:
+            scene.cleanup()
+
+    def render_batch(self, user_mvc_cfg_fns: List[str]) -> None:
+        """
+        Render the videos described by the mvc configs at user_mvc_cfg_fns in a single render pass.
+        Each video is rendered into its own tile of the framebuffer, which is read back once per frame and split into the videos.
+        Readback and writer thread settings are taken from the first config. All configs must use the same renderer.
+        """
+
+        # build cfgs
+        from app.services.animated_drawings.config import Config
+        cfgs: List[Config] = [Config(user_mvc_cfg_fn) for user_mvc_cfg_fn in user_mvc_cfg_fns]
+
+        if any(cfg.view.use_software_renderer != cfgs[0].view.use_software_renderer for cfg in cfgs):
+            msg = 'RenderWorker.render_batch requires all configs to use the same renderer'
+            logging.critical(msg)
+            assert False, msg
+
+        self._prep_view(cfgs)
+        assert self.view is not None  # for static analysis
+
+        # create scenes, one job per tile
+        from app.services.animated_drawings.model.scene import Scene
+        from app.services.animated_drawings.controller.video_render_controller import BatchRenderJob, BatchVideoRenderController
+        scenes: List[Scene] = []
+        try:
+            jobs: List[BatchRenderJob] = []
+            try:
+                for cfg, tile in zip(cfgs, self.view.tiles):
+                    scenes.append(Scene(cfg.scene))
+                    jobs.append(BatchRenderJob(cfg.controller, scenes[-1], tile.frame_rect))
+
+                # create controller, leaving the view alive once the run loop is finished
+                controller = BatchVideoRenderController(jobs, self.view, release_view=False)
+            except BaseException:
+                # the video writers of the jobs already created may have started ffmpeg subprocesses
+                for job in jobs:
+                    job.video_writer.abort()
+                raise
+            controller.run()
+        finally:
+            for scene in scenes:
+                scene.cleanup()
+
+    def _prep_view(self, cfgs: List[Config]) -> None:
+        """ Check the cfgs can be rendered by a RenderWorker, then create the view or reset it, with one tile per cfg. """
+        for cfg in cfgs:
+            if cfg.controller.mode != 'video_render' or not (cfg.view.use_mesa or cfg.view.use_software_renderer):
+                msg = 'RenderWorker requires MODE: video_render and either USE_MESA: True or USE_SOFTWARE_RENDERER: True'
+                logging.critical(msg)
+                assert False, msg
+
+        # a job using the other renderer cannot reuse the view
+        if self.view is not None and self.view.cfg.use_software_renderer != cfgs[0].view.use_software_renderer:
+            self.cleanup()
+
+        # create the view once, reset it for later jobs
+        from app.services.animated_drawings.view.view import View
+        if self.view is None:
+            self.view = View.create_view(cfgs[0].view)  # laid out with a single tile
+            if len(cfgs) > 1:
+                self.view.reset_tiles([cfg.view for cfg in cfgs])
+        else:
+            self.view.reset_tiles([cfg.view for cfg in cfgs])
+
+    def cleanup(self) -> None:
+        """ Release the view, destroying its context if it has one. """
+        if self.view is not None:
+            self.view.cleanup()
+            self.view = None
+
+
 if __name__ == '__main__':
     logging.basicConfig(filename='log.txt', level=logging.DEBUG)
 
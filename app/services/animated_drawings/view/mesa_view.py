@@ -10,14 +10,12 @@ from OpenGL import GL, osmesa
 from app.services.animated_drawings.model.camera import Camera
 from app.services.animated_drawings.model.scene import Scene
 from app.services.animated_drawings.model.transform import Transform
-from app.services.animated_drawings.view.view import View
-from app.services.animated_drawings.view.utils import get_projection_matrix
-from app.services.animated_drawings.utils import read_background_image
-from app.services.animated_drawings.view.shaders.shader import Shader
+from app.services.animated_drawings.view.view import View, ViewTile
+from app.services.animated_drawings.view.shaders.shader import Shader, GLState
 from app.services.animated_drawings.config import ViewConfig
 
 import logging
-from typing import Tuple, Dict
+from typing import Tuple, Dict, List, Optional
 import numpy as np
 import numpy.typing as npt
 from pathlib import Path
@@ -30,40 +28,56 @@ class MesaView(View):
     def __init__(self, cfg: ViewConfig) -> None:
         super().__init__(cfg)
 
-        self.camera: Camera = Camera(self.cfg.camera_pos, self.cfg.camera_fwd)
+        width, height = self._layout_tiles([cfg])
 
         self.ctx: osmesa.OSMesaContext
         self.buffer: npt.NDArray[np.uint8]
-        self._initialize_mesa()
+        self._initialize_mesa(width, height)
 
+        self.gl_state: GLState = GLState()  # all draw paths change the shader program, capabilities and polygon mode through it
         self.shaders: Dict[str, Shader] = {}
-        self.shader_ids: Dict[str, int] = {}
         self._prep_shaders()
+        self._shader_camera_m: Optional[npt.NDArray[np.float32]] = None  # the camera world transform the shaders' view matrix was last computed from
 
-        self._prep_background_image()
+        self.background_fbos: List[Tuple[ViewTile, int, int]] = []  # (tile, texture id, framebuffer object id) of each background image
+        self._prep_background_images()
 
-        self._set_shader_projections(get_projection_matrix(*self.get_framebuffer_size()))
+        self.clear_tiles: List[ViewTile] = []  # tiles without a background, cleared to a color other than the framebuffer's
 
-    def _prep_background_image(self) -> None:
-        """ Initialize framebuffer object for background image, if specified. """
+        self._shader_proj_m: Optional[npt.NDArray[np.float32]] = None  # the projection matrix last sent to the shaders
 
-        # if nothing specified, return
-        if not self.cfg.background_image:
-            return
+    def _prep_background_images(self) -> None:
+        """ Initialize a framebuffer object for the background image of each tile that has one. """
+        self.background_fbos = []
+        for tile in self.tiles:
+            if tile.background is None:
+                continue
+
+            _txtr = tile.background
+
+            txtr_h, txtr_w, _ = _txtr.shape
+            txtr_id = GL.glGenTextures(1)
+            GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 4)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, txtr_id)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_BASE_LEVEL, 0)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, 0)
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, txtr_w, txtr_h, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, _txtr)
 
-        _txtr = read_background_image(self.cfg.background_image)
+            fbo_id = GL.glGenFramebuffers(1)
+            GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, fbo_id)
+            GL.glFramebufferTexture2D(GL.GL_READ_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_TEXTURE_2D, txtr_id, 0)
 
-        self.txtr_h, self.txtr_w, _ = _txtr.shape
-        self.txtr_id = GL.glGenTextures(1)
-        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 4)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.txtr_id)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_BASE_LEVEL, 0)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, 0)
-        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, self.txtr_w, self.txtr_h, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, _txtr)
+            self.background_fbos.append((tile, txtr_id, fbo_id))
+
+    def _cleanup_background_images(self) -> None:
+        """ Delete the framebuffer objects and textures of the background images. """
+        if not self.background_fbos:
+            return
 
-        self.fboId: GL.GLint = GL.glGenFramebuffers(1)
-        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.fboId)
-        GL.glFramebufferTexture2D(GL.GL_READ_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_TEXTURE_2D, self.txtr_id, 0)
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, 0)
+        GL.glDeleteFramebuffers(len(self.background_fbos), [fbo_id for _, _, fbo_id in self.background_fbos])
+        GL.glDeleteTextures([txtr_id for _, txtr_id, _ in self.background_fbos])
+        self.background_fbos = []
 
     def _prep_shaders(self) -> None:
         BVH_VERT = Path(resource_filename(__name__, "shaders/bvh.vert"))
@@ -79,66 +93,119 @@ class MesaView(View):
         self._initiatize_shader('texture_shader', str(TEXTURE_VERT), str(TEXTURE_FRAG), texture=True)
 
     def _update_shaders_view_transform(self, camera: Camera) -> None:
+        # the view matrix is only sent again when the camera has moved
+        camera_m = camera.get_world_transform()
+        if np.array_equal(camera_m, self._shader_camera_m):
+            return
+        self._shader_camera_m = camera_m
+
         try:
-            view_transform: npt.NDArray[np.float32] = np.linalg.inv(camera.get_world_transform())
+            view_transform: npt.NDArray[np.float32] = np.linalg.inv(camera_m)
         except Exception as e:
             msg = f'Error inverting camera world transform: {e}'
             logging.critical(msg)
             assert False, msg
 
-        for shader_name in self.shaders:
-            GL.glUseProgram(self.shader_ids[shader_name])
-            view_loc = GL.glGetUniformLocation(self.shader_ids[shader_name], "view")
-            GL.glUniformMatrix4fv(view_loc, 1, GL.GL_FALSE, view_transform.T)
+        for shader in self.shaders.values():
+            self.gl_state.set_uniform_matrix(shader, 'view', view_transform)
 
     def _set_shader_projections(self, proj_m: npt.NDArray[np.float32]) -> None:
-        for shader_id in self.shader_ids.values():
-            GL.glUseProgram(shader_id)
-            proj_loc = GL.glGetUniformLocation(shader_id, "proj")
-            GL.glUniformMatrix4fv(proj_loc, 1, GL.GL_FALSE, proj_m.T)
+        for shader in self.shaders.values():
+            self.gl_state.set_uniform_matrix(shader, 'proj', proj_m)
 
     def _initiatize_shader(self, shader_name: str, vert_path: str, frag_path: str, **kwargs) -> None:
         self.shaders[shader_name] = Shader(vert_path, frag_path)
-        self.shader_ids[shader_name] = self.shaders[shader_name].glid  # pyright: ignore[reportGeneralTypeIssues]
 
         if 'texture' in kwargs and kwargs['texture'] is True:
-            GL.glUseProgram(self.shader_ids[shader_name])
-            GL.glUniform1i(GL.glGetUniformLocation(
-                self.shader_ids[shader_name], 'texture0'), 0)
+            self.gl_state.set_uniform_int(self.shaders[shader_name], 'texture0', 0)
 
-    def _initialize_mesa(self) -> None:
+    def _initialize_mesa(self, width: int, height: int) -> None:
 
-        width, height = self.cfg.window_dimensions
         self.ctx = osmesa.OSMesaCreateContext(osmesa.OSMESA_RGBA, None)
         self.buffer: npt.NDArray[np.uint8] = GL.arrays.GLubyteArray.zeros((height, width, 4))  # type: ignore
         osmesa.OSMesaMakeCurrent(self.ctx, self.buffer, GL.GL_UNSIGNED_BYTE, width, height)
 
         GL.glClearColor(*self.cfg.clear_color)
 
+    def reset_tiles(self, cfgs: List[ViewConfig]) -> None:
+        """
+        Prepare the view to render one scene per cfg, each into its own tile of the framebuffer.
+        The OSMesa context and compiled shaders are kept; cameras, framebuffer size, clear color and background are replaced.
+        """
+        self._cleanup_background_images()
+        self.gl_state.reset_counts()
+
+        width, height = self._layout_tiles(cfgs)
+        if (width, height) != tuple(self.get_framebuffer_size()):
+            self.buffer = GL.arrays.GLubyteArray.zeros((height, width, 4))  # type: ignore
+            osmesa.OSMesaMakeCurrent(self.ctx, self.buffer, GL.GL_UNSIGNED_BYTE, width, height)
+
+        GL.glClearColor(*self.cfg.clear_color)
+        self.clear_tiles = [tile for tile in self.tiles if tile.background is None and tile.cfg.clear_color != self.cfg.clear_color]
+
+        self._prep_background_images()
+
     def set_scene(self, scene: Scene) -> None:
         self.scene = scene
 
     def render(self, scene: Transform) -> None:
+        self.render_tiles([scene])
+
+    def render_tiles(self, scenes: List[Optional[Transform]]) -> None:
         GL.glViewport(0, 0, *self.get_framebuffer_size())
 
-        # Draw the background
-        if self.cfg.background_image:
+        # Draw the backgrounds, each stretched over its tile
+        for tile, _, fbo_id in self.background_fbos:
+            assert tile.background is not None  # for static analysis
+            txtr_h, txtr_w, _ = tile.background.shape
+            x, y, w, h = tile.buffer_rect
             GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, 0)
-            GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.fboId)
-            win_w, win_h = self.get_framebuffer_size()
-            GL.glBlitFramebuffer(0, 0, self.txtr_w, self.txtr_h, 0, 0, win_w, win_h, GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR)
+            GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, fbo_id)
+            GL.glBlitFramebuffer(0, 0, txtr_w, txtr_h, x, y, x + w, y + h, GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR)
+
+        for tile, scene in zip(self.tiles, scenes):
+            if scene is None:
+                continue
+
+            GL.glViewport(*tile.scene_viewport)
 
-        self._update_shaders_view_transform(self.camera)
+            # a scene larger than its tile is limited to the tile by the scissor test
+            clipped = tile.scissor_rect != tile.scene_viewport
+            self.gl_state.set_capability(GL.GL_SCISSOR_TEST, clipped)
+            if clipped:
+                GL.glScissor(*tile.scissor_rect)
 
-        scene.draw(shader_ids=self.shader_ids, viewer_cfg=self.cfg)
+            # tiles of the same size have the same projection matrix, so it is only sent again when it changes
+            if not np.array_equal(tile.proj_m, self._shader_proj_m):
+                self._set_shader_projections(tile.proj_m)
+                self._shader_proj_m = tile.proj_m
+
+            self._update_shaders_view_transform(tile.camera)
+
+            scene.draw(shaders=self.shaders, gl_state=self.gl_state, viewer_cfg=tile.cfg)
 
     def get_framebuffer_size(self) -> Tuple[int, int]:
         """ Return (width, height) of view's window. """
         return self.buffer.shape[:2][::-1]
 
+    def get_gl_call_counts(self) -> Dict[str, float]:
+        return self.gl_state.get_call_counts_per_frame()
+
     def clear_window(self) -> None:
+        self.gl_state.start_frame()
+        self.gl_state.set_capability(GL.GL_SCISSOR_TEST, False)
         GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)  # type: ignore
 
+        # tiles with their own clear color are cleared again, limited to the tile by the scissor test
+        if self.clear_tiles:
+            self.gl_state.set_capability(GL.GL_SCISSOR_TEST, True)
+            for tile in self.clear_tiles:
+                GL.glScissor(*tile.buffer_rect)
+                GL.glClearColor(*tile.cfg.clear_color)
+                GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+            self.gl_state.set_capability(GL.GL_SCISSOR_TEST, False)
+            GL.glClearColor(*self.cfg.clear_color)
+
     def cleanup(self) -> None:
         """ Destroy the context when it is finished. """
         osmesa.OSMesaDestroyContext(self.ctx)
@@ -4,6 +4,10 @@
 
 import OpenGL.GL as GL
 import logging
+from collections import defaultdict
+from typing import Dict, Optional
+import numpy as np
+import numpy.typing as npt
 
 
 class Shader:
@@ -53,3 +57,85 @@ class Shader:
             msg = f'Error creating shader program: {GL.glGetProgramInfoLog(self.glid).decode("ascii")}'
             logging.critical(msg)
             assert False, msg
+
+        self.uniform_locations: Dict[str, int] = {}  # locations of the uniforms looked up so far, by name
+
+    def get_uniform_location(self, name: str) -> int:
+        """ Return the location of the named uniform. It is only looked up the first time, as it is fixed once the program is linked. """
+        if name not in self.uniform_locations:
+            self.uniform_locations[name] = GL.glGetUniformLocation(self.glid, name)
+        return self.uniform_locations[name]
+
+
+class GLState:
+    """
+    Cache of the OpenGL state set by the draw paths: the shader program in use, enabled capabilities and polygon mode.
+    Calls that would not change the cached state are skipped. The cache is only correct if all changes to this state go through it.
+    Also counts the calls made through it, and the calls skipped, so the number of calls per frame can be measured.
+    """
+
+    def __init__(self) -> None:
+        self._program: Optional[int] = None
+        self._capabilities: Dict[int, bool] = {}
+        self._polygon_mode: Optional[int] = None
+
+        self.frame_count: int = 0  # frames started since the counts were last reset
+        self.call_counts: Dict[str, int] = defaultdict(int)  # calls made since the counts were last reset, by function name. Skipped calls are prefixed with 'skipped '
+
+    def use_program(self, shader: Shader) -> None:
+        if self._program == shader.glid:
+            self.call_counts['skipped glUseProgram'] += 1
+            return
+        GL.glUseProgram(shader.glid)
+        self._program = shader.glid
+        self.call_counts['glUseProgram'] += 1
+
+    def set_capability(self, capability: int, enabled: bool) -> None:
+        """ glEnable or glDisable the capability, unless it is already in that state. """
+        name = 'glEnable' if enabled else 'glDisable'
+        if self._capabilities.get(capability) == enabled:
+            self.call_counts[f'skipped {name}'] += 1
+            return
+        if enabled:
+            GL.glEnable(capability)
+        else:
+            GL.glDisable(capability)
+        self._capabilities[capability] = enabled
+        self.call_counts[name] += 1
+
+    def set_polygon_mode(self, mode: int) -> None:
+        """ Set the polygon mode of front and back faces. """
+        if self._polygon_mode == mode:
+            self.call_counts['skipped glPolygonMode'] += 1
+            return
+        GL.glPolygonMode(GL.GL_FRONT_AND_BACK, mode)
+        self._polygon_mode = mode
+        self.call_counts['glPolygonMode'] += 1
+
+    def set_uniform_matrix(self, shader: Shader, name: str, m: npt.NDArray[np.float32]) -> None:
+        """ Use the shader's program and set its named mat4 uniform to m, which is transposed into OpenGL's column major order. """
+        self.use_program(shader)
+        GL.glUniformMatrix4fv(self._get_uniform_location(shader, name), 1, GL.GL_FALSE, m.T)
+        self.call_counts['glUniformMatrix4fv'] += 1
+
+    def set_uniform_int(self, shader: Shader, name: str, value: int) -> None:
+        """ Use the shader's program and set its named int (or sampler) uniform to value. """
+        self.use_program(shader)
+        GL.glUniform1i(self._get_uniform_location(shader, name), value)
+        self.call_counts['glUniform1i'] += 1
+
+    def _get_uniform_location(self, shader: Shader, name: str) -> int:
+        self.call_counts['glGetUniformLocation' if name not in shader.uniform_locations else 'skipped glGetUniformLocation'] += 1
+        return shader.get_uniform_location(name)
+
+    def start_frame(self) -> None:
+        """ Called by the view as it starts rendering each frame. """
+        self.frame_count += 1
+
+    def reset_counts(self) -> None:
+        self.frame_count = 0
+        self.call_counts = defaultdict(int)
+
+    def get_call_counts_per_frame(self) -> Dict[str, float]:
+        """ Return the mean number of calls made and skipped per frame since the counts were last reset, by function name. """
+        return {name: count / max(self.frame_count, 1) for name, count in sorted(self.call_counts.items())}
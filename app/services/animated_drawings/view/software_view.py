@@ -0,0 +1,202 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+from typing import Tuple, Optional, List
+import numpy as np
+import numpy.typing as npt
+import cv2
+
+from app.services.animated_drawings.model.transform import Transform
+from app.services.animated_drawings.model.animated_drawing import AnimatedDrawing
+from app.services.animated_drawings.view.view import View, ViewTile
+from app.services.animated_drawings.config import ViewConfig
+
+ALPHA_DISCARD_THRESHOLD = 0.1  # texels more transparent than this are not drawn, as in shaders/texture.frag
+SAMPLE_ROW_LENGTH = 1024  # texture lookups are batched into rows of this many
+
+
+class SoftwareView(View):
+    """
+    View for headless rendering without OpenGL. The textured meshes of the scene's Animated Drawings are rasterized on the CPU with NumPy,
+    so no OSMesa context is needed and any number of processes can render side by side.
+
+    The framebuffer follows MesaView's: RGBA rows, bottom row first, with the background, tiles and scene viewports placed the same way.
+    Each triangle maps screen pixels to texture coordinates with its own affine transform, and triangles are drawn in the order of the
+    Animated Drawing's draw indices, so a later triangle covers an earlier one wherever its texel is not discarded as transparent.
+    Only the textures of Animated Drawings are drawn; the rig, per-joint colors, mesh lines and any other scene objects are skipped.
+    """
+
+    def __init__(self, cfg: ViewConfig) -> None:
+        super().__init__(cfg)
+
+        if self.cfg.draw_ad_rig or self.cfg.draw_ad_color or self.cfg.draw_ad_mesh_lines:
+            logging.warning('SoftwareView only draws Animated Drawing textures. DRAW_AD_RIG, DRAW_AD_COLOR and DRAW_AD_MESH_LINES are ignored')
+
+        self.buffer: npt.NDArray[np.uint8] = np.zeros([0, 0, 4], dtype=np.uint8)
+        self.background_buffer: Optional[npt.NDArray[np.uint8]]  # the tiles' backgrounds and clear colors, composed into a framebuffer
+        self.clear_color: npt.NDArray[np.uint8]
+        self.reset(cfg)
+
+    def reset_tiles(self, cfgs: List[ViewConfig]) -> None:
+        """ Prepare the view to render one scene per cfg, each into its own tile of the framebuffer. The framebuffer is kept if its size is unchanged. """
+        width, height = self._layout_tiles(cfgs)
+        if (width, height) != self.get_framebuffer_size():
+            self.buffer = np.zeros([height, width, 4], dtype=np.uint8)
+
+        self.clear_color = np.round(np.array(self.cfg.clear_color) * 255).astype(np.uint8)
+
+        # each tile's background is stretched over the tile, as by MesaView's blits. Tiles without one take their clear color,
+        # so a background is only composed when some tile has an image or a clear color other than the framebuffer's
+        self.background_buffer = None
+        if any(tile.background is not None or tile.cfg.clear_color != self.cfg.clear_color for tile in self.tiles):
+            self.background_buffer = np.empty([height, width, 4], dtype=np.uint8)
+            self.background_buffer.view(np.uint32).fill(self.clear_color.view(np.uint32)[0])
+            for tile in self.tiles:
+                x, y, w, h = tile.buffer_rect
+                if tile.background is None:
+                    self.background_buffer[y:y + h, x:x + w] = np.round(np.array(tile.cfg.clear_color) * 255)
+                elif tile.background.shape[:2] == (h, w):
+                    self.background_buffer[y:y + h, x:x + w] = tile.background
+                else:
+                    self.background_buffer[y:y + h, x:x + w] = cv2.resize(tile.background, (w, h), interpolation=cv2.INTER_LINEAR)
+
+    def render(self, scene: Transform) -> None:
+        self.render_tiles([scene])
+
+    def render_tiles(self, scenes: List[Optional[Transform]]) -> None:
+        # Draw the background
+        if self.background_buffer is not None:
+            np.copyto(self.buffer, self.background_buffer)
+
+        for tile, scene in zip(self.tiles, scenes):
+            if scene is None or not tile.cfg.draw_ad_txtr:
+                continue
+
+            try:
+                view_transform: npt.NDArray[np.float32] = np.linalg.inv(tile.camera.get_world_transform())
+            except Exception as e:
+                msg = f'Error inverting camera world transform: {e}'
+                logging.critical(msg)
+                assert False, msg
+
+            self._render_transform(scene, tile.proj_m @ view_transform, tile)
+
+    def _render_transform(self, t: Transform, proj_view_m: npt.NDArray[np.float32], tile: ViewTile) -> None:
+        """ Draw the Animated Drawings among t and its descendants, in the same order as Transform.draw() visits them. """
+        if isinstance(t, AnimatedDrawing):
+            self._draw_animated_drawing(t, proj_view_m, tile)
+
+        for c in t.get_children():
+            self._render_transform(c, proj_view_m, tile)
+
+    def _draw_animated_drawing(self, ad: AnimatedDrawing, proj_view_m: npt.NDArray[np.float32], tile: ViewTile) -> None:
+        """ Rasterize the triangles of the Animated Drawing's mesh into the tile's scene viewport, clipped to its scissor rect, textured with its texture. """
+        vp_x, vp_y, vp_w, vp_h = tile.scene_viewport
+        clip_x, clip_y, clip_w, clip_h = tile.scissor_rect
+        buffer_w = self.buffer.shape[1]
+
+        # project the vertices into window coordinates
+        mvp_m = proj_view_m.astype(np.float64) @ ad.get_world_transform(update_ancestors=False)
+        clip_positions = ad.vertices[:, :3].astype(np.float64) @ mvp_m[:3, :3].T + mvp_m[:3, 3]
+        clip_ws = ad.vertices[:, :3].astype(np.float64) @ mvp_m[3, :3] + mvp_m[3, 3]
+        window_xs = vp_x + (clip_positions[:, 0] / clip_ws + 1.0) * vp_w / 2
+        window_ys = vp_y + (clip_positions[:, 1] / clip_ws + 1.0) * vp_h / 2
+
+        # triangles in draw order, skipping those reaching behind the camera or without area
+        triangles = ad.indices.reshape([-1, 3])
+        triangles = triangles[np.all(clip_ws[triangles] > 0, axis=1)]
+        tri_xs, tri_ys = window_xs[triangles], window_ys[triangles]  # [T, 3]
+        areas = (tri_xs[:, 1] - tri_xs[:, 0]) * (tri_ys[:, 2] - tri_ys[:, 0]) - (tri_ys[:, 1] - tri_ys[:, 0]) * (tri_xs[:, 2] - tri_xs[:, 0])
+        has_area = areas != 0
+        triangles, tri_xs, tri_ys, areas = triangles[has_area], tri_xs[has_area], tri_ys[has_area], areas[has_area]
+        if len(triangles) == 0:
+            return
+
+        # each triangle's barycentric coordinates, as affine functions of window position: bc = bc_xs * x + bc_ys * y + bc_0s
+        bc_xs = (np.roll(tri_ys, -1, axis=1) - np.roll(tri_ys, -2, axis=1)) / areas[:, None]  # [T, 3]
+        bc_ys = (np.roll(tri_xs, -2, axis=1) - np.roll(tri_xs, -1, axis=1)) / areas[:, None]
+        bc_0s = (np.roll(tri_xs, -1, axis=1) * np.roll(tri_ys, -2, axis=1) - np.roll(tri_xs, -2, axis=1) * np.roll(tri_ys, -1, axis=1)) / areas[:, None]
+
+        # compose them with the texture coordinates of the vertices, giving each triangle's affine map from window position to texel position
+        txtr_h, txtr_w, _ = ad.txtr.shape
+        tri_txtr_xys = ad.vertices[triangles][:, :, 6:8].astype(np.float64) * [txtr_w, txtr_h]  # [T, 3, 2]
+        txtr_xy_xs = np.einsum('tv,tvc->tc', bc_xs, tri_txtr_xys)  # [T, 2]
+        txtr_xy_ys = np.einsum('tv,tvc->tc', bc_ys, tri_txtr_xys)
+        txtr_xy_0s = np.einsum('tv,tvc->tc', bc_0s, tri_txtr_xys)
+
+        # like OpenGL, sample the nearest texel where the texture is minified and interpolate bilinearly where it is magnified
+        magnified = np.maximum(np.hypot(*txtr_xy_xs.T), np.hypot(*txtr_xy_ys.T)) <= 1.0
+
+        # the rows of pixels whose centers are within each triangle's vertical extent, clipped to the scissor rect
+        y_mins = np.maximum(np.ceil(tri_ys.min(axis=1) - 0.5), clip_y).astype(np.int64)
+        y_maxs = np.minimum(np.floor(tri_ys.max(axis=1) - 0.5), clip_y + clip_h - 1).astype(np.int64)
+        row_counts = np.maximum(y_maxs - y_mins + 1, 0)
+        row_tri_idxs = np.repeat(np.arange(len(triangles)), row_counts)
+        row_ys = y_mins[row_tri_idxs] + np.arange(row_counts.sum()) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+        row_center_ys = (row_ys + 0.5)[:, None]
+
+        # on each row, the span of pixel centers inside the triangle, where all three barycentric coordinates are non-negative
+        row_bc_xs = bc_xs[row_tri_idxs]  # [R, 3]
+        row_bc_0s = bc_ys[row_tri_idxs] * row_center_ys + bc_0s[row_tri_idxs]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            row_bounds = -row_bc_0s / row_bc_xs
+        x_los = np.where(row_bc_xs > 0, row_bounds, -np.inf).max(axis=1)
+        x_his = np.where(row_bc_xs < 0, row_bounds, np.inf).min(axis=1)
+        x_mins = np.maximum(np.ceil(x_los - 0.5), clip_x).astype(np.int64)
+        x_maxs = np.minimum(np.floor(x_his - 0.5), clip_x + clip_w - 1).astype(np.int64)
+        span_ws = np.maximum(x_maxs - x_mins + 1, 0)
+        span_ws[np.any((row_bc_xs == 0) & (row_bc_0s < 0), axis=1)] = 0  # rows outside of an edge parallel to them
+
+        # the fragments: one per pixel of each span
+        frag_row_idxs = np.repeat(np.arange(len(row_ys)), span_ws)
+        frag_xs = x_mins[frag_row_idxs] + np.arange(span_ws.sum()) - np.repeat(np.cumsum(span_ws) - span_ws, span_ws)
+        frag_ys = row_ys[frag_row_idxs]
+        frag_tri_idxs = row_tri_idxs[frag_row_idxs]
+
+        # sample the texture
+        row_txtr_xys = txtr_xy_ys[row_tri_idxs] * row_center_ys + txtr_xy_0s[row_tri_idxs]
+        frag_txtr_xys = row_txtr_xys[frag_row_idxs] + txtr_xy_xs[frag_tri_idxs] * (frag_xs + 0.5)[:, None]
+        frag_colors = self._sample_texture(ad.txtr, frag_txtr_xys, cv2.INTER_NEAREST)
+        if np.any(magnified):
+            frag_magnified = magnified[frag_tri_idxs]
+            frag_colors[frag_magnified] = self._sample_texture(ad.txtr, frag_txtr_xys[frag_magnified], cv2.INTER_LINEAR)
+
+        # fragments are in draw order, so of those not discarded, the last one on each pixel is the one that shows
+        kept_frag_idxs = np.flatnonzero(frag_colors[:, 3] >= ALPHA_DISCARD_THRESHOLD * 255).astype(np.int32)
+        frag_pixel_idxs = frag_ys[kept_frag_idxs] * buffer_w + frag_xs[kept_frag_idxs]
+        shown_frag_idxs = np.full(self.buffer.shape[0] * buffer_w, -1, dtype=np.int32)
+        np.maximum.at(shown_frag_idxs, frag_pixel_idxs, kept_frag_idxs)
+
+        # copy the colors of the shown fragments to their pixels, a pixel's 4 channels at a time
+        drawn_pixel_idxs = np.flatnonzero(shown_frag_idxs >= 0)
+        self.buffer.view(np.uint32).reshape([-1])[drawn_pixel_idxs] = frag_colors.view(np.uint32).reshape([-1])[shown_frag_idxs[drawn_pixel_idxs]]
+
+    @staticmethod
+    def _sample_texture(txtr: npt.NDArray[np.uint8], txtr_xys: npt.NDArray[np.float64], interpolation: int) -> npt.NDArray[np.uint8]:
+        """
+        Returns the [N, 4] RGBA colors of the texture at each of the [N, 2] texel positions, where texel (col, row) spans [col, col+1) x [row, row+1).
+        interpolation is cv2.INTER_NEAREST or cv2.INTER_LINEAR. As with OpenGL's default GL_REPEAT wrapping, the texture repeats beyond its borders.
+        """
+        # cv2.remap samples at texel centers and takes maps of less than SHRT_MAX rows, so pass the positions as rows of SAMPLE_ROW_LENGTH
+        point_num = len(txtr_xys)
+        if point_num == 0:
+            return np.empty([0, 4], dtype=np.uint8)
+        maps = np.zeros([-(-point_num // SAMPLE_ROW_LENGTH) * SAMPLE_ROW_LENGTH, 2], dtype=np.float32)
+        maps[:point_num] = txtr_xys - 0.5
+        maps = maps.reshape([-1, SAMPLE_ROW_LENGTH, 2])
+
+        colors: npt.NDArray[np.uint8] = cv2.remap(txtr, maps, None, interpolation, borderMode=cv2.BORDER_WRAP)
+        return colors.reshape([-1, 4])[:point_num]
+
+    def get_framebuffer_size(self) -> Tuple[int, int]:
+        """ Return (width, height) of view's framebuffer. """
+        height, width, _ = self.buffer.shape
+        return width, height
+
+    def clear_window(self) -> None:
+        self.buffer.view(np.uint32).fill(self.clear_color.view(np.uint32)[0])
+
+    def cleanup(self) -> None:
+        """ Nothing to release: the framebuffer is an ordinary array. """
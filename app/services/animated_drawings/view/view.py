@@ -4,8 +4,15 @@
 
 from __future__ import annotations
 from abc import abstractmethod
-from typing import Tuple
+import logging
+from typing import Tuple, Optional, List, Dict
+import numpy as np
+import numpy.typing as npt
 from app.services.animated_drawings.config import ViewConfig
+from app.services.animated_drawings.model.camera import Camera
+from app.services.animated_drawings.model.transform import Transform
+from app.services.animated_drawings.view.utils import get_projection_matrix
+from app.services.animated_drawings.utils import read_background_image
 
 
 class View:
@@ -17,7 +24,7 @@ class View:
 
     def __init__(self, cfg: ViewConfig):
         self.cfg: ViewConfig = cfg
-        pass
+        self.tiles: List[ViewTile] = []  # regions of the framebuffer that scenes are rendered into, used by headless views
 
     @abstractmethod
     def render(self, scene) -> None:  # pyright: ignore[reportUnknownParameterType,reportMissingParameterType]
@@ -35,13 +42,111 @@ class View:
     def get_framebuffer_size(self) -> Tuple[int, int]:
         """ Return (width, height) of framebuffer. """
 
+    def get_gl_call_counts(self) -> Dict[str, float]:
+        """ Return the mean number of OpenGL calls per frame made and skipped through the view's GL state cache, by function name. Empty if the view has none. """
+        return {}
+
+    def reset(self, cfg: ViewConfig) -> None:
+        """ Prepare the view to render a new scene described by cfg. Only headless views, which can be reused across scenes, support this. """
+        self.reset_tiles([cfg])
+
+    def reset_tiles(self, cfgs: List[ViewConfig]) -> None:
+        """
+        Prepare the view to render one scene per cfg in a single pass, each into its own tile of the framebuffer.
+        Only headless views support this.
+        """
+        msg = f'{type(self).__name__} cannot be reset to render new scenes'
+        logging.critical(msg)
+        assert False, msg
+
+    def render_tiles(self, scenes: List[Optional[Transform]]) -> None:
+        """
+        Render each scene into its tile, as laid out by reset_tiles(). Tiles whose scene is None only show their background.
+        Only headless views support this.
+        """
+        msg = f'{type(self).__name__} cannot render scenes into tiles'
+        logging.critical(msg)
+        assert False, msg
+
+    def _layout_tiles(self, cfgs: List[ViewConfig]) -> Tuple[int, int]:
+        """
+        Lay out one tile per cfg, in rows of up to ceil(sqrt(len(cfgs))) tiles, each holding its background image.
+        Sets self.cfg to the first cfg. Returns (width, height) of the framebuffer needed to hold all tiles.
+        """
+        self.cfg = cfgs[0]
+
+        # each tile takes the size of its background image if FIT_WINDOW_TO_BACKGROUND, else WINDOW_DIMENSIONS
+        backgrounds = [read_background_image(cfg.background_image) if cfg.background_image else None for cfg in cfgs]
+        tile_sizes: List[Tuple[int, int]] = []
+        for cfg, background in zip(cfgs, backgrounds):
+            if cfg.fit_window_to_background and background is not None:
+                tile_sizes.append((background.shape[1], background.shape[0]))
+            else:
+                tile_sizes.append(tuple(cfg.window_dimensions))  # type: ignore
+
+        # place the tiles left to right, top to bottom
+        row_len = int(np.ceil(np.sqrt(len(cfgs))))
+        frame_rects: List[Tuple[int, int, int, int]] = []
+        buffer_w, buffer_h = 0, 0
+        for row_start in range(0, len(cfgs), row_len):
+            x = 0
+            for tile_w, tile_h in tile_sizes[row_start:row_start + row_len]:
+                frame_rects.append((x, buffer_h, tile_w, tile_h))
+                x += tile_w
+            buffer_w = max(buffer_w, x)
+            buffer_h += max(tile_h for _, tile_h in tile_sizes[row_start:row_start + row_len])
+
+        self.tiles = [ViewTile(cfg, frame_rect, buffer_h, background) for cfg, frame_rect, background in zip(cfgs, frame_rects, backgrounds)]
+
+        return buffer_w, buffer_h
+
     @staticmethod
     def create_view(view_cfg: ViewConfig) -> View:
         """ Takes in a view dictionary from mvc config file and returns the appropriate view. """
         # create view
-        if view_cfg.use_mesa:
+        if view_cfg.use_software_renderer:
+            from app.services.animated_drawings.view.software_view import SoftwareView
+            return SoftwareView(view_cfg)
+        elif view_cfg.use_mesa:
             from app.services.animated_drawings.view.mesa_view import MesaView
             return MesaView(view_cfg)
         else:
             from app.services.animated_drawings.view.window_view import WindowView
             return WindowView(view_cfg)
+
+
+class ViewTile():
+    """ A region of a headless view's framebuffer that one scene is rendered into, seen through its own camera. """
+
+    def __init__(self, cfg: ViewConfig, frame_rect: Tuple[int, int, int, int], buffer_h: int, background: Optional[npt.NDArray[np.uint8]]) -> None:
+        """
+        cfg: the view config of the scene rendered into the tile
+        frame_rect: (x, y, width, height) of the tile within output frames, measured from their top left
+        buffer_h: height of the framebuffer holding the tile
+        background: the tile's background image, bottom row first, stretched over the tile when drawn. If None, the tile is cleared to its clear color
+        """
+        self.cfg: ViewConfig = cfg
+        self.camera: Camera = Camera(cfg.camera_pos, cfg.camera_fwd)
+        self.frame_rect: Tuple[int, int, int, int] = frame_rect
+        self.background: Optional[npt.NDArray[np.uint8]] = background
+
+        # (x, y, width, height) of the tile within the framebuffer, whose rows start at the bottom
+        self.buffer_rect: Tuple[int, int, int, int] = (frame_rect[0], buffer_h - frame_rect[1] - frame_rect[3], frame_rect[2], frame_rect[3])
+
+        # draw the scene at WINDOW_DIMENSIONS in the center of the tile. A tile smaller than that (e.g. a small background image)
+        # shows the center of the scene, which is clipped to the tile
+        tile_x, tile_y, tile_w, tile_h = frame_rect
+        scene_w, scene_h = cfg.window_dimensions
+
+        # offsets are measured from the top left of the output video; GL viewports start at the bottom left
+        x = tile_x + (tile_w - scene_w) // 2
+        y = buffer_h - (tile_y + (tile_h - scene_h) // 2) - scene_h
+        self.scene_viewport: Tuple[int, int, int, int] = (x, y, scene_w, scene_h)  # (x, y, width, height) of the region the scene is drawn into
+
+        # (x, y, width, height) of the part of the scene viewport within the tile. Drawing is limited to it
+        buffer_x, buffer_y = self.buffer_rect[:2]
+        scissor_x, scissor_y = max(x, buffer_x), max(y, buffer_y)
+        self.scissor_rect: Tuple[int, int, int, int] = (scissor_x, scissor_y,
+                                                        min(x + scene_w, buffer_x + tile_w) - scissor_x, min(y + scene_h, buffer_y + tile_h) - scissor_y)
+
+        self.proj_m: npt.NDArray[np.float32] = get_projection_matrix(scene_w, scene_h)
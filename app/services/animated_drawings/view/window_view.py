@@ -3,7 +3,7 @@
 # LICENSE file in the root directory of this source tree.
 
 from app.services.animated_drawings.view.view import View
-from app.services.animated_drawings.view.shaders.shader import Shader
+from app.services.animated_drawings.view.shaders.shader import Shader, GLState
 from app.services.animated_drawings.view.utils import get_projection_matrix
 from app.services.animated_drawings.utils import read_background_image
 from app.services.animated_drawings.model.scene import Scene
@@ -13,7 +13,7 @@ from app.services.animated_drawings.config import ViewConfig
 import glfw
 import OpenGL.GL as GL
 import logging
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
 import numpy as np
 import numpy.typing as npt
 from pathlib import Path
@@ -30,12 +30,14 @@ class WindowView(View):
 
         self.camera: Camera = Camera(cfg.camera_pos, cfg.camera_fwd)
 
+        self.gl_state: GLState = GLState()  # shared with the scene's draw paths
+
         self.win: glfw._GLFWwindow
         self._create_window(*cfg.window_dimensions)  # pyright: ignore[reportGeneralTypeIssues]
 
         self.shaders: Dict[str, Shader] = {}
-        self.shader_ids: Dict[str, int] = {}
         self._prep_shaders()
+        self._shader_camera_m: Optional[npt.NDArray[np.float32]] = None  # camera transform of the view matrix last sent
 
         self.fboId: GL.GLint
         self._prep_background_image()
@@ -80,32 +82,31 @@ class WindowView(View):
         self._initiatize_shader('texture_shader', str(TEXTURE_VERT), str(TEXTURE_FRAG), texture=True)
 
     def _update_shaders_view_transform(self, camera: Camera) -> None:
+        # skip the upload while the camera is still
+        camera_m = camera.get_world_transform()
+        if np.array_equal(camera_m, self._shader_camera_m):
+            return
+        self._shader_camera_m = camera_m
+
         try:
-            view_transform: npt.NDArray[np.float32] = np.linalg.inv(camera.get_world_transform())
+            view_transform: npt.NDArray[np.float32] = np.linalg.inv(camera_m)
         except Exception as e:
             msg = f'Error inverting camera world transform: {e}'
             logging.critical(msg)
             assert False, msg
 
-        for shader_name in self.shaders:
-            GL.glUseProgram(self.shader_ids[shader_name])
-            view_loc = GL.glGetUniformLocation(self.shader_ids[shader_name], "view")
-            GL.glUniformMatrix4fv(view_loc, 1, GL.GL_FALSE, view_transform.T)
+        for shader in self.shaders.values():
+            self.gl_state.set_uniform_matrix(shader, 'view', view_transform)
 
     def _set_shader_projections(self, proj_m: npt.NDArray[np.float32]) -> None:
-        for shader_id in self.shader_ids.values():
-            GL.glUseProgram(shader_id)
-            proj_loc = GL.glGetUniformLocation(shader_id, "proj")
-            GL.glUniformMatrix4fv(proj_loc, 1, GL.GL_FALSE, proj_m.T)
+        for shader in self.shaders.values():
+            self.gl_state.set_uniform_matrix(shader, 'proj', proj_m)
 
     def _initiatize_shader(self, shader_name: str, vert_path: str, frag_path: str, **kwargs) -> None:
         self.shaders[shader_name] = Shader(vert_path, frag_path)
-        self.shader_ids[shader_name] = self.shaders[shader_name].glid  # pyright: ignore[reportGeneralTypeIssues]
 
         if 'texture' in kwargs and kwargs['texture'] is True:
-            GL.glUseProgram(self.shader_ids[shader_name])
-            GL.glUniform1i(GL.glGetUniformLocation(
-                self.shader_ids[shader_name], 'texture0'), 0)
+            self.gl_state.set_uniform_int(self.shaders[shader_name], 'texture0', 0)
 
     def _create_window(self, width: int, height: int) -> None:
 
@@ -119,8 +120,8 @@ class WindowView(View):
 
         glfw.make_context_current(self.win)
 
-        GL.glEnable(GL.GL_CULL_FACE)
-        GL.glEnable(GL.GL_DEPTH_TEST)
+        self.gl_state.set_capability(GL.GL_CULL_FACE, True)
+        self.gl_state.set_capability(GL.GL_DEPTH_TEST, True)
         GL.glClearColor(*self.cfg.clear_color)
 
         logging.info(f'OpenGL Version: {GL.glGetString(GL.GL_VERSION).decode()}')  # pyright: ignore[reportGeneralTypeIssues]
@@ -142,16 +143,20 @@ class WindowView(View):
 
         self._update_shaders_view_transform(self.camera)
 
-        scene.draw(shader_ids=self.shader_ids, viewer_cfg=self.cfg)
+        scene.draw(shaders=self.shaders, gl_state=self.gl_state, viewer_cfg=self.cfg)
 
     def get_framebuffer_size(self) -> Tuple[int, int]:
         """ Return (width, height) of view's window. """
         return glfw.get_framebuffer_size(self.win)
 
+    def get_gl_call_counts(self) -> Dict[str, float]:
+        return self.gl_state.get_call_counts_per_frame()
+
     def swap_buffers(self) -> None:
         glfw.swap_buffers(self.win)
 
     def clear_window(self) -> None:
+        self.gl_state.start_frame()
         GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)  # type: ignore
 
     def cleanup(self) -> None:
@@ -68,6 +68,17 @@ class AzureBlobService:
             error_message = f"Failed to upload a file to {blob_name}, Exception={str(e)}"
             raise Exception(error_message)
 
+    def get_blob_url(self, blob_name: str) -> str:
+        """Get the URL of a blob in Azure Blob Storage.
+
+        Args:
+            blob_name (str): The blob name.
+
+        Returns:
+            str: The URL of the blob.
+        """
+        return self.container_client.get_blob_client(blob_name).url
+
     def get_result_image(self, save_path: str, blob_name: str) -> None:
         """Download a file from Azure Blob Storage.
 
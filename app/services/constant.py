@@ -21,6 +21,13 @@ class DanceName(str, Enum):
     BUMBLEBEE = "bumblebee"
     GROOVE = "groove"
 
+class JobStatus(str, Enum):
+    """Enum for model job and dance statuses."""
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
 AZURE_STORAGE_CONTAINER_NAME = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
 AZURE_STORAGE_CONNECTION_STR = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 AZURE_PUBLIC_STORAGE_CONTAINER_NAME = os.getenv("AZURE_PUBLIC_STORAGE_CONTAINER_NAME")
@@ -48,6 +55,12 @@ EMPTY_BACKGROUND_BASE_IMAGE_PATH = os.path.join(LOCAL_PATH, IMAGES_DIR, EMPTY_BA
 
 MODEL_SOURCE_DIR = os.path.join(LOCAL_PATH, "tmp_model_sources")
 MODEL_RESULT_DIR = os.path.join(LOCAL_PATH, "tmp_model_results")
+MODEL_CACHE_DIR = os.path.join(LOCAL_PATH, "tmp_model_cache")
+MODEL_CHARACTER_CACHE_DIR = os.path.join(MODEL_CACHE_DIR, "character")
+
+CHARACTER_ANNOTATION_DIR = "annotation"
 
-VIDEO_CODEC = "libx264"
-VIDEO_FPS = 30
+MODEL_JOB_WORKERS = int(os.getenv("MODEL_JOB_WORKERS", "1"))
+MODEL_JOB_TTL_SECONDS = int(os.getenv("MODEL_JOB_TTL_SECONDS", "3600"))
+MODEL_RENDER_PROCESSES = int(os.getenv("MODEL_RENDER_PROCESSES", str(min(len(DanceName), os.cpu_count() or 1))))
+MODEL_SOFTWARE_RENDERER = os.getenv("MODEL_SOFTWARE_RENDERER", "false").lower() == "true"
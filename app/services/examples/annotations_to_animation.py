@@ -7,14 +7,47 @@ import logging
 from pathlib import Path
 import sys
 import yaml
+from typing import Optional
 from pkg_resources import resource_filename
 
 
-def annotations_to_animation(char_anno_dir: str, motion_cfg_fn: str, retarget_cfg_fn: str):
+def annotations_to_animation(char_anno_dir: str, motion_cfg_fn: str, retarget_cfg_fn: str, output_dir: Optional[str] = None,
+                             render_worker: Optional[render.RenderWorker] = None, background_image: Optional[str] = None,
+                             mp4: bool = False, cache_dir: Optional[str] = None, character_cache_dir: Optional[str] = None,
+                             software_renderer: bool = False):
     """
     Given a path to a directory with character annotations, a motion configuration file, and a retarget configuration file,
-    creates an animation and saves it to {annotation_dir}/video.png
+    creates an animation and saves it to {output_dir}/video.gif. If output_dir is not specified, char_anno_dir is used.
+    Passing a separate output_dir allows several motions to be rendered from the same character annotations.
+    If render_worker is specified, its view (OSMesa context and shaders) is reused instead of creating a new one.
+    See create_mvc_cfg for the remaining arguments.
     """
+    output_mvc_cfn_fn = create_mvc_cfg(char_anno_dir, motion_cfg_fn, retarget_cfg_fn, output_dir=output_dir, background_image=background_image,
+                                       mp4=mp4, cache_dir=cache_dir, character_cache_dir=character_cache_dir, software_renderer=software_renderer)
+
+    # render the video
+    if render_worker is not None:
+        render_worker.render(output_mvc_cfn_fn)
+    else:
+        render.start(output_mvc_cfn_fn)
+
+
+def create_mvc_cfg(char_anno_dir: str, motion_cfg_fn: str, retarget_cfg_fn: str, output_dir: Optional[str] = None,
+                   background_image: Optional[str] = None, mp4: bool = False, cache_dir: Optional[str] = None,
+                   character_cache_dir: Optional[str] = None, software_renderer: bool = False) -> str:
+    """
+    Writes the mvc config rendering the character annotations with the motion to {output_dir}/mvc_cfg.yaml, and returns its path.
+    If output_dir is not specified, char_anno_dir is used.
+    Configs created for several animations can be rendered in a single pass with RenderWorker.render_batch.
+    If background_image is specified, the video takes its size and the character is rendered in its center.
+    If mp4 is True, {output_dir}/video.mp4 is encoded with ffmpeg (H.264) from the same rendered frames as the GIF.
+    If cache_dir is specified, preprocessing that does not depend on the character (e.g. retargeted motion) is cached there.
+    If character_cache_dir is specified, the character's own preprocessing (e.g. its mesh) is loaded from there, see create_character_cache.
+    If software_renderer is True, the scene is rasterized with NumPy instead of OSMesa.
+    """
+    if output_dir is None:
+        output_dir = char_anno_dir
+    Path(output_dir).mkdir(exist_ok=True, parents=True)
 
     # package character_cfg_fn, motion_cfg_fn, and retarget_cfg_fn
     animated_drawing_dict = {
@@ -23,22 +56,53 @@ def annotations_to_animation(char_anno_dir: str, motion_cfg_fn: str, retarget_cf
         'retarget_cfg': str(Path(retarget_cfg_fn).resolve())
     }
 
+    # composite the background while rendering
+    view_cfg = {"USE_MESA": True, "USE_SOFTWARE_RENDERER": software_renderer}
+    if background_image is not None:
+        view_cfg['BACKGROUND_IMAGE'] = str(Path(background_image).resolve())
+        view_cfg['FIT_WINDOW_TO_BACKGROUND'] = True
+
+    # set the output locations
+    output_video_paths = [str(Path(output_dir, 'video.gif').resolve())]
+    if mp4:
+        output_video_paths.append(str(Path(output_dir, 'video.mp4').resolve()))
+
+    # add the character to the scene
+    scene_cfg = {'ANIMATED_CHARACTERS': [animated_drawing_dict], 'PRECOMPUTE_ARAP': True}
+    if cache_dir is not None:
+        scene_cfg['CACHE_DIR'] = str(Path(cache_dir).resolve())
+    if character_cache_dir is not None:
+        scene_cfg['CHARACTER_CACHE_DIR'] = str(Path(character_cache_dir).resolve())
+
     # create mvc config
     mvc_cfg = {
-        'view': {"USE_MESA": True},
-        'scene': {'ANIMATED_CHARACTERS': [animated_drawing_dict]},  # add the character to the scene
+        'view': view_cfg,
+        'scene': scene_cfg,
         'controller': {
             'MODE': 'video_render',  # 'video_render' or 'interactive'
-            'OUTPUT_VIDEO_PATH': str(Path(char_anno_dir, 'video.gif').resolve())}  # set the output location
+            'OUTPUT_VIDEO_PATH': output_video_paths,
+            'OUTPUT_VIDEO_BACKEND': 'ffmpeg',
+            'READBACK_PBO_COUNT': 2,  # read each frame back while the next one renders
+            'WRITER_QUEUE_SIZE': 4}  # encode frames on a writer thread while the next ones render
     }
 
     # write the new mvc config file out
-    output_mvc_cfn_fn = str(Path(char_anno_dir, 'mvc_cfg.yaml'))
+    output_mvc_cfn_fn = str(Path(output_dir, 'mvc_cfg.yaml'))
     with open(output_mvc_cfn_fn, 'w') as f:
         yaml.dump(dict(mvc_cfg), f)
 
-    # render the video
-    render.start(output_mvc_cfn_fn)
+    return output_mvc_cfn_fn
+
+
+def create_character_cache(char_anno_dir: str, character_cache_dir: str) -> None:
+    """
+    Preprocesses the character annotations in char_anno_dir (mask, texture, mesh, bone labels and ARAP matrices) once and saves the results to character_cache_dir.
+    Animations created from the annotations by create_mvc_cfg with the same character_cache_dir load them and skip straight to retargeting.
+    """
+    from app.services.animated_drawings.config import CharacterConfig
+    from app.services.animated_drawings.model.animated_drawing import AnimatedDrawing
+    char_cfg = CharacterConfig(str(Path(char_anno_dir, 'char_cfg.yaml').resolve()))
+    AnimatedDrawing.create_character_cache(char_cfg, Path(character_cache_dir).resolve())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,208 @@
+"""Background job subsystem to run the model outside of the HTTP request."""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Dict, Optional
+from app.services.blob import AzureBlobService
+from app.services.constant import DanceName, JobStatus, AZURE_PUBLIC_STORAGE_CONTAINER_NAME, AZURE_PUBLIC_CONNECTION_STRING, BACKGROUND_DIR, CHARACTER_DIR, RESULT_DIR, MODEL_SOURCE_DIR, MODEL_RESULT_DIR, MODEL_JOB_WORKERS, MODEL_JOB_TTL_SECONDS
+from app.services.run_model import create_character_annotations, delete_tmp_cache_files, delete_tmp_result_files, delete_tmp_source_files, shutdown_render_executor, submit_dance_animations
+
+
+class ModelJob:
+    def __init__(self, user_uuid: str):
+        self.job_id = str(uuid.uuid4())
+        self.user_uuid = user_uuid
+        self.status = JobStatus.PENDING
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.dances: Dict[DanceName, dict] = {
+            dance_name: {"status": JobStatus.PENDING, "gif_url": None, "mp4_url": None, "error": None}
+            for dance_name in DanceName
+        }
+
+    def to_dict(self) -> dict:
+        """Get a JSON serializable snapshot of the job.
+
+        Returns:
+            dict: The job status, the per-dance progress and the result URLs.
+        """
+        completed = sum(1 for dance in self.dances.values() if dance["status"] == JobStatus.SUCCEEDED)
+        return {
+            "job_id": self.job_id,
+            "user_id": self.user_uuid,
+            "status": self.status.value,
+            "error": self.error,
+            "progress": {"completed": completed, "total": len(self.dances)},
+            "dances": {
+                dance_name.value: {**dance, "status": dance["status"].value}
+                for dance_name, dance in self.dances.items()
+            },
+        }
+
+
+class ModelJobManager:
+    def __init__(self, max_workers: int = MODEL_JOB_WORKERS, ttl_seconds: int = MODEL_JOB_TTL_SECONDS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-job")
+        self.ttl_seconds = ttl_seconds
+        self.jobs: Dict[str, ModelJob] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, user_uuid: str) -> dict:
+        """Queue a model run for the given user.
+
+        Args:
+            user_uuid (str): The user UUID.
+
+        Raises:
+            RuntimeError: When a job of the user is still pending or running.
+
+        Returns:
+            dict: A snapshot of the queued job.
+        """
+        with self.lock:
+            self._remove_expired_jobs()
+            for job in self.jobs.values():
+                if job.user_uuid == user_uuid and job.status in (JobStatus.PENDING, JobStatus.RUNNING):
+                    error_message = f"A model job is already in progress for user_uuid={user_uuid}, job_id={job.job_id}"
+                    raise RuntimeError(error_message)
+
+            job = ModelJob(user_uuid=user_uuid)
+            self.jobs[job.job_id] = job
+            snapshot = job.to_dict()
+
+        self.executor.submit(self._run, job)
+        return snapshot
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Get a snapshot of the job with the given ID.
+
+        Args:
+            job_id (str): The job ID.
+
+        Returns:
+            Optional[dict]: A snapshot of the job, or None if the job is unknown or expired.
+        """
+        with self.lock:
+            self._remove_expired_jobs()
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def shutdown(self) -> None:
+        """Stop accepting jobs and wait for the running ones to finish."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        shutdown_render_executor()
+
+    def _remove_expired_jobs(self) -> None:
+        now = time.time()
+        expired_job_ids = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.ttl_seconds
+        ]
+        for job_id in expired_job_ids:
+            del self.jobs[job_id]
+
+    def _update(self, job: ModelJob, dance_name: Optional[DanceName] = None, **fields) -> None:
+        with self.lock:
+            if dance_name is None:
+                for key, value in fields.items():
+                    setattr(job, key, value)
+                if job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED):
+                    job.finished_at = time.time()
+            else:
+                job.dances[dance_name].update(fields)
+
+    def _run(self, job: ModelJob) -> None:
+        """Run the job, making sure it always ends up SUCCEEDED or FAILED.
+
+        Errors the steps of _run_steps do not handle themselves (e.g. a broken render pool)
+        would otherwise be kept by the executor future and leave the job RUNNING.
+        """
+        try:
+            self._run_steps(job)
+        except Exception as e:
+            self._fail(job, f"Unexpected error: {str(e)}")
+
+    def _run_steps(self, job: ModelJob) -> None:
+        user_uuid = job.user_uuid
+        self._update(job, status=JobStatus.RUNNING)
+
+        try:
+            PrivateBlobService = AzureBlobService()
+            PrivateBlobService.get_result_image(save_path=f"{MODEL_SOURCE_DIR}/{BACKGROUND_DIR}/{user_uuid}.png", blob_name=f"{BACKGROUND_DIR}/{user_uuid}.png")
+            PrivateBlobService.get_result_image(save_path=f"{MODEL_SOURCE_DIR}/{CHARACTER_DIR}/{user_uuid}.png", blob_name=f"{CHARACTER_DIR}/{user_uuid}.png")
+        except Exception as e:
+            self._fail(job, f"Error downloading images from Blob: {str(e)}")
+            return
+
+        PublicBlobService = AzureBlobService(container_name=AZURE_PUBLIC_STORAGE_CONTAINER_NAME, connecting_string=AZURE_PUBLIC_CONNECTION_STRING)
+
+        try:
+            char_anno_dir = create_character_annotations(user_uuid=user_uuid)
+        except Exception as e:
+            self._fail(job, f"Error annotating the character: {str(e)}")
+            return
+
+        futures = submit_dance_animations(user_uuid=user_uuid, char_anno_dir=char_anno_dir)
+        try:
+            for dance_name in futures.values():
+                self._update(job, dance_name, status=JobStatus.RUNNING)
+
+            failed_dances = []
+            for future in as_completed(futures):
+                dance_name = futures[future]
+                try:
+                    future.result()
+                    gif_blob_name = f"{RESULT_DIR}/{dance_name.value}/{user_uuid}.gif"
+                    mp4_blob_name = f"{RESULT_DIR}/{dance_name.value}/{user_uuid}.mp4"
+                    PublicBlobService.upload_file(file_path=f"{MODEL_RESULT_DIR}/{user_uuid}/{dance_name.value}/video.gif", blob_name=gif_blob_name)
+                    PublicBlobService.upload_file(file_path=f"{MODEL_RESULT_DIR}/{user_uuid}/{dance_name.value}/video.mp4", blob_name=mp4_blob_name)
+                except Exception as e:
+                    failed_dances.append(dance_name.value)
+                    self._update(job, dance_name, status=JobStatus.FAILED, error=str(e))
+                    continue
+                finally:
+                    delete_tmp_result_files(user_uuid=user_uuid, dance_name=dance_name)
+
+                self._update(
+                    job,
+                    dance_name,
+                    status=JobStatus.SUCCEEDED,
+                    gif_url=PublicBlobService.get_blob_url(gif_blob_name),
+                    mp4_url=PublicBlobService.get_blob_url(mp4_blob_name),
+                )
+        except Exception:
+            # dances still rendering would write to the files _fail deletes, so cancel them, or wait for those already running
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise
+
+        if failed_dances:
+            self._fail(job, f"Error processing model - dance_name={', '.join(failed_dances)}")
+            return
+
+        self._cleanup(user_uuid)
+        self._update(job, status=JobStatus.SUCCEEDED)
+
+    def _fail(self, job: ModelJob, error_message: str) -> None:
+        logging.error(f"Model job failed - job_id={job.job_id}, {error_message}")
+        try:
+            self._cleanup(job.user_uuid)
+        except Exception as e:
+            logging.error(f"Error deleting temporary files - job_id={job.job_id}, {str(e)}")
+        for dance_name, dance in job.dances.items():
+            if dance["status"] in (JobStatus.PENDING, JobStatus.RUNNING):
+                self._update(job, dance_name, status=JobStatus.FAILED, error=error_message)
+        self._update(job, status=JobStatus.FAILED, error=error_message)
+
+    def _cleanup(self, user_uuid: str) -> None:
+        delete_tmp_result_files(user_uuid=user_uuid)
+        delete_tmp_source_files(user_uuid=user_uuid)
+        delete_tmp_cache_files(user_uuid=user_uuid)
+
+
+model_job_manager = ModelJobManager()
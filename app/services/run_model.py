@@ -1,13 +1,22 @@
 """Service to run the model and generate animations from images."""
 
 import os
-import imageio
+import multiprocessing
 import shutil
-from PIL import Image
-from moviepy import VideoFileClip
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
 from app.services.examples.image_to_annotations import image_to_annotations
-from app.services.examples.annotations_to_animation import annotations_to_animation
-from app.services.constant import VIDEO_CODEC, VIDEO_FPS, LOCAL_PATH, BACKGROUND_DIR, CHARACTER_DIR, MODEL_SOURCE_DIR, MODEL_RESULT_DIR, DanceName
+from app.services.examples.annotations_to_animation import annotations_to_animation, create_character_cache
+from app.services.animated_drawings.render import RenderWorker
+from app.services.constant import LOCAL_PATH, BACKGROUND_DIR, CHARACTER_DIR, CHARACTER_ANNOTATION_DIR, MODEL_SOURCE_DIR, MODEL_RESULT_DIR, MODEL_CACHE_DIR, MODEL_CHARACTER_CACHE_DIR, MODEL_RENDER_PROCESSES, MODEL_SOFTWARE_RENDERER, DanceName
+
+_render_executor: Optional[ProcessPoolExecutor] = None
+_render_executor_lock = threading.Lock()
+
+# set in each render process by _initialize_render_worker
+_render_worker: Optional[RenderWorker] = None
 
 
 def delete_tmp_source_files(user_uuid: str) -> None:
@@ -24,101 +33,190 @@ def delete_tmp_source_files(user_uuid: str) -> None:
     if os.path.exists(character_img_path):
         os.remove(character_img_path)
 
-def delete_tmp_result_files(user_uuid: str) -> None:
+def delete_tmp_result_files(user_uuid: str, dance_name: Optional[DanceName] = None) -> None:
     """Delete temporary result files for the given user UUID.
 
     Args:
         user_uuid (str): The user UUID for which to delete temporary result files.
+        dance_name (Optional[DanceName]): If given, only the result files of this dance are deleted
+            and the character annotations are kept for the remaining dances.
     """
-    char_anno_dir = os.path.join(MODEL_RESULT_DIR, user_uuid)
-    
-    if os.path.exists(char_anno_dir):
-        shutil.rmtree(char_anno_dir)
+    result_dir = os.path.join(MODEL_RESULT_DIR, user_uuid)
+    if dance_name is not None:
+        result_dir = os.path.join(result_dir, dance_name.value)
 
-def apply_background_image(background_img_path: str, result_character_gif_path: str) -> None:
-    """Apply a background image to the character GIF.
+    if os.path.exists(result_dir):
+        shutil.rmtree(result_dir)
+
+def delete_tmp_cache_files(user_uuid: str) -> None:
+    """Delete the character cache of the given user UUID, which holds copies of the character's mask and texture.
 
     Args:
-        background_img_path (str): Path to the background image.
-        result_character_gif_path (str): Path to the character GIF.
+        user_uuid (str): The user UUID for which to delete the character cache.
     """
-    background = Image.open(background_img_path).convert("RGBA")
-    bg_width, bg_height = background.size
+    character_cache_dir = get_character_cache_dir(user_uuid)
 
-    reader = imageio.get_reader(result_character_gif_path)
-    fps = reader.get_meta_data()['duration']
+    if os.path.exists(character_cache_dir):
+        shutil.rmtree(character_cache_dir)
 
-    frames = []
+def get_character_cache_dir(user_uuid: str) -> str:
+    """Get the directory the character of the given user UUID is preprocessed into, once for all dances.
 
-    for id, frame in enumerate(reader):
-        if id == 0:
-            continue
-        frame_image = Image.fromarray(frame).convert("RGBA")
-        fg_width, fg_height = frame_image.size
-
-        composed = background.copy()
-        paste_x = (bg_width - fg_width) // 2
-        paste_y = (bg_height - fg_height) // 2
-        composed.paste(frame_image, (paste_x, paste_y), frame_image)
-        frames.append(composed)
-
-    frames[0].save(
-        result_character_gif_path,
-        save_all=True,
-        append_images=frames[1:],
-        duration=fps,
-        loop=0
-    )
-
-def image_to_animation(user_uuid: str, dance_name: DanceName) -> tuple[str, str]:
-    """Convert images to animation.
+    Args:
+        user_uuid (str): The user UUID.
+    Returns:
+        str: Path to the user's character cache directory.
+    """
+    return os.path.join(MODEL_CHARACTER_CACHE_DIR, user_uuid)
+
+def create_character_annotations(user_uuid: str) -> str:
+    """Run detection, segmentation and pose estimation on the character image once.
+
+    The resulting char_cfg.yaml, texture.png and mask.png are shared by every dance of the request.
+    The character's mesh and ARAP matrices are also computed once here and cached in the user's character cache directory,
+    so the dances, rendered in parallel, only load them.
 
     Args:
         user_uuid (str): The user UUID.
-        dance_name (DanceName): The name of the dance.
     Returns:
-        tuple[str, str]: Paths to the generated GIF and MP4 files.
+        str: Path to the directory containing the character annotations.
     """
-    background_img_path = os.path.join(MODEL_SOURCE_DIR, BACKGROUND_DIR, f"{user_uuid}.png")
     character_img_path = os.path.join(MODEL_SOURCE_DIR, CHARACTER_DIR, f"{user_uuid}.png")
 
-    if not os.path.exists(background_img_path) or not os.path.exists(character_img_path):
-        error_message = f"One or more source images not found for user_uuid={user_uuid}"
+    if not os.path.exists(character_img_path):
+        error_message = f"Character image not found for user_uuid={user_uuid}"
         raise FileNotFoundError(error_message)
 
-    char_anno_dir = os.path.join(MODEL_RESULT_DIR, user_uuid)
-    motion_cfg_fn = os.path.join(LOCAL_PATH, "examples", "config", "motion", f"{dance_name.value}.yaml")
-    retarget_cfg_fn = os.path.join(LOCAL_PATH, "examples", "config", "retarget", f"{dance_name.value}.yaml")
+    char_anno_dir = os.path.join(MODEL_RESULT_DIR, user_uuid, CHARACTER_ANNOTATION_DIR)
+    os.makedirs(char_anno_dir, exist_ok=True)
 
     try:
         image_to_annotations(img_fn=character_img_path, out_dir=char_anno_dir)
+        create_character_cache(char_anno_dir=char_anno_dir, character_cache_dir=get_character_cache_dir(user_uuid))
     except Exception as e:
         error_message = f"Error occurred while creating annotations - Exception={e}"
         raise Exception(error_message)
-    
-    try:
-        annotations_to_animation(char_anno_dir=char_anno_dir, motion_cfg_fn=motion_cfg_fn, retarget_cfg_fn=retarget_cfg_fn)
-    except Exception as e:
-        error_message = f"Error occurred while creating animations - Exception={e}"
-        raise Exception(error_message)
 
-    try:
-        result_gif_path = os.path.join(MODEL_RESULT_DIR, user_uuid, "video.gif")
-        apply_background_image(background_img_path=background_img_path, result_character_gif_path=result_gif_path)
-    except Exception as e:
-        error_message = f"Error occurred while applying background image - Exception={e}"
-        raise Exception(error_message)
+    return char_anno_dir
+
+def image_to_animation(user_uuid: str, dance_name: DanceName, char_anno_dir: str) -> tuple[str, str]:
+    """Convert images to animation.
+
+    Args:
+        user_uuid (str): The user UUID.
+        dance_name (DanceName): The name of the dance.
+        char_anno_dir (str): Path to the character annotations created by create_character_annotations.
+    Returns:
+        tuple[str, str]: Paths to the generated GIF and MP4 files.
+    """
+    background_img_path = os.path.join(MODEL_SOURCE_DIR, BACKGROUND_DIR, f"{user_uuid}.png")
+
+    if not os.path.exists(background_img_path) or not os.path.exists(os.path.join(char_anno_dir, "char_cfg.yaml")):
+        error_message = f"Background image or character annotations not found for user_uuid={user_uuid}"
+        raise FileNotFoundError(error_message)
+
+    result_dir = os.path.join(MODEL_RESULT_DIR, user_uuid, dance_name.value)
+    motion_cfg_fn = os.path.join(LOCAL_PATH, "examples", "config", "motion", f"{dance_name.value}.yaml")
+    retarget_cfg_fn = os.path.join(LOCAL_PATH, "examples", "config", "retarget", f"{dance_name.value}.yaml")
 
     try:
-        result_mp4_path = os.path.join(MODEL_RESULT_DIR, user_uuid, "video.mp4")
-        clip = VideoFileClip(result_gif_path)
-        clip.write_videofile(result_mp4_path, codec=VIDEO_CODEC, fps=VIDEO_FPS)
+        annotations_to_animation(char_anno_dir=char_anno_dir, motion_cfg_fn=motion_cfg_fn, retarget_cfg_fn=retarget_cfg_fn, output_dir=result_dir,
+                                 render_worker=_render_worker, background_image=background_img_path, mp4=True,
+                                 cache_dir=MODEL_CACHE_DIR, character_cache_dir=get_character_cache_dir(user_uuid), software_renderer=MODEL_SOFTWARE_RENDERER)
     except Exception as e:
-        error_message = f"Error occurred while converting GIF to MP4 - Exception={e}"
+        error_message = f"Error occurred while creating animations - Exception={e}"
         raise Exception(error_message)
 
+    result_gif_path = os.path.join(result_dir, "video.gif")
+    result_mp4_path = os.path.join(result_dir, "video.mp4")
+
     if os.path.exists(result_gif_path) and os.path.exists(result_mp4_path):
         return result_gif_path, result_mp4_path
     else:
         error_message = f"Error occurred - GIF or MP4 file not found for user_uuid={user_uuid}"
         raise Exception(error_message)
+
+def _initialize_render_worker() -> None:
+    """Create the RenderWorker of a render process, reused by every dance rendered in that process."""
+    global _render_worker
+    _render_worker = RenderWorker()
+
+def get_render_executor() -> ProcessPoolExecutor:
+    """Get the process pool shared by every model job to render dances.
+
+    Each worker process keeps its own RenderWorker, so its OSMesa context and shaders are
+    created once and dances render in parallel on MODEL_RENDER_PROCESSES cores. Workers are
+    spawned rather than forked because the pool is created from a model job thread.
+
+    Returns:
+        ProcessPoolExecutor: The render process pool.
+    """
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            _render_executor = ProcessPoolExecutor(
+                max_workers=MODEL_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialize_render_worker,
+            )
+        return _render_executor
+
+def _discard_render_executor(executor: ProcessPoolExecutor) -> None:
+    """Drop a broken render process pool so the next get_render_executor creates a new one.
+
+    A pool is broken for good once one of its workers dies (e.g. a crash in OSMesa).
+
+    Args:
+        executor (ProcessPoolExecutor): The broken pool. Nothing is done if it was already replaced.
+    """
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is not executor:
+            return
+        _render_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_render_executor() -> None:
+    """Shut down the render process pool if it was started."""
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is not None:
+            _render_executor.shutdown(wait=True, cancel_futures=True)
+            _render_executor = None
+
+def submit_dance_animations(user_uuid: str, char_anno_dir: str) -> Dict[Future, DanceName]:
+    """Fan out image_to_animation of every dance to the render process pool.
+
+    Every dance reuses the character annotations in char_anno_dir and writes to its own result directory.
+
+    Args:
+        user_uuid (str): The user UUID.
+        char_anno_dir (str): Path to the character annotations created by create_character_annotations.
+    Returns:
+        Dict[Future, DanceName]: The future of each dance, resolving to the paths of its GIF and MP4 files.
+    """
+    for attempt in range(2):
+        executor = get_render_executor()
+        futures = {}
+        try:
+            for dance_name in DanceName:
+                futures[executor.submit(image_to_animation, user_uuid=user_uuid, dance_name=dance_name, char_anno_dir=char_anno_dir)] = dance_name
+        except BrokenProcessPool:
+            # a worker of an earlier job crashed. Replace the pool and submit again, once.
+            # the dances already submitted to the broken pool must not keep using this job's files
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            _discard_render_executor(executor)
+            if attempt == 1:
+                raise
+            continue
+
+        # if a worker crashes while rendering this job, its dances fail and the pool is replaced for the next job
+        for future in futures:
+            future.add_done_callback(lambda future, executor=executor: _discard_render_executor_if_broken(future, executor))
+        return futures
+
+def _discard_render_executor_if_broken(future: Future, executor: ProcessPoolExecutor) -> None:
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _discard_render_executor(executor)
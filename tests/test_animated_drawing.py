@@ -0,0 +1,81 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from app.services.animated_drawings.config import CharacterConfig, RetargetConfig, MotionConfig
+from app.services.animated_drawings.model.animated_drawing import AnimatedDrawing
+from collections import defaultdict
+from pathlib import Path
+from typing import DefaultDict, Dict, List, Tuple
+import copy
+import heapq
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+EXAMPLES_DIR = Path(__file__).parents[1] / 'app' / 'services' / 'examples'
+
+
+def _joint_to_triangles_by_heap(ad: AnimatedDrawing) -> Dict[str, npt.NDArray[np.int32]]:
+    """ Reference copy of the original joint to triangle assignment, popping one search step at a time from a heap. """
+    shortest_distance = np.full(ad.mask.shape, 1 << 12, dtype=np.int32)
+    closest_joint_idx = np.full(ad.mask.shape, -1, dtype=np.int8)
+
+    joints_d = {joint['name']: joint for joint in copy.deepcopy(ad.char_cfg.skeleton)}
+    for joint in joints_d.values():
+        joint['loc'][1] = 1 - joint['loc'][1]
+
+    joint_name_to_idx: List[str] = [joint['name'] for joint in ad.char_cfg.skeleton]
+
+    heap: List[Tuple[float, Tuple[int, Tuple[int, int]]]] = []
+    for joint in joints_d.values():
+        if joint['parent'] is None:
+            continue
+        joint_idx = joint_name_to_idx.index(joint['name'])
+        seeds_xy = (ad.img_dim * np.linspace(joint['loc'], joints_d[joint['parent']]['loc'], num=20, endpoint=False)).round()
+        heap.extend([(0, (joint_idx, tuple(seed_xy.astype(np.int32)))) for seed_xy in seeds_xy])
+
+    while heap:
+        distance, (joint_idx, (x, y)) = heapq.heappop(heap)
+        neighbors = [(x-1, y-1), (x, y-1), (x+1, y-1), (x-1, y), (x+1, y), (x-1, y+1), (x, y+1), (x+1, y+1)]
+        n_dists = [1.414, 1.0, 1.414, 1.0, 1.0, 1.414, 1.0, 1.414]
+        for (n_x, n_y), n_dist in zip(neighbors, n_dists):
+            n_distance = distance + n_dist
+            if not 0 <= n_x < ad.img_dim or not 0 <= n_y < ad.img_dim:
+                continue
+            if not ad.mask[n_x, n_y]:
+                continue
+            if shortest_distance[n_x, n_y] <= n_distance:
+                continue
+            closest_joint_idx[n_x, n_y] = joint_idx
+            shortest_distance[n_x, n_y] = n_distance
+            heapq.heappush(heap, (n_distance, (joint_idx, (n_x, n_y))))
+
+    joint_to_tri_v_idx_and_dist: DefaultDict[str, List[Tuple[npt.NDArray[np.int32], np.int32]]] = defaultdict(list)
+    for tri_v_idx in ad.mesh['triangles']:
+        tri_verts = np.array([ad.mesh['vertices'][v_idx] for v_idx in tri_v_idx])
+        centroid_x, centroid_y = list((tri_verts.mean(axis=0) * ad.img_dim).round().astype(np.int32))
+        joint_to_tri_v_idx_and_dist[joint_name_to_idx[closest_joint_idx[centroid_x, centroid_y]]].append((tri_v_idx, shortest_distance[centroid_x, centroid_y]))
+
+    joint_to_tri_v_idx: Dict[str, npt.NDArray[np.int32]] = {}
+    for key, val in joint_to_tri_v_idx_and_dist.items():
+        val.sort(key=lambda x: float(x[1]), reverse=True)
+        joint_to_tri_v_idx[key] = np.array([v[0] for v in val]).flatten()
+    return joint_to_tri_v_idx
+
+
+@pytest.mark.parametrize('char_name,motion_name', [('char1', 'groove'), ('char2', 'groove'), ('char3', 'anxiety'), ('char4', 'bumblebee')])
+def test_joint_to_triangles_matches_heap_search(char_name, motion_name):
+    char_cfg = CharacterConfig(str(EXAMPLES_DIR / 'characters' / char_name / 'char_cfg.yaml'))
+    retarget_cfg = RetargetConfig(str(EXAMPLES_DIR / 'config' / 'retarget' / f'{motion_name}.yaml'))
+    motion_cfg = MotionConfig(str(EXAMPLES_DIR / 'config' / 'motion' / f'{motion_name}.yaml'))
+    skeleton = copy.deepcopy(char_cfg.skeleton)
+
+    ad = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg)
+
+    assert ad.char_cfg.skeleton == skeleton  # the character config is left unchanged
+
+    expected = _joint_to_triangles_by_heap(ad)
+    assert list(ad.joint_to_tri_v_idx.keys()) == list(expected.keys())
+    for joint_name, tri_v_idxs in expected.items():
+        assert np.array_equal(ad.joint_to_tri_v_idx[joint_name], tri_v_idxs), joint_name
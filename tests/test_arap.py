@@ -0,0 +1,94 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from app.services.animated_drawings.config import CharacterConfig, RetargetConfig, MotionConfig
+from app.services.animated_drawings.model.animated_drawing import AnimatedDrawing
+from app.services.animated_drawings.model.arap import ARAP
+from pathlib import Path
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+EXAMPLES_DIR = Path(__file__).parents[1] / 'app' / 'services' / 'examples'
+
+
+def _create_animated_drawing(precompute_arap: bool = False) -> AnimatedDrawing:
+    char_cfg = CharacterConfig(str(EXAMPLES_DIR / 'characters' / 'char1' / 'char_cfg.yaml'))
+    retarget_cfg = RetargetConfig(str(EXAMPLES_DIR / 'config' / 'retarget' / 'groove.yaml'))
+    motion_cfg = MotionConfig(str(EXAMPLES_DIR / 'config' / 'motion' / 'groove.yaml'))
+    return AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg, precompute_arap=precompute_arap)
+
+
+def _get_control_points(ad: AnimatedDrawing) -> npt.NDArray[np.float32]:
+    """ The pin positions update() passes to ARAP.solve, for every frame of the motion. """
+    control_points = []
+    solve = ad.arap.solve
+
+    def record_solve(pins_xy: npt.NDArray[np.float32]) -> npt.NDArray[np.float64]:
+        control_points.append(np.copy(pins_xy))
+        return solve(pins_xy)
+
+    ad.arap.solve = record_solve  # type: ignore
+    try:
+        for frame_idx in range(ad.retargeter.frame_max_num):
+            ad.set_time(frame_idx * ad.retargeter.frame_time)
+            ad.update()
+    finally:
+        del ad.arap.solve
+    return np.array(control_points, dtype=np.float32)
+
+
+def _solve_per_edge(arap: ARAP, pins_xy_: npt.NDArray[np.float32]) -> npt.NDArray[np.float64]:
+    """ Reference solve of a single frame, rotating the edges one at a time as ARAP.solve originally did. """
+    pins_xy = pins_xy_[arap.pin_mask]
+
+    b1 = np.hstack([np.zeros([2 * arap.edge_num], dtype=np.float64), arap.w * pins_xy.reshape([-1, ])])
+    v1 = arap.tA1xA1_lu.solve(arap.tA1 @ b1.T)
+
+    T1 = arap.G @ v1
+    b2_top = np.empty([arap.edge_num, 2], dtype=np.float64)
+    for idx, e0 in enumerate(arap.edge_vectors):
+        c = T1[2*idx]
+        s = T1[2*idx + 1]
+        scale = 1.0 / np.sqrt(c * c + s * s)
+        T2 = np.asarray(((c * scale, s * scale), (-s * scale, c * scale)))
+        b2_top[idx] = np.dot(T2, e0)
+    b2 = np.vstack([b2_top, arap.w * pins_xy])
+
+    return arap.tA2xA2_lu.solve(arap.tA2 @ b2)
+
+
+@pytest.fixture(scope='module')
+def animated_drawing() -> AnimatedDrawing:
+    return _create_animated_drawing()
+
+
+def test_solve_matches_per_edge_solve(animated_drawing):
+    control_points = _get_control_points(animated_drawing)
+    assert len(control_points) == animated_drawing.retargeter.frame_max_num
+
+    for pins_xy in control_points:
+        assert np.allclose(animated_drawing.arap.solve(pins_xy), _solve_per_edge(animated_drawing.arap, pins_xy))
+
+
+def test_solve_batch_matches_solve(animated_drawing):
+    control_points = _get_control_points(animated_drawing)
+
+    batch_vertices = animated_drawing.arap.solve_batch(control_points)
+
+    assert batch_vertices.shape == (len(control_points), len(animated_drawing.vertices), 2)
+    for frame_vertices, pins_xy in zip(batch_vertices, control_points):
+        assert np.allclose(frame_vertices, animated_drawing.arap.solve(pins_xy))
+
+
+def test_precomputed_vertices_match_update(animated_drawing):
+    precomputed_ad = _create_animated_drawing(precompute_arap=True)
+    assert precomputed_ad.vertex_trajectory is not None
+
+    for frame_idx in range(0, animated_drawing.retargeter.frame_max_num, 10):
+        t = frame_idx * animated_drawing.retargeter.frame_time
+        for ad in [animated_drawing, precomputed_ad]:
+            ad.set_time(t)
+            ad.update()
+        assert np.allclose(precomputed_ad.vertices[:, :2], animated_drawing.vertices[:, :2], atol=1e-4)